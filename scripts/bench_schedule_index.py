@@ -0,0 +1,73 @@
+import sys
+import os
+import argparse
+import random
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.knowledge_manager import KnowledgeManager
+from src.models import Activity, Therapy
+
+DAYS = ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"]
+
+
+def _random_activity(rng: random.Random, idx: int) -> Activity:
+    start = rng.randrange(0, 24 * 60 - 60)
+    return Activity(
+        activity_id=f"bench_{idx}",
+        name=f"Attività {idx}",
+        description="benchmark",
+        day_of_week=rng.sample(DAYS, rng.randint(1, 3)),
+        time=f"{start // 60:02d}:{start % 60:02d}",
+        duration_minutes=rng.choice([5, 10, 15, 30, 45, 60]),
+    )
+
+
+def _linear_conflicts(km: KnowledgeManager, new_activity: Activity) -> int:
+    # Implementazione precedente: scansione completa con parsing degli orari a ogni chiamata
+    new_start, new_end = km._get_time_interval(new_activity.time, new_activity.duration_minutes)
+    found = 0
+    for existing in km.therapy.activities:
+        if set(new_activity.day_of_week) & set(existing.day_of_week):
+            ex_start, ex_end = km._get_time_interval(existing.time, existing.duration_minutes)
+            if new_start < ex_end and new_end > ex_start:
+                found += 1
+    return found
+
+
+def run(sizes, queries: int, seed: int) -> None:
+    print(f"{'attività':>10} {'build (ms)':>12} {'index (µs/q)':>14} {'lineare (µs/q)':>16} {'speedup':>9}")
+    for size in sizes:
+        rng = random.Random(seed)
+        km = KnowledgeManager()
+        km.therapy = Therapy(patient_id="bench", activities=[_random_activity(rng, i) for i in range(size)])
+        probes = [_random_activity(rng, size + i) for i in range(queries)]
+
+        t0 = time.perf_counter()
+        km._schedule_index()
+        build_ms = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        indexed = [len(km.check_temporal_conflict(p)) for p in probes]
+        index_us = (time.perf_counter() - t0) / queries * 1e6
+
+        t0 = time.perf_counter()
+        linear = [_linear_conflicts(km, p) for p in probes]
+        linear_us = (time.perf_counter() - t0) / queries * 1e6
+
+        assert indexed == linear, "L'indice non coincide con la scansione lineare"
+        print(f"{size:>10} {build_ms:>12.1f} {index_us:>14.1f} {linear_us:>16.1f} {linear_us / index_us:>8.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark check_temporal_conflict: indice per giorno vs scansione lineare")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    run(args.sizes, args.queries, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,9 +10,10 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from llama_index.llms.ollama import Ollama
 from llama_index.core import Settings
-from llama_index.embeddings.ollama import OllamaEmbedding
+from src.embeddings import get_embed_model
 
 # Import logic from main application
+from src import journal
 from src.main import run_agent_step, session, HISTORY_FILE, km
 
 # --- DEFINIZIONE SCENARI DI TEST ---
@@ -267,14 +268,14 @@ async def main():
     Path("data/patients").mkdir(parents=True, exist_ok=True)
     Path("data/caregivers").mkdir(parents=True, exist_ok=True)
     Path("data/therapies").mkdir(parents=True, exist_ok=True)
-    (Path("data/patients") / "TestAuto1.json").write_text(
-        '{"patient_id": "TestAuto1", "name": "TestAuto1", "medical_conditions": [], "preferences": [], "habits": [], "notes": []}', encoding="utf-8"
+    journal.write_snapshot(Path("data/patients") / "TestAuto1.json",
+        '{"patient_id": "TestAuto1", "name": "TestAuto1", "medical_conditions": [], "preferences": [], "habits": [], "notes": []}',
     )
-    (Path("data/caregivers") / "CaregiverTest.json").write_text(
-        '{"caregiver_id": "CaregiverTest", "name": "Caregiver Test", "notes": [], "semantic_preferences": []}', encoding="utf-8"
+    journal.write_snapshot(Path("data/caregivers") / "CaregiverTest.json",
+        '{"caregiver_id": "CaregiverTest", "name": "Caregiver Test", "notes": [], "semantic_preferences": []}',
     )
     # Reset therapy to empty
-    (Path("data/therapies") / "TestAuto1.json").write_text('[]', encoding="utf-8")
+    journal.write_snapshot(Path("data/therapies") / "TestAuto1.json", '[]')
     
     # -----------------------------------------
 
@@ -290,7 +291,7 @@ async def main():
     )
     
     Settings.llm = llm
-    Settings.embed_model = OllamaEmbedding(model_name="nomic-embed-text")
+    Settings.embed_model = get_embed_model()
     
     # Dizionario LLM (possiamo usare lo stesso per Fast e Smart nel test automatizzato per semplicità,
     # oppure puoi passare argomenti diversi)
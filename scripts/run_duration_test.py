@@ -9,8 +9,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from llama_index.llms.ollama import Ollama
 from llama_index.core import Settings
-from llama_index.embeddings.ollama import OllamaEmbedding
+from src.embeddings import get_embed_model
 
+from src import journal
 from src.main import run_agent_step, session, reset_rag_index
 from src.ingest_data import ingest_data
 
@@ -31,15 +32,13 @@ def _seed_data() -> None:
     Path("data/caregivers").mkdir(parents=True, exist_ok=True)
     Path("data/therapies").mkdir(parents=True, exist_ok=True)
 
-    (Path("data/patients") / "TestAuto1.json").write_text(
+    journal.write_snapshot(Path("data/patients") / "TestAuto1.json",
         '{"patient_id": "TestAuto1", "name": "TestAuto1", "medical_conditions": [], "preferences": [], "habits": [], "notes": []}',
-        encoding="utf-8",
     )
-    (Path("data/caregivers") / "Andrea.json").write_text(
+    journal.write_snapshot(Path("data/caregivers") / "Andrea.json",
         '{"caregiver_id": "Andrea", "name": "Andrea", "notes": [], "semantic_preferences": []}',
-        encoding="utf-8",
     )
-    (Path("data/therapies") / "TestAuto1.json").write_text('[]', encoding="utf-8")
+    journal.write_snapshot(Path("data/therapies") / "TestAuto1.json", '[]')
 
 
 async def main() -> None:
@@ -68,7 +67,7 @@ async def main() -> None:
         additional_kwargs={"stop": ["Utente:", "\nUtente", "Caregiver:", "\nCaregiver"]},
     )
     Settings.llm = llm
-    Settings.embed_model = OllamaEmbedding(model_name="nomic-embed-text")
+    Settings.embed_model = get_embed_model()
     llms = {"FAST": llm, "SMART": llm}
 
     for user_input in SCENARIO:
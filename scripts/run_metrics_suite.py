@@ -12,8 +12,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from llama_index.llms.ollama import Ollama
 from llama_index.core import Settings
-from llama_index.embeddings.ollama import OllamaEmbedding
+from src.embeddings import get_embed_model
 
+from src import journal
 from src.main import run_agent_step, session, reset_rag_index
 from src.ingest_data import ingest_data
 
@@ -24,7 +25,7 @@ def _write_seed_data() -> None:
     Path("data/caregivers").mkdir(parents=True, exist_ok=True)
     Path("data/therapies").mkdir(parents=True, exist_ok=True)
 
-    (Path("data/patients") / "mario_rossi.json").write_text(
+    journal.write_snapshot(Path("data/patients") / "mario_rossi.json",
         '{\n'
         '  "patient_id": "mario_rossi",\n'
         '  "name": "Mario Rossi",\n'
@@ -35,10 +36,9 @@ def _write_seed_data() -> None:
         '    {"content": "Evitare zuccheri semplici", "day": null, "created_at": "2026-01-14T10:00:00"}\n'
         '  ]\n'
         '}\n',
-        encoding="utf-8",
     )
 
-    (Path("data/patients") / "paolo_verdi.json").write_text(
+    journal.write_snapshot(Path("data/patients") / "paolo_verdi.json",
         '{\n'
         '  "patient_id": "paolo_verdi",\n'
         '  "name": "Paolo Verdi",\n'
@@ -49,10 +49,9 @@ def _write_seed_data() -> None:
         '    {"content": "Evitare sforzi intensi nelle prime ore del mattino", "day": null, "created_at": "2026-01-14T10:05:00"}\n'
         '  ]\n'
         '}\n',
-        encoding="utf-8",
     )
 
-    (Path("data/caregivers") / "andrea_bianchi.json").write_text(
+    journal.write_snapshot(Path("data/caregivers") / "andrea_bianchi.json",
         '{\n'
         '  "caregiver_id": "andrea_bianchi",\n'
         '  "name": "Andrea Bianchi",\n'
@@ -62,10 +61,9 @@ def _write_seed_data() -> None:
         '    {"content": "Preferisce istruzioni concise", "day": null, "created_at": "2026-01-14T10:10:00"}\n'
         '  ]\n'
         '}\n',
-        encoding="utf-8",
     )
 
-    (Path("data/caregivers") / "maria_rossi.json").write_text(
+    journal.write_snapshot(Path("data/caregivers") / "maria_rossi.json",
         '{\n'
         '  "caregiver_id": "maria_rossi",\n'
         '  "name": "Maria Rossi",\n'
@@ -75,10 +73,9 @@ def _write_seed_data() -> None:
         '    {"content": "Preferisce dettaglio sugli orari", "day": null, "created_at": "2026-01-14T10:12:00"}\n'
         '  ]\n'
         '}\n',
-        encoding="utf-8",
     )
 
-    (Path("data/therapies") / "mario_rossi.json").write_text(
+    journal.write_snapshot(Path("data/therapies") / "mario_rossi.json",
         '{\n'
         '  "patient_id": "mario_rossi",\n'
         '  "activities": [\n'
@@ -87,10 +84,9 @@ def _write_seed_data() -> None:
         '    {"activity_id": "mr_003", "name": "Camminata mattutina", "description": "Passeggiata di 20 minuti", "day_of_week": ["Martedì", "Giovedì"], "time": "09:30", "dependencies": []}\n'
         '  ]\n'
         '}\n',
-        encoding="utf-8",
     )
 
-    (Path("data/therapies") / "paolo_verdi.json").write_text(
+    journal.write_snapshot(Path("data/therapies") / "paolo_verdi.json",
         '{\n'
         '  "patient_id": "paolo_verdi",\n'
         '  "activities": [\n'
@@ -98,7 +94,6 @@ def _write_seed_data() -> None:
         '    {"activity_id": "pv_002", "name": "Terapia calda", "description": "Applicazione impacchi caldi", "day_of_week": ["Martedì", "Venerdì"], "time": "16:00", "dependencies": []}\n'
         '  ]\n'
         '}\n',
-        encoding="utf-8",
     )
 
 
@@ -716,7 +711,7 @@ async def run_model(model, temperature, output_dir, reingest, runs, repeat_scena
                 additional_kwargs={"stop": ["Utente:", "\nUtente", "Caregiver:", "\nCaregiver"]},
             )
             Settings.llm = llm
-            Settings.embed_model = OllamaEmbedding(model_name="nomic-embed-text")
+            Settings.embed_model = get_embed_model()
             llms = {"FAST": llm, "SMART": llm}
 
             for repeat_idx in range(1, repeat_scenarios + 1):
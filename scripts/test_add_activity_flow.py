@@ -6,6 +6,7 @@ from pathlib import Path
 # Add project root
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from src import journal
 from src.knowledge_manager import KnowledgeManager
 from src.models import Activity
 
@@ -17,10 +18,10 @@ def test_full_add_flow():
     cid = "test_add_caregiver"
     
     # File JSON di partenza vuoti/base
-    (Path("data/patients") / f"{pid}.json").write_text(json.dumps({"patient_id": pid, "name": "Test Patient", "medical_conditions": [], "preferences": [], "habits": [], "notes": []}))
-    (Path("data/caregivers") / f"{cid}.json").write_text(json.dumps({"caregiver_id": cid, "name": "Test Caregiver", "notes": []}))
+    journal.write_snapshot(Path("data/patients") / f"{pid}.json", json.dumps({"patient_id": pid, "name": "Test Patient", "medical_conditions": [], "preferences": [], "habits": [], "notes": []}))
+    journal.write_snapshot(Path("data/caregivers") / f"{cid}.json", json.dumps({"caregiver_id": cid, "name": "Test Caregiver", "notes": []}))
     # Terapia vuota
-    (Path("data/therapies") / f"{pid}.json").write_text(json.dumps([])) # Lista vuota o oggetto vuoto
+    journal.write_snapshot(Path("data/therapies") / f"{pid}.json", json.dumps([])) # Lista vuota o oggetto vuoto
 
     km = KnowledgeManager()
     km.set_context(pid, cid)
@@ -52,7 +53,8 @@ def test_full_add_flow():
 
     # 4. Verifica su Disco (JSON)
     print("4. Verifica su Disco (JSON)...")
-    file_content = (Path("data/therapies") / f"{pid}.json").read_text()
+    # Snapshot + journal: le modifiche recenti sono ancora nel journal
+    file_content = json.dumps(journal.load_json(Path("data/therapies") / f"{pid}.json"), ensure_ascii=False)
     if "Fisioterapia" in file_content and "15:00" in file_content:
         print("   ✅ FILE AGGIORNATO CORRETTAMENTE")
     else:
@@ -72,6 +74,7 @@ def test_full_add_flow():
         (Path("data/patients") / f"{pid}.json").unlink()
         (Path("data/caregivers") / f"{cid}.json").unlink()
         (Path("data/therapies") / f"{pid}.json").unlink()
+        journal.journal_path(Path("data/therapies") / f"{pid}.json").unlink(missing_ok=True)
     except: pass
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@
 import sys
 import os
 import asyncio
+import json
 from pathlib import Path
 
 # Skip when collected by pytest; this is an integration script.
@@ -17,10 +18,11 @@ if __name__ != "__main__":
 sys.path.append(os.getcwd())
 
 # Importiamo le funzioni del bot
+from src import journal
 from src.main import run_agent_step, PENDING_ACTION, km, session, MODEL_FAST, MODEL_SMART
 from llama_index.llms.ollama import Ollama
 from llama_index.core import Settings
-from llama_index.embeddings.ollama import OllamaEmbedding
+from src.embeddings import get_embed_model
 
 # Configurazione manuale identica al main
 def setup():
@@ -40,7 +42,7 @@ def setup():
         ollama_additional_kwargs={"keep_alive": "60m", "num_predict": 100}
     )
     Settings.llm = llm_smart
-    Settings.embed_model = OllamaEmbedding(model_name="nomic-embed-text")
+    Settings.embed_model = get_embed_model()
     return {"FAST": llm_fast, "SMART": llm_smart}
 
 async def test_flow():
@@ -96,7 +98,8 @@ async def test_flow():
         print("❌ FILE PAZIENTE NON TROVATO.")
         return
         
-    content = target_file.read_text()
+    # Snapshot + journal: le modifiche recenti sono ancora nel journal
+    content = json.dumps(journal.load_json(target_file), ensure_ascii=False)
     if "TestAutomato" in content:
         print("🎉 VITTORIA: 'TestAutomato' TROVATO NEL FILE JSON!")
     else:
@@ -5,11 +5,10 @@ import logging
 from pathlib import Path
 import pandas as pd
 from llama_index.core import VectorStoreIndex, Settings
-from llama_index.core.tools import FunctionTool, QueryEngineTool, ToolMetadata
+from llama_index.core.tools import FunctionTool
 from llama_index.core.agent import ReActAgent
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.llms.ollama import Ollama
-from llama_index.embeddings.ollama import OllamaEmbedding
 import chromadb
 
 # Ensure project root is on sys.path when running via `streamlit run src/app.py`
@@ -19,7 +18,11 @@ if str(ROOT_DIR) not in sys.path:
 
 # Importiamo la logica di business
 from src.knowledge_manager import KnowledgeManager
+from src.rag_sync import STALE_FILENAME, RagSync
+from src.ingest_data import context_filters
 from src.models import Activity
+from src.weekdays import day_key
+from src.embeddings import get_embed_model
 from src.logging_utils import setup_logger
 
 # --- CONFIGURAZIONE PAGINA ---
@@ -34,8 +37,34 @@ MODEL_NAME = "kmchat-14b"
 DB_DIR = "data"
 logger = setup_logger("app", "app")
 
+@st.cache_resource
+def get_rag_store():
+    """(indice, collezione) Chroma condivisi da agente e sincronizzazione RAG; None se il DB non esiste."""
+    db_path = Path(DB_DIR) / "chroma_db"
+    if not db_path.exists():
+        return None
+    Settings.embed_model = get_embed_model()
+    db_client = chromadb.PersistentClient(path=str(db_path))
+    chroma_collection = db_client.get_collection("patient_therapies")
+    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    return VectorStoreIndex.from_vector_store(vector_store), chroma_collection
+
+def _require_rag_store():
+    store = get_rag_store()
+    if store is None:
+        raise RuntimeError("DB vettoriale non trovato")
+    return store
+
 if "km" not in st.session_state:
     st.session_state.km = KnowledgeManager(auto_discover=False)
+    # Le attività aggiunte dalla UI aggiornano anche i vettori RAG (vedi rag_sync)
+    st.session_state.rag_sync = RagSync(
+        lambda: _require_rag_store()[0],
+        lambda: _require_rag_store()[1],
+        lambda patient_id: st.session_state.km.storage.read("therapy", patient_id),
+        stale_path=Path(DB_DIR) / "chroma_db" / STALE_FILENAME,
+    )
+    st.session_state.km.add_change_listener(st.session_state.rag_sync)
 
 if "messages" not in st.session_state:
     st.session_state.messages = [
@@ -72,8 +101,8 @@ def add_activity_tool(
                 },
             }
             return "Azione in sospeso. Scrivi 'conferma' per applicare o 'annulla' per annullare."
-        import time as t_lib
-        act_id = f"act_{int(t_lib.time())}"
+        import uuid
+        act_id = f"act_{uuid.uuid4().hex[:12]}"
         if isinstance(time, str) and "-" in time:
             parts = [p.strip() for p in time.split("-", 1)]
             if len(parts) == 2:
@@ -89,13 +118,18 @@ def add_activity_tool(
                     pass
         new_activity = Activity(
             activity_id=act_id, name=name, description=description,
-            day_of_week=days, time=time, duration_minutes=duration_minutes, dependencies=[]
+            day_of_week=list(dict.fromkeys(map(day_key, days))), time=time, duration_minutes=duration_minutes, dependencies=[]
         )
         result = st.session_state.km.add_activity(new_activity)
         return result
     except Exception as e:
         return f"Errore: {str(e)}"
 
+def _therapy_table(week) -> pd.DataFrame:
+    # La vista è già ordinata per giorno e orario
+    data = [{"Giorno": day, "Orario": act.time, "Attività": act.name} for day, activities in week.items() for act in activities]
+    return pd.DataFrame(data, columns=["Giorno", "Orario", "Attività"])
+
 def get_schedule_tool(day: str) -> str:
     """Restituisce le attività per un giorno specifico."""
     if not st.session_state.km.current_patient_id:
@@ -141,26 +175,26 @@ def get_agent():
     # 1. LLM
     llm = Ollama(model=MODEL_NAME, request_timeout=120.0)
     Settings.llm = llm
-    Settings.embed_model = OllamaEmbedding(model_name="nomic-embed-text")
+    Settings.embed_model = get_embed_model()
 
     # 2. RAG Tool
-    db_path = Path(DB_DIR) / "chroma_db"
-    if not db_path.exists():
-        logger.error("DB vettoriale non trovato a %s", db_path)
+    store = get_rag_store()
+    if store is None:
+        logger.error("DB vettoriale non trovato a %s", Path(DB_DIR) / "chroma_db")
         return None # Gestito nella UI
-
-    db_client = chromadb.PersistentClient(path=str(db_path))
-    chroma_collection = db_client.get_collection("patient_therapies")
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    index = VectorStoreIndex.from_vector_store(vector_store)
+    index, _ = store
     
-    rag_engine = index.as_query_engine(similarity_top_k=3)
-    rag_tool = QueryEngineTool(
-        query_engine=rag_engine,
-        metadata=ToolMetadata(
-            name="consult_guidelines",
-            description="Cerca linee guida mediche e info storiche nel database."
-        )
+    def consult_guidelines(query: str) -> str:
+        # Il contesto può cambiare dalla sidebar: il filtro sui metadati è calcolato a ogni ricerca.
+        # Linee guida (type == guideline) oppure documenti del paziente/caregiver attivi.
+        km = st.session_state.km
+        filters = context_filters(km.current_patient_id, km.current_caregiver_id, include_guidelines=True)
+        return str(index.as_query_engine(similarity_top_k=3, filters=filters).query(query))
+
+    rag_tool = FunctionTool.from_defaults(
+        fn=consult_guidelines,
+        name="consult_guidelines",
+        description="Cerca linee guida mediche e info storiche nel database (paziente e caregiver attivi).",
     )
 
     # 3. Logic Tools
@@ -235,6 +269,8 @@ with st.sidebar:
             st.warning("Seleziona paziente e caregiver prima di continuare.")
         else:
             st.session_state.km.set_context(selected_patient, selected_caregiver)
+            if get_rag_store() is not None:
+                st.session_state.rag_sync.reconcile_stale([selected_patient])
             st.rerun()
     
     # Ricarica dati aggiornati
@@ -243,23 +279,9 @@ with st.sidebar:
     therapy = st.session_state.km.therapy
     
     if therapy and therapy.activities:
-        # Creiamo un DataFrame per visualizzare bene la tabella
-        data = []
-        for act in therapy.activities:
-            for day in act.day_of_week:
-                data.append({
-                    "Giorno": day,
-                    "Orario": act.time,
-                    "Attività": act.name
-                })
-        
-        df = pd.DataFrame(data)
-        # Ordiniamo per giorno (approssimativo) e orario
-        days_order = ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"]
-        df['Giorno'] = pd.Categorical(df['Giorno'], categories=days_order, ordered=True)
-        df = df.sort_values(['Giorno', 'Orario'])
-        
-        st.dataframe(df, hide_index=True, width="stretch")
+        # La tabella viene ricostruita solo se la vista settimanale del KnowledgeManager è cambiata
+        table = st.session_state.km.week_view("therapy_table", _therapy_table)
+        st.dataframe(table, hide_index=True, width="stretch")
     else:
         st.info("Nessuna terapia caricata.")
         
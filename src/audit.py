@@ -0,0 +1,156 @@
+"""
+Audit dei conflitti su tutte le terapie dello storage configurato (default_storage: file JSON
+in DATA_DIR o database SQLite).
+
+I controlli di KnowledgeManager valgono solo per la singola modifica: i dati inseriti con
+force=True o modificati a mano possono contenere sovrapposizioni e dipendenze rotte.
+Per ogni terapia l'audit esegue una sweep-line per giorno della settimana (O(n log n))
+e una visita topologica delle dipendenze; i pazienti sono elaborati in parallelo.
+
+    python -m src.audit --data-dir data --output audit.json
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from src.knowledge_manager import default_storage
+from src.models import Activity
+from src.schedule_index import ScheduleIndex, overlapping_pairs, time_interval
+from src.weekdays import day_key
+
+
+def _describe(activity: Activity) -> Dict:
+    return {"activity_id": activity.activity_id, "name": activity.name, "time": activity.time}
+
+
+def audit_activities(activities: List[Activity]) -> Dict[str, List]:
+    """Sovrapposizioni, dipendenze mancanti, sequenze errate e cicli di una lista di attività."""
+    intervals = []
+    for activity in activities:
+        try:
+            start, end = time_interval(activity.time, activity.duration_minutes)
+        except Exception:
+            start = end = None
+        days = [day_key(day) for day in activity.day_of_week]
+        intervals.append((start, end, days))
+
+    overlaps = []
+    for second, earlier in sorted(overlapping_pairs(intervals).items()):
+        for first, days in sorted(earlier.items()):
+            overlaps.append({
+                "days": sorted(days),
+                "first": _describe(activities[first]),
+                "second": _describe(activities[second]),
+            })
+
+    report = ScheduleIndex(activities).dependency_report()
+    return {
+        "overlaps": overlaps,
+        "missing_dependencies": [
+            {"activity": name, "day": day, "dependency": dep} for (name, day), dep in report.missing
+        ],
+        "order_violations": [
+            {"activity": name, "day": day, "dependency": dep} for (name, day), (dep, _) in report.misordered
+        ],
+        "cycles": [{"activity": name, "day": day} for name, day in report.cyclic],
+    }
+
+
+def _source(storage, key: str) -> str:
+    path_for = getattr(storage, "path_for", None)
+    return str(path_for("therapy", key)) if path_for else f"{storage.db_path}#{key}"
+
+
+def audit_therapy(storage, key: str) -> Dict:
+    """Audit della terapia `key` letta dallo storage (snapshot e modifiche non compattate)."""
+    result = {"patient_id": key, "source": _source(storage, key), "errors": []}
+    try:
+        data = storage.read("therapy", key)
+    except Exception as e:
+        result["errors"].append(f"JSON non valido: {e}")
+        return result
+    if isinstance(data, dict):
+        result["patient_id"] = str(data.get("patient_id") or key)
+        raw_activities = data.get("activities") or []
+    else:
+        raw_activities = data or []
+    activities = []
+    for pos, raw in enumerate(raw_activities):
+        try:
+            activities.append(Activity(**raw))
+        except Exception as e:
+            result["errors"].append(f"Attività #{pos + 1} non valida: {e}")
+    result.update(audit_activities(activities))
+    return result
+
+
+def _issue_count(result: Dict) -> int:
+    keys = ("errors", "overlaps", "missing_dependencies", "order_violations", "cycles")
+    return sum(len(result.get(key, ())) for key in keys)
+
+
+# Storage dei processi del pool (una connessione/indice per processo)
+_worker_storage = None
+
+
+def _init_worker(data_dir: Path) -> None:
+    global _worker_storage
+    _worker_storage = default_storage(data_dir)
+
+
+def _audit_in_worker(key: str) -> Dict:
+    return audit_therapy(_worker_storage, key)
+
+
+def run_audit(data_dir: Path, workers: Optional[int] = None) -> Dict:
+    storage = default_storage(Path(data_dir))
+    try:
+        keys = storage.list_ids("therapy")
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(keys) < 2:
+            results = [audit_therapy(storage, key) for key in keys]
+        else:
+            chunksize = max(1, len(keys) // (workers * 8))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(Path(data_dir),)) as pool:
+                results = list(pool.map(_audit_in_worker, keys, chunksize=chunksize))
+    finally:
+        storage.close()
+    with_issues = [r for r in results if _issue_count(r)]
+    return {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "therapies": len(results),
+        "therapies_with_issues": len(with_issues),
+        "issues": sum(_issue_count(r) for r in with_issues),
+        "patients": with_issues,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Audit di sovrapposizioni e dipendenze su tutte le terapie")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--output", default=None, help="File JSON del report (default: stdout)")
+    parser.add_argument("--workers", type=int, default=None, help="Processi (default: tutti i core)")
+    parser.add_argument("--strict", action="store_true", help="Exit code 1 se vengono trovati problemi")
+    args = parser.parse_args(argv)
+
+    report = run_audit(Path(args.data_dir), args.workers)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+        print(f"Terapie: {report['therapies']}, con problemi: {report['therapies_with_issues']}. Report: {args.output}")
+    else:
+        print(text)
+    return 1 if args.strict and report["issues"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
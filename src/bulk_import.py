@@ -0,0 +1,207 @@
+"""
+Importazione massiva di pazienti, caregiver e terapie nello storage configurato
+(default_storage: file JSON in DATA_DIR o database SQLite).
+
+La cartella sorgente ha la stessa struttura di data/ (patients/, caregivers/, therapies/).
+Ogni file viene validato con i modelli pydantic, normalizzato (orari, durate, nomi dei giorni)
+e, per le terapie, controllato con gli stessi controlli di KnowledgeManager (duplicati,
+sovrapposizioni, dipendenze) in un pool di processi. Le entità valide vengono scritte (in modo
+atomico) man mano che arrivano i risultati; gli errori finiscono nel report JSON.
+
+    python -m src.bulk_import /percorso/sorgente --data-dir data --report import_report.json
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from src import journal
+from src.knowledge_manager import JsonFileStorage, KnowledgeManager, default_storage
+from src.models import Activity, CaregiverProfile, PatientProfile, Therapy
+from src.rag_sync import STALE_FILENAME, mark_stale
+from src.schedule_index import normalize_time_and_duration
+from src.weekdays import normalize_day
+
+# Tipo di entità -> (cartella, campo id, modello)
+_KINDS = {
+    "patient": ("patients", "patient_id", PatientProfile),
+    "caregiver": ("caregivers", "caregiver_id", CaregiverProfile),
+    "therapy": ("therapies", "patient_id", Therapy),
+}
+
+
+def _normalize_activity(raw: dict, errors: List[str], label: str) -> Optional[Activity]:
+    data = dict(raw)
+    data["time"], data["duration_minutes"] = normalize_time_and_duration(data.get("time"), data.get("duration_minutes"))
+    days = []
+    for day in data.get("day_of_week") or []:
+        canonical = normalize_day(day)
+        if canonical is None:
+            errors.append(f"{label}: giorno non riconosciuto '{day}'")
+        elif canonical not in days:
+            days.append(canonical)
+    data["day_of_week"] = days
+    if not data.get("description"):
+        data["description"] = data.get("name", "")
+    try:
+        return Activity(**data)
+    except Exception as e:
+        errors.append(f"{label}: {e}")
+        return None
+
+
+def _is_safe_id(entity_id: str) -> bool:
+    # L'id diventa il nome del file in data_dir: niente separatori, "..", file nascosti
+    return bool(entity_id) and Path(entity_id).name == entity_id and not entity_id.startswith(".")
+
+
+def _check_therapy(therapy: Therapy) -> List[str]:
+    km = KnowledgeManager(storage=JsonFileStorage())
+    km.therapy = Therapy(patient_id=therapy.patient_id, activities=[])
+    issues = []
+    for activity, warnings in zip(therapy.activities, km.check_batch_conflicts(therapy.activities)):
+        issues.extend(f"'{activity.name}' ({activity.activity_id}): {w}" for w in warnings)
+    return issues
+
+
+def process_file(kind: str, path: str) -> Dict:
+    """Valida e normalizza un file; eseguita nei processi del pool (nessuna scrittura su disco)."""
+    _, id_field, model_cls = _KINDS[kind]
+    source = Path(path)
+    result = {"kind": kind, "source": str(source), "id": source.stem, "errors": [], "warnings": [], "data": None}
+    try:
+        data = journal.load_json(source)
+    except Exception as e:
+        result["errors"].append(f"JSON non valido: {e}")
+        return result
+    if kind == "therapy" and isinstance(data, list):
+        # Formato legacy: lista di attività senza contenitore
+        data = {"patient_id": source.stem, "activities": data}
+    if not isinstance(data, dict):
+        result["errors"].append("Contenuto non valido: atteso un oggetto JSON")
+        return result
+    result["id"] = str(data.get(id_field) or source.stem)
+    if not _is_safe_id(result["id"]):
+        result["errors"].append(f"{id_field} non valido come nome di file: '{result['id']}'")
+        return result
+    data.setdefault(id_field, result["id"])
+
+    if kind == "therapy":
+        activities = []
+        for pos, raw in enumerate(data.get("activities") or []):
+            if not isinstance(raw, dict):
+                result["errors"].append(f"attività #{pos + 1}: atteso un oggetto JSON")
+                continue
+            activity = _normalize_activity(raw, result["errors"], f"attività #{pos + 1} '{raw.get('name', '?')}'")
+            if activity is not None:
+                activities.append(activity)
+        data["activities"] = activities
+    try:
+        model = model_cls(**data)
+    except Exception as e:
+        result["errors"].append(str(e))
+        return result
+    if kind == "therapy" and not result["errors"]:
+        result["warnings"] = _check_therapy(model)
+    result["data"] = model.model_dump(mode="json")
+    return result
+
+
+def _iter_sources(source_dir: Path) -> Iterator[tuple]:
+    for kind, (folder, _, _) in _KINDS.items():
+        root = source_dir / folder
+        if root.exists():
+            for path in sorted(root.glob("*.json")):
+                if not path.name.startswith("."):
+                    yield kind, str(path)
+
+
+def _process_item(item: tuple) -> Dict:
+    return process_file(*item)
+
+
+def run_import(
+    source_dir: Path,
+    data_dir: Path,
+    workers: Optional[int] = None,
+    force: bool = False,
+    dry_run: bool = False,
+    on_result=None,
+) -> Dict:
+    """
+    Importa source_dir nello storage di data_dir e restituisce il report. Con force le terapie con conflitti
+    vengono scritte comunque (i conflitti restano nel report come avvisi). Le terapie scritte
+    vengono segnate da riallineare nell'indice RAG (vedi rag_sync).
+    """
+    items = list(_iter_sources(Path(source_dir)))
+    workers = workers or os.cpu_count() or 1
+    report = {"imported": 0, "rejected": 0, "files": []}
+    if not items:
+        return report
+
+    def results() -> Iterator[Dict]:
+        if workers == 1:
+            yield from map(_process_item, items)
+            return
+        chunksize = max(1, len(items) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(_process_item, items, chunksize=chunksize)
+
+    storage = None if dry_run else default_storage(Path(data_dir))
+    written_therapies = []
+    try:
+        for result in results():
+            rejected = bool(result["errors"]) or (bool(result["warnings"]) and not force)
+            if not rejected and storage is not None:
+                storage.write_raw(result["kind"], result["id"], result["data"])
+                if result["kind"] == "therapy":
+                    written_therapies.append(result["id"])
+            report["rejected" if rejected else "imported"] += 1
+            entry = {key: result[key] for key in ("kind", "id", "source", "errors", "warnings")}
+            entry["status"] = "rejected" if rejected else ("valid" if dry_run else "imported")
+            if result["errors"] or result["warnings"]:
+                report["files"].append(entry)
+            if on_result:
+                on_result(entry)
+    finally:
+        if storage is not None:
+            storage.close()
+        # Scritture che non passano dal KnowledgeManager: nessun listener aggiorna l'indice RAG
+        if written_therapies:
+            mark_stale(Path(data_dir) / "chroma_db" / STALE_FILENAME, written_therapies)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Importazione massiva di pazienti, caregiver e terapie")
+    parser.add_argument("source", help="Cartella con patients/, caregivers/ e therapies/")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--workers", type=int, default=None, help="Processi (default: tutti i core)")
+    parser.add_argument("--force", action="store_true", help="Importa anche le terapie con conflitti")
+    parser.add_argument("--dry-run", action="store_true", help="Valida senza scrivere")
+    parser.add_argument("--report", default="import_report.json", help="File del report degli errori")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    def on_result(entry: Dict) -> None:
+        if not args.quiet:
+            issues = len(entry["errors"]) + len(entry["warnings"])
+            suffix = f" ({issues} problemi)" if issues else ""
+            print(f"[{entry['status']}] {entry['kind']} {entry['id']}{suffix}", flush=True)
+
+    report = run_import(
+        Path(args.source), Path(args.data_dir), args.workers, args.force, args.dry_run, on_result=on_result,
+    )
+    Path(args.report).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Importati: {report['imported']}, scartati: {report['rejected']}. Report: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
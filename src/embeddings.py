@@ -0,0 +1,95 @@
+"""
+Modello di embedding usato da tutti i percorsi di indicizzazione e di ricerca.
+
+get_embed_model() restituisce OllamaEmbedding avvolto da CachedEmbedding, che legge e scrive
+la cache su disco (vedi embedding_cache) e invia al server solo i testi mai visti, una volta sola
+anche se ripetuti nello stesso batch. KMCHAT_EMBED_CACHE=0 disattiva la cache.
+"""
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.embeddings.ollama import OllamaEmbedding
+
+from src.embedding_cache import CACHE_FILENAME, EmbeddingCache
+
+EMBED_MODEL_NAME = "nomic-embed-text"
+# Una sola connessione per file di cache, anche se get_embed_model viene chiamata più volte
+_CACHES: Dict[str, EmbeddingCache] = {}
+
+
+class CachedEmbedding(BaseEmbedding):
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: EmbeddingCache, **kwargs):
+        super().__init__(model_name=inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs)
+        self._inner = inner
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    def _lookup(self, kind: str, texts: List[str]) -> tuple:
+        vectors = self._cache.get_many(self.model_name, kind, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        return vectors, missing
+
+    def _fill(self, kind: str, texts: List[str], vectors: list, missing: List[str], fresh: List[List[float]]) -> List[List[float]]:
+        self._cache.put_many(self.model_name, kind, missing, fresh)
+        computed = dict(zip(missing, fresh))
+        return [vector if vector is not None else computed[text] for text, vector in zip(texts, vectors)]
+
+    def _cached(self, kind: str, texts: List[str], compute: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        vectors, missing = self._lookup(kind, texts)
+        if not missing:
+            return vectors
+        return self._fill(kind, texts, vectors, missing, compute(missing))
+
+    async def _acached(
+        self, kind: str, texts: List[str], compute: Callable[[List[str]], Awaitable[List[List[float]]]]
+    ) -> List[List[float]]:
+        vectors, missing = self._lookup(kind, texts)
+        if not missing:
+            return vectors
+        return self._fill(kind, texts, vectors, missing, await compute(missing))
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._cached("query", [query], lambda ts: [self._inner.get_query_embedding(ts[0])])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        async def compute(ts):
+            return [await self._inner.aget_query_embedding(ts[0])]
+        return (await self._acached("query", [query], compute))[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._cached("text", texts, self._inner.get_text_embedding_batch)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._acached("text", texts, self._inner.aget_text_embedding_batch)
+
+
+def get_embed_model(
+    model_name: str = EMBED_MODEL_NAME, cache_path: Optional[str] = None, embed_batch_size: Optional[int] = None,
+) -> BaseEmbedding:
+    """Embedding Ollama con cache persistente (percorso: KMCHAT_EMBED_CACHE_PATH o data/embedding_cache.sqlite)."""
+    inner = OllamaEmbedding(model_name=model_name, **({"embed_batch_size": embed_batch_size} if embed_batch_size else {}))
+    if os.getenv("KMCHAT_EMBED_CACHE", "1").strip() == "0":
+        return inner
+    path = str(cache_path or os.getenv("KMCHAT_EMBED_CACHE_PATH") or Path("data") / CACHE_FILENAME)
+    if path not in _CACHES:
+        _CACHES[path] = EmbeddingCache(path)
+    return CachedEmbedding(inner, _CACHES[path])
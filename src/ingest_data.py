@@ -1,25 +1,116 @@
+"""
+Indicizzazione dei dati (terapie, profili paziente e caregiver) nella collezione Chroma.
+I dati sono letti dallo storage configurato (default_storage: file JSON o SQLite).
+
+Ogni documento ha un id stabile (es. "therapy:<patient_id>:<activity_id>") e un hash del
+contenuto nei metadati: a ogni esecuzione vengono calcolati solo gli embedding dei documenti
+nuovi o modificati e rimossi quelli non più presenti nei dati. --rebuild ricrea la collezione.
+La pipeline è in streaming (entità -> lettura in un pool di --workers processi -> documenti ->
+blocchi di --batch-size testi -> embedding con al massimo --concurrency richieste contemporanee
+-> upsert), con code limitate tra gli stadi.
+
+    python src/ingest_data.py [--rebuild] [--batch-size 64] [--concurrency 4]
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
 import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Iterable
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
 
-from llama_index.core import Document, VectorStoreIndex, Settings, StorageContext
-from llama_index.embeddings.ollama import OllamaEmbedding
-from llama_index.vector_stores.chroma import ChromaVectorStore
-import chromadb
+# Ensure project root is on sys.path when running via `python src/ingest_data.py`
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
 
+from src.knowledge_manager import default_storage
+
+# llama_index e chromadb sono importati nelle funzioni che li usano: id, diff e code della
+# pipeline restano utilizzabili (e testabili) senza lo stack RAG
+if TYPE_CHECKING:
+    from llama_index.core import Document, VectorStoreIndex
+    from llama_index.core.vector_stores import MetadataFilters
 
 DATA_DIR = Path("data")
 COLLECTION_NAME = "patient_therapies"
+# Metadato con l'hash del contenuto: escluso dal testo usato per embedding e LLM
+HASH_KEY = "content_hash"
+# Valore del metadato "type" delle linee guida, comuni a tutti i pazienti
+GUIDELINE_TYPE = "guideline"
+# Id per chiamata a collection.get/delete di Chroma
+CHROMA_PAGE_SIZE = 5000
+# Testi per richiesta di embedding e richieste contemporanee al server
+EMBED_BATCH_SIZE = int(os.getenv("KMCHAT_EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.getenv("KMCHAT_EMBED_CONCURRENCY", "4"))
+# Processi per il parsing dei file JSON
+PARSE_WORKERS = int(os.getenv("KMCHAT_INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Ogni quanti blocchi stampare l'avanzamento
+PROGRESS_EVERY = 20
 
 
-def _load_json(path: Path):
-    try:
-        return json.loads(path.read_text(encoding="utf-8"))
-    except Exception:
-        return None
+class EmbedStats(NamedTuple):
+    documents: int
+    tokens: int
+    seconds: float
+
+    def __str__(self) -> str:
+        elapsed = max(self.seconds, 1e-9)
+        return (
+            f"{self.documents} documenti in {self.seconds:.1f}s "
+            f"({self.documents / elapsed:.1f} doc/s, {self.tokens / elapsed:.0f} token/s)"
+        )
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def activity_doc_id(patient_id: str, activity_id: str) -> str:
+    return f"therapy:{patient_id}:{activity_id}"
+
+
+def context_filters(
+    patient_id: Optional[str], caregiver_id: Optional[str], include_guidelines: bool = False
+) -> Optional[MetadataFilters]:
+    """
+    Filtro sui documenti del paziente o del caregiver (metadati patient_id / caregiver_id),
+    applicato da Chroma prima della ricerca di similarità. Con include_guidelines passano anche
+    i documenti type == "guideline". None se il contesto è vuoto.
+    """
+    from llama_index.core.vector_stores import FilterCondition, MetadataFilter, MetadataFilters
+
+    pairs = (("patient_id", patient_id), ("caregiver_id", caregiver_id))
+    if include_guidelines:
+        pairs += (("type", GUIDELINE_TYPE),)
+    filters = [MetadataFilter(key=key, value=value) for key, value in pairs if value]
+    return MetadataFilters(filters=filters, condition=FilterCondition.OR) if filters else None
+
+
+def _make_doc(doc_id: str, text: str, metadata: dict) -> Document:
+    from llama_index.core import Document
+
+    metadata = dict(metadata)
+    metadata[HASH_KEY] = _digest(text + "\n" + json.dumps(metadata, sort_keys=True, ensure_ascii=False))[:32]
+    return Document(
+        id_=doc_id, text=text, metadata=metadata,
+        excluded_embed_metadata_keys=[HASH_KEY], excluded_llm_metadata_keys=[HASH_KEY],
+    )
+
+
+def _profile_doc_id(prefix: str, owner_id: str, category: str, key: str, seen: Dict[str, int]) -> str:
+    # Id dal contenuto: le voci uguali nello stesso profilo ricevono un suffisso progressivo
+    doc_id = f"{prefix}:{owner_id}:{category}:{_digest(key)[:16]}"
+    seen[doc_id] = seen.get(doc_id, 0) + 1
+    return doc_id if seen[doc_id] == 1 else f"{doc_id}:{seen[doc_id]}"
 
 
-def _build_activity_doc(activity: dict, patient_id: str) -> Document | None:
+def build_activity_doc(activity: dict, patient_id: str, position: int = 0) -> Document | None:
     name = activity.get("name")
     if not name:
         return None
@@ -50,182 +141,372 @@ def _build_activity_doc(activity: dict, patient_id: str) -> Document | None:
         "patient_id": patient_id,
         "activity_id": activity.get("activity_id"),
     }
-    return Document(text="\n".join(lines), metadata=meta)
+    doc_id = activity_doc_id(patient_id, activity.get("activity_id") or f"#{position}")
+    return _make_doc(doc_id, "\n".join(lines), meta)
 
 
-def _iter_therapy_docs() -> Iterable[Document]:
-    therapy_dir = DATA_DIR / "therapies"
-    if not therapy_dir.exists():
+def _therapy_data_docs(data, key: str) -> List[Document]:
+    if isinstance(data, dict) and "activities" in data:
+        activities = data.get("activities") or []
+        patient_id = data.get("patient_id") or key
+    elif isinstance(data, list):
+        activities = data
+        patient_id = key
+    else:
         return []
+    return therapy_docs(activities, patient_id)
 
-    docs: list[Document] = []
-    for path in therapy_dir.glob("*.json"):
-        data = _load_json(path)
-        if not data:
+
+def therapy_docs(activities: Iterable, patient_id: str) -> List[Document]:
+    """Documenti di tutte le attività di una terapia, con id univoci (ingestion e rag_sync)."""
+    docs: List[Document] = []
+    seen = set()
+    for position, activity in enumerate(activities):
+        if not isinstance(activity, dict):
             continue
-        if isinstance(data, dict) and "activities" in data:
-            activities = data.get("activities") or []
-            patient_id = data.get("patient_id") or path.stem
-        elif isinstance(data, list):
-            activities = data
-            patient_id = path.stem
-        else:
+        doc = build_activity_doc(activity, patient_id, position)
+        if doc:
+            if doc.id_ in seen:
+                # activity_id ripetuto nella stessa terapia: l'id del documento resta univoco
+                doc.id_ = f"{doc.id_}#{position}"
+            seen.add(doc.id_)
+            docs.append(doc)
+    return docs
+
+
+# Campo lista del profilo paziente -> (tipo, categoria)
+_PATIENT_LISTS = {
+    "medical_conditions": ("patient_condition", "conditions"),
+    "preferences": ("patient_preference", "preferences"),
+    "habits": ("patient_habit", "habits"),
+}
+
+
+def _iter_notes(data: dict) -> Iterator[tuple]:
+    for note in data.get("notes") or []:
+        if not isinstance(note, dict):
             continue
+        content = note.get("content")
+        if content:
+            yield note.get("day"), content
+
 
-        for activity in activities:
-            if not isinstance(activity, dict):
-                continue
-            doc = _build_activity_doc(activity, patient_id)
-            if doc:
-                docs.append(doc)
+def _patient_data_docs(data, key: str) -> List[Document]:
+    if not isinstance(data, dict):
+        return []
+    patient_id = data.get("patient_id") or key
+    docs: List[Document] = []
+    seen: Dict[str, int] = {}
+    for field, (doc_type, category) in _PATIENT_LISTS.items():
+        for item in data.get(field) or []:
+            meta = {"type": doc_type, "category": category, "source": "patient_profile", "patient_id": patient_id}
+            doc_id = _profile_doc_id("patient", patient_id, category, str(item), seen)
+            docs.append(_make_doc(doc_id, f"[Always] {item}", meta))
+    for day, content in _iter_notes(data):
+        meta = {"type": "patient_note", "category": "notes", "source": "patient_profile", "patient_id": patient_id}
+        doc_id = _profile_doc_id("patient", patient_id, "notes", f"{day or ''}|{content}", seen)
+        docs.append(_make_doc(doc_id, f"[{day or 'Always'}] {content}", meta))
     return docs
 
 
-def _iter_patient_docs() -> Iterable[Document]:
-    patient_dir = DATA_DIR / "patients"
-    if not patient_dir.exists():
+def _caregiver_data_docs(data, key: str) -> List[Document]:
+    if not isinstance(data, dict):
         return []
-
-    docs: list[Document] = []
-    for path in patient_dir.glob("*.json"):
-        data = _load_json(path)
-        if not data or not isinstance(data, dict):
-            continue
-        patient_id = data.get("patient_id") or path.stem
-        for cond in data.get("medical_conditions") or []:
-            docs.append(
-                Document(
-                    text=f"[Always] {cond}",
-                    metadata={
-                        "type": "patient_condition",
-                        "category": "conditions",
-                        "source": "patient_profile",
-                        "patient_id": patient_id,
-                    },
-                )
-            )
-        for pref in data.get("preferences") or []:
-            docs.append(
-                Document(
-                    text=f"[Always] {pref}",
-                    metadata={
-                        "type": "patient_preference",
-                        "category": "preferences",
-                        "source": "patient_profile",
-                        "patient_id": patient_id,
-                    },
-                )
-            )
-        for habit in data.get("habits") or []:
-            docs.append(
-                Document(
-                    text=f"[Always] {habit}",
-                    metadata={
-                        "type": "patient_habit",
-                        "category": "habits",
-                        "source": "patient_profile",
-                        "patient_id": patient_id,
-                    },
-                )
-            )
-        for note in data.get("notes") or []:
-            if not isinstance(note, dict):
-                continue
-            content = note.get("content")
-            if not content:
-                continue
-            day = note.get("day")
-            label = day or "Always"
-            docs.append(
-                Document(
-                    text=f"[{label}] {content}",
-                    metadata={
-                        "type": "patient_note",
-                        "category": "notes",
-                        "source": "patient_profile",
-                        "patient_id": patient_id,
-                    },
-                )
-            )
+    caregiver_id = data.get("caregiver_id") or key
+    docs: List[Document] = []
+    seen: Dict[str, int] = {}
+    for pref in data.get("semantic_preferences") or []:
+        meta = {"type": "caregiver_preference", "category": "caregiver", "source": "caregiver_profile", "caregiver_id": caregiver_id}
+        doc_id = _profile_doc_id("caregiver", caregiver_id, "preferences", str(pref), seen)
+        docs.append(_make_doc(doc_id, f"[Always] {pref}", meta))
+    for day, content in _iter_notes(data):
+        meta = {"type": "caregiver_note", "category": "caregiver", "source": "caregiver_profile", "caregiver_id": caregiver_id}
+        doc_id = _profile_doc_id("caregiver", caregiver_id, "notes", f"{day or ''}|{content}", seen)
+        docs.append(_make_doc(doc_id, f"[{day or 'Always'}] {content}", meta))
     return docs
 
 
-def _iter_caregiver_docs() -> Iterable[Document]:
-    caregiver_dir = DATA_DIR / "caregivers"
-    if not caregiver_dir.exists():
+# Tipo di entità dello storage -> costruttore dei documenti dai suoi dati grezzi
+_SOURCES = {
+    "therapy": _therapy_data_docs,
+    "patient": _patient_data_docs,
+    "caregiver": _caregiver_data_docs,
+}
+
+
+def _entity_docs(storage, kind: str, key: str) -> List[Document]:
+    try:
+        data = storage.read(kind, key)
+    except Exception:
         return []
+    return _SOURCES[kind](data, key) if data else []
+
+
+# Storage dei processi del pool di parsing (una connessione/indice per processo)
+_worker_storage = None
 
-    docs: list[Document] = []
-    for path in caregiver_dir.glob("*.json"):
-        data = _load_json(path)
-        if not data or not isinstance(data, dict):
-            continue
-        caregiver_id = data.get("caregiver_id") or path.stem
-        for pref in data.get("semantic_preferences") or []:
-            docs.append(
-                Document(
-                    text=f"[Always] {pref}",
-                    metadata={
-                        "type": "caregiver_preference",
-                        "category": "caregiver",
-                        "source": "caregiver_profile",
-                        "caregiver_id": caregiver_id,
-                    },
-                )
-            )
-        for note in data.get("notes") or []:
-            if not isinstance(note, dict):
-                continue
-            content = note.get("content")
-            if not content:
-                continue
-            day = note.get("day")
-            label = day or "Always"
-            docs.append(
-                Document(
-                    text=f"[{label}] {content}",
-                    metadata={
-                        "type": "caregiver_note",
-                        "category": "caregiver",
-                        "source": "caregiver_profile",
-                        "caregiver_id": caregiver_id,
-                    },
-                )
-            )
-    return docs
 
+def _init_worker(data_dir: Path) -> None:
+    global _worker_storage
+    _worker_storage = default_storage(data_dir)
+
+
+def _worker_docs(source: tuple) -> List[Document]:
+    return _entity_docs(_worker_storage, *source)
+
+
+def profile_docs(kind: str, data, key: str) -> List[Document]:
+    """Documenti di un profilo ("patient" o "caregiver") dai dati grezzi, con gli id e gli hash dell'ingestion."""
+    return _SOURCES[kind](data, key)
+
+
+def _bounded(submit, items: Iterable, window: int) -> Iterator:
+    """Risultati in ordine, con al massimo `window` elementi in lavorazione: coda limitata tra due stadi."""
+    pending = deque()
+    for item in items:
+        pending.append(submit(item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_documents(data_dir: Path = None, workers: int = PARSE_WORKERS) -> Iterator[Document]:
+    """
+    Elenco delle entità -> lettura -> costruzione dei documenti, in streaming, dallo storage di
+    default_storage(data_dir). Con workers > 1 la lettura gira in un pool di processi con al più
+    4 * workers entità in volo.
+    """
+    data_dir = Path(data_dir or DATA_DIR)
+    storage = default_storage(data_dir)
+    try:
+        sources = ((kind, key) for kind in _SOURCES for key in storage.list_ids(kind))
+        if workers <= 1:
+            for kind, key in sources:
+                yield from _entity_docs(storage, kind, key)
+            return
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data_dir,)) as pool:
+            for docs in _bounded(lambda source: pool.submit(_worker_docs, source), sources, workers * 4):
+                yield from docs
+    finally:
+        storage.close()
+
+
+def _page_hashes(page: dict, hashes: Dict[str, Optional[str]]) -> int:
+    ids = page.get("ids") or []
+    metadatas = page.get("metadatas") or [None] * len(ids)
+    for doc_id, meta in zip(ids, metadatas):
+        hashes[doc_id] = (meta or {}).get(HASH_KEY)
+    return len(ids)
+
+
+def existing_hashes(collection, where: Optional[dict] = None) -> Dict[str, Optional[str]]:
+    """id -> hash del contenuto dei documenti nella collezione, filtrati da `where` (None per quelli senza hash)."""
+    hashes: Dict[str, Optional[str]] = {}
+    offset = 0
+    while True:
+        page = collection.get(where=where, include=["metadatas"], limit=CHROMA_PAGE_SIZE, offset=offset)
+        found = _page_hashes(page, hashes)
+        if found < CHROMA_PAGE_SIZE:
+            return hashes
+        offset += found
+
+
+def stored_hashes(collection, ids: List[str]) -> Dict[str, Optional[str]]:
+    """id -> hash del contenuto per i soli `ids` già presenti nella collezione."""
+    hashes: Dict[str, Optional[str]] = {}
+    for i in range(0, len(ids), CHROMA_PAGE_SIZE):
+        _page_hashes(collection.get(ids=ids[i:i + CHROMA_PAGE_SIZE], include=["metadatas"]), hashes)
+    return hashes
+
+
+def changed_documents(
+    documents: Iterable[Document], existing: Dict[str, Optional[str]], counts: Dict[str, int] = None,
+) -> Iterator[Document]:
+    """
+    Documenti nuovi o modificati rispetto a `existing` (id -> hash, vedi existing_hashes), contati in
+    `counts` (nuovi, modificati, invariati). Gli id incontrati vengono tolti da `existing`: a fine
+    iterazione vi restano solo i documenti spariti dai dati.
+    """
+    counts = counts if counts is not None else {}
+    for key in ("nuovi", "modificati", "invariati"):
+        counts.setdefault(key, 0)
+    for doc in documents:
+        if doc.id_ not in existing:
+            counts["nuovi"] += 1
+            yield doc
+        elif existing.pop(doc.id_) != doc.metadata[HASH_KEY]:
+            counts["modificati"] += 1
+            yield doc
+        else:
+            counts["invariati"] += 1
+
+
+def changed_in_collection(
+    documents: Iterable[Document], collection, counts: Dict[str, int] = None, seen: Set[str] = None,
+    window: int = CHROMA_PAGE_SIZE,
+) -> Iterator[Document]:
+    """
+    Come changed_documents, ma gli hash vengono letti dalla collezione una finestra di `window`
+    documenti alla volta (stored_hashes) invece di caricarli tutti prima dello streaming.
+    Gli id incontrati vengono aggiunti a `seen` (vedi vanished_ids).
+    """
+    for batch in _batched(documents, max(1, window)):
+        ids = [doc.id_ for doc in batch]
+        if seen is not None:
+            seen.update(ids)
+        yield from changed_documents(batch, stored_hashes(collection, ids), counts)
+
+
+def vanished_ids(collection, seen: Set[str]) -> List[str]:
+    """Id della collezione non presenti in `seen`, letti a pagine (solo gli id, senza metadati)."""
+    vanished: List[str] = []
+    offset = 0
+    while True:
+        ids = collection.get(include=[], limit=CHROMA_PAGE_SIZE, offset=offset).get("ids") or []
+        vanished.extend(doc_id for doc_id in ids if doc_id not in seen)
+        if len(ids) < CHROMA_PAGE_SIZE:
+            return vanished
+        offset += len(ids)
+
+
+def delete_ids(collection, ids: List[str]) -> None:
+    for i in range(0, len(ids), CHROMA_PAGE_SIZE):
+        collection.delete(ids=ids[i:i + CHROMA_PAGE_SIZE])
+
+
+def _embed_batch(batch: List[Document]) -> tuple:
+    """Calcola gli embedding del blocco (assegnati ai documenti); restituisce (blocco, token stimati)."""
+    from llama_index.core import Settings
+    from llama_index.core.schema import MetadataMode
+
+    texts = [doc.get_content(metadata_mode=MetadataMode.EMBED) for doc in batch]
+    for doc, vector in zip(batch, Settings.embed_model.get_text_embedding_batch(texts)):
+        doc.embedding = vector
+    return batch, sum(len(Settings.tokenizer(text)) for text in texts)
+
+
+def _batched(documents: Iterable[Document], size: int) -> Iterator[List[Document]]:
+    batch: List[Document] = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_and_insert(
+    index: VectorStoreIndex,
+    documents: Iterable[Document],
+    batch_size: int = EMBED_BATCH_SIZE,
+    concurrency: int = EMBED_CONCURRENCY,
+    before_insert: Callable[[List[Document]], None] = None,
+) -> EmbedStats:
+    """
+    Embedding a blocchi in un pool di `concurrency` thread (le richieste HTTP non tengono il GIL),
+    consumando `documents` in streaming: al più 2 * concurrency blocchi in memoria. Ogni blocco
+    viene scritto nella collezione appena pronto, dal thread principale (dopo before_insert).
+    """
+    batch_size, concurrency = max(1, batch_size), max(1, concurrency)
+    started = time.perf_counter()
+    done = tokens = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = _bounded(lambda batch: pool.submit(_embed_batch, batch), _batched(documents, batch_size), concurrency * 2)
+        for n, (batch, batch_tokens) in enumerate(results, start=1):
+            if before_insert:
+                before_insert(batch)
+            index.insert_nodes(batch)
+            done += len(batch)
+            tokens += batch_tokens
+            if n % PROGRESS_EVERY == 0:
+                print(f"  ... {EmbedStats(done, tokens, time.perf_counter() - started)}", flush=True)
+    return EmbedStats(done, tokens, time.perf_counter() - started)
+
+
+def ingest_data(
+    output_dir: str = "data",
+    rebuild: bool = False,
+    batch_size: int = EMBED_BATCH_SIZE,
+    concurrency: int = EMBED_CONCURRENCY,
+    workers: int = PARSE_WORKERS,
+) -> VectorStoreIndex:
+    """
+    Allinea la collezione ai dati salvati: embedding solo per i documenti nuovi o modificati,
+    rimozione di quelli spariti (compresi quelli inseriti dalla chat con id casuale).
+    I documenti scorrono in streaming dallo storage all'upsert: gli hash salvati vengono letti per
+    finestre di documenti e in memoria restano solo i blocchi in lavorazione e gli id già visti.
+    """
+    import chromadb
+    from llama_index.core import Settings, StorageContext, VectorStoreIndex
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
+    from src.embeddings import get_embed_model
 
-def ingest_data(output_dir: str = "data") -> VectorStoreIndex:
     Path(output_dir).mkdir(parents=True, exist_ok=True)
 
-    Settings.embed_model = OllamaEmbedding(model_name="nomic-embed-text")
+    Settings.embed_model = get_embed_model(embed_batch_size=batch_size)
     Settings.chunk_size = 512
     Settings.chunk_overlap = 50
 
-    documents: list[Document] = []
-    documents.extend(list(_iter_therapy_docs()))
-    documents.extend(list(_iter_patient_docs()))
-    documents.extend(list(_iter_caregiver_docs()))
+    from src.rag_sync import STALE_FILENAME, read_stale, write_stale
+
+    stale_path = Path(output_dir) / "chroma_db" / STALE_FILENAME
+    # Pazienti segnati da riallineare prima di questa ingestion: alla fine risultano allineati
+    stale_before = read_stale(stale_path)
 
     db = chromadb.PersistentClient(path=str(Path(output_dir) / "chroma_db"))
-    try:
-        db.delete_collection(name=COLLECTION_NAME)
-        print(f"Collezione '{COLLECTION_NAME}' resettata.")
-    except Exception:
-        pass
+    if rebuild:
+        try:
+            db.delete_collection(name=COLLECTION_NAME)
+            print(f"Collezione '{COLLECTION_NAME}' resettata.")
+        except Exception:
+            pass
 
     chroma_collection = db.get_or_create_collection(COLLECTION_NAME)
     vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
     storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    index = VectorStoreIndex.from_vector_store(vector_store, storage_context=storage_context)
+
+    # Gli id della collezione non visti durante lo streaming sono i documenti spariti dai dati
+    seen: Set[str] = set()
+    counts: Dict[str, int] = {}
+
+    def replace_previous(batch: List[Document]) -> None:
+        # Upsert: il vettore precedente con lo stesso id viene rimosso (nessun effetto sugli id nuovi)
+        chroma_collection.delete(ids=[doc.id_ for doc in batch])
 
-    print(f"Indicizzazione di {len(documents)} documenti totali...")
-    index = VectorStoreIndex.from_documents(documents, storage_context=storage_context)
+    changed = changed_in_collection(
+        iter_documents(DATA_DIR, workers), chroma_collection, counts, seen, window=batch_size * concurrency,
+    )
+    stats = embed_and_insert(index, changed, batch_size, concurrency, before_insert=replace_previous)
+    removed = vanished_ids(chroma_collection, seen)
+    delete_ids(chroma_collection, removed)
+    if stale_before:
+        write_stale(stale_path, read_stale(stale_path) - stale_before)
+    print(
+        f"Documenti: {sum(counts.values())} (nuovi {counts['nuovi']}, modificati {counts['modificati']}, "
+        f"rimossi {len(removed)}, invariati {counts['invariati']})."
+    )
+    if stats.documents:
+        print(f"Embedding: {stats}")
     print("✅ Ingestion completata con successo.")
     return index
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Indicizzazione incrementale dei dati in Chroma")
+    parser.add_argument("--data-dir", default="data", help="Cartella della collezione Chroma")
+    parser.add_argument("--rebuild", action="store_true", help="Ricrea la collezione da zero")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Testi per richiesta di embedding")
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY, help="Richieste di embedding contemporanee")
+    parser.add_argument("--workers", type=int, default=PARSE_WORKERS, help="Processi per il parsing dei file")
+    args = parser.parse_args()
     print("Inizio fase di ingestion dati...")
-    ingest_data()
+    ingest_data(
+        args.data_dir, rebuild=args.rebuild, batch_size=args.batch_size,
+        concurrency=args.concurrency, workers=args.workers,
+    )
     print("Ingestion dati completata.")
     print("\nRicorda di avere Ollama in esecuzione (nomic-embed-text) prima di eseguire questo script.")
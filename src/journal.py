@@ -0,0 +1,216 @@
+"""
+Journal append-only delle modifiche ai file JSON di DATA_DIR.
+
+Accanto a ogni snapshot (es. therapies/<id>.json) può esistere un file <id>.journal.jsonl
+con un'operazione per riga. La prima riga ("base") identifica lo snapshot a cui le operazioni
+si applicano: hash del contenuto più generazione. La generazione è un contatore scritto dentro
+lo snapshot ("_generation") e incrementato da write_snapshot, quindi non dipende da mtime o
+copie del file (touch, git checkout). Un journal di una generazione precedente è superato
+(snapshot riscritto, anche con contenuto identico, o crash a metà compattazione) e viene
+ignorato; qualunque altra differenza (snapshot modificato a mano o sostituito con una versione
+diversa) solleva JournalMismatchError invece di scartare le operazioni pendenti.
+
+Operazioni supportate:
+- {"op": "add", "activity": {...}}
+- {"op": "update", "index": i, "activity_id": "...", "fields": {...}}
+- {"op": "remove", "index": i, "activity_id": "..."}
+- {"op": "append", "field": "notes", "value": ...}   (profili paziente/caregiver)
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+JOURNAL_SUFFIX = ".journal.jsonl"
+# Campo dello snapshot con la generazione; le liste (formato legacy) sono avvolte in ITEMS_KEY
+GENERATION_KEY = "_generation"
+ITEMS_KEY = "_items"
+# Numero di operazioni oltre il quale il journal viene compattato nello snapshot
+JOURNAL_COMPACT_THRESHOLD = 200
+
+logger = logging.getLogger("kmchat.journal")
+
+
+class JournalMismatchError(RuntimeError):
+    """Il journal ha operazioni pendenti per uno snapshot diverso da quello su disco."""
+
+
+def journal_path(snapshot_path: Path) -> Path:
+    return snapshot_path.with_name(snapshot_path.stem + JOURNAL_SUFFIX)
+
+
+def _base(raw: bytes, generation: int) -> str:
+    # "<sha1>@<generazione>"
+    return f"{hashlib.sha1(raw).hexdigest()}@{generation}"
+
+
+def _split_base(base: str) -> Tuple[str, int]:
+    digest, _, generation = base.partition("@")
+    return digest, int(generation)
+
+
+def _header_matches(path: Path, header: Any, base: str) -> bool:
+    """True se il journal vale per lo snapshot, False se è di una generazione superata; altrimenti errore."""
+    digest, generation = _split_base(base)
+    header_generation = header.get("generation") if isinstance(header, dict) else None
+    if not isinstance(header, dict) or header.get("op") != "base" or not isinstance(header_generation, int):
+        raise JournalMismatchError(f"Intestazione del journal {path} non valida.")
+    if header_generation == generation and header.get("digest") == digest:
+        return True
+    if header_generation < generation:
+        return False
+    raise JournalMismatchError(
+        f"Il journal {path} (generazione {header_generation}) non corrisponde allo snapshot "
+        f"(generazione {generation}): lo snapshot è stato modificato o sostituito. "
+        "Ripristinare lo snapshot originale oppure rimuovere il journal per scartarne le operazioni."
+    )
+
+
+def _unwrap(data: Any) -> Tuple[Any, int]:
+    if not isinstance(data, dict):
+        return data, 0
+    generation = data.pop(GENERATION_KEY, 0)
+    if set(data) == {ITEMS_KEY}:
+        data = data[ITEMS_KEY]
+    return data, generation if isinstance(generation, int) else 0
+
+
+def read_snapshot(snapshot_path: Path) -> Tuple[Any, Optional[str]]:
+    """Legge lo snapshot JSON e restituisce (dati, base per il journal); (None, None) se il file non esiste."""
+    try:
+        raw = Path(snapshot_path).read_bytes()
+    except FileNotFoundError:
+        return None, None
+    data, generation = _unwrap(json.loads(raw))
+    return data, _base(raw, generation)
+
+
+def read_ops(snapshot_path: Path, base: Optional[str]) -> List[dict]:
+    """Restituisce le operazioni del journal valide per lo snapshot identificato da base."""
+    path = journal_path(snapshot_path)
+    if base is None or not path.exists():
+        return []
+    ops: List[dict] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                op = json.loads(line)
+            except json.JSONDecodeError:
+                if lineno == 0:
+                    # Intestazione e prime operazioni sono scritte insieme: nessuna operazione completa
+                    logger.warning("Intestazione del journal %s troncata: ignorato.", path)
+                    return []
+                # Tipicamente l'ultima riga troncata da un crash durante la scrittura
+                logger.warning("Riga %d del journal %s non valida: ignorata.", lineno + 1, path)
+                continue
+            if lineno == 0:
+                if not _header_matches(path, op, base):
+                    logger.info("Journal %s di una generazione superata dello snapshot: ignorato.", path)
+                    return []
+                continue
+            ops.append(op)
+    return ops
+
+
+def _current_header(path: Path) -> Optional[dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.loads(f.readline())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def append_ops(snapshot_path: Path, ops: List[dict], base: str) -> None:
+    path = journal_path(snapshot_path)
+    lines = []
+    header = _current_header(path)
+    # Un journal di una generazione superata viene sostituito, non esteso
+    mode = "a" if header is not None and _header_matches(path, header, base) else "w"
+    if mode == "w":
+        digest, generation = _split_base(base)
+        lines.append(json.dumps({"op": "base", "digest": digest, "generation": generation}))
+    lines.extend(json.dumps(op, ensure_ascii=False) for op in ops)
+    with open(path, mode, encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def _previous_generation(snapshot_path: Path) -> int:
+    # La più alta tra snapshot e journal: il journal può sopravvivere a uno snapshot riscritto a mano
+    generation = 0
+    try:
+        _, generation = _unwrap(json.loads(Path(snapshot_path).read_bytes()))
+    except (FileNotFoundError, ValueError):
+        pass
+    header = _current_header(journal_path(snapshot_path))
+    if isinstance(header, dict) and isinstance(header.get("generation"), int):
+        generation = max(generation, header["generation"])
+    return generation
+
+
+def write_snapshot(snapshot_path: Path, content: Any) -> str:
+    """
+    Riscrive lo snapshot in modo atomico con la generazione successiva, elimina il journal e
+    restituisce la nuova base. `content`: testo JSON oppure dati (dict, o lista nel formato legacy).
+    """
+    data = json.loads(content) if isinstance(content, str) else content
+    generation = _previous_generation(snapshot_path) + 1
+    if isinstance(data, dict):
+        data = {GENERATION_KEY: generation, **{k: v for k, v in data.items() if k != GENERATION_KEY}}
+    else:
+        data = {GENERATION_KEY: generation, ITEMS_KEY: data}
+    raw = json.dumps(data, indent=4, ensure_ascii=False).encode("utf-8")
+    tmp_path = snapshot_path.with_name(f".{snapshot_path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(raw)
+    os.replace(tmp_path, snapshot_path)
+    try:
+        journal_path(snapshot_path).unlink()
+    except FileNotFoundError:
+        pass
+    return _base(raw, generation)
+
+
+def _resolve_index(activities: list, op: dict) -> Optional[int]:
+    idx = op.get("index")
+    act_id = op.get("activity_id")
+    if isinstance(idx, int) and 0 <= idx < len(activities):
+        if activities[idx].get("activity_id") == act_id:
+            return idx
+    for i, act in enumerate(activities):
+        if act.get("activity_id") == act_id:
+            return i
+    return None
+
+
+def replay(data: Any, ops: List[dict]) -> Any:
+    """Applica le operazioni ai dati grezzi dello snapshot (lista legacy o dict)."""
+    for op in ops:
+        kind = op.get("op")
+        if kind == "append":
+            data.setdefault(op["field"], []).append(op["value"])
+            continue
+        activities = data if isinstance(data, list) else data.setdefault("activities", [])
+        if kind == "add":
+            activities.append(op["activity"])
+            continue
+        idx = _resolve_index(activities, op)
+        if idx is None:
+            logger.warning("Operazione %s su attività '%s' non applicabile: ignorata.", kind, op.get("activity_id"))
+        elif kind == "update":
+            activities[idx].update(op.get("fields") or {})
+        elif kind == "remove":
+            activities.pop(idx)
+    return data
+
+
+def load_json(snapshot_path: Path) -> Any:
+    """Snapshot + journal: lo stato corrente del file, come lo vedrebbe KnowledgeManager."""
+    data, digest = read_snapshot(snapshot_path)
+    if data is None:
+        return None
+    return replay(data, read_ops(snapshot_path, digest))
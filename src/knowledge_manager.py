@@ -1,23 +1,399 @@
 import json
 import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Optional
-from datetime import datetime, date
+from types import MappingProxyType
+from typing import Any, Callable, Iterator, List, Dict, Mapping, NamedTuple, Optional, Tuple, Union
+from datetime import datetime, date, timedelta
 
+from pydantic import BaseModel
+
+from src import journal
 from src.models import Therapy, Activity, PatientProfile, CaregiverProfile, Note
+from src.profile_index import ProfileIndex
+from src.sqlite_storage import SQLITE_FILENAME, SqliteStorage
+from src.text_normalize import normalize_name
+from src.schedule_index import (
+    DEFAULT_DURATION_MINUTES, ScheduleIndex, free_slots, overlapping_pairs, parse_time_to_minutes, time_interval,
+)
+from src.weekdays import WEEKDAYS, WeekdayMask, day_key
 
 DATA_DIR = Path("data")
+# Intervallo minimo (secondi) tra due scansioni della cartella nell'indice anagrafico
+DIRECTORY_REFRESH_SECONDS = 2.0
+# Limiti della cache dei contesti (paziente, caregiver) già caricati: numero di contesti e
+# numero totale di elementi (attività, note, ...) tenuti in memoria
+CONTEXT_CACHE_SIZE = int(os.getenv("KMCHAT_CONTEXT_CACHE_SIZE", "8"))
+CONTEXT_CACHE_MAX_ITEMS = int(os.getenv("KMCHAT_CONTEXT_CACHE_MAX_ITEMS", "20000"))
+# Fascia oraria di default in cui find_free_slot cerca gli slot liberi
+FREE_SLOT_EARLIEST = "07:00"
+FREE_SLOT_LATEST = "22:00"
 logger = logging.getLogger("kmchat.km")
+
+# Categoria di save_knowledge_note -> (campo del profilo paziente, etichetta, messaggio di conferma)
+_PATIENT_FIELDS = {
+    "habits": ("habits", "Abitudine", "Abitudine salvata."),
+    "preferences": ("preferences", "Preferenza", "Preferenza salvata."),
+    "conditions": ("medical_conditions", "Condizione medica", "Condizione medica salvata."),
+}
+
+
+class DirectoryEntry(NamedTuple):
+    id: str
+    name: Optional[str]
+    normalized_name: str
+    mtime_ns: int
+
+
+class _DirectoryIndex:
+    """
+    Indice in memoria dei profili (pazienti o caregiver) presenti in una cartella di DATA_DIR.
+    I file vengono riletti solo quando il loro mtime cambia; la ricerca per nome è un lookup su dict.
+    """
+
+    def __init__(
+        self, folder_name: str, id_field: str,
+        refresh_interval: float = DIRECTORY_REFRESH_SECONDS, data_dir: Optional[Path] = None,
+    ):
+        self.folder_name = folder_name
+        self.id_field = id_field
+        self.data_dir = data_dir
+        self.refresh_interval = refresh_interval
+        self._root: Optional[Path] = None
+        self._last_scan: Optional[float] = None
+        self._entries: Dict[str, DirectoryEntry] = {}
+        self._mtimes: Dict[str, int] = {}
+        self._by_name: Dict[str, str] = {}
+        self._listing: List[Dict[str, Optional[str]]] = []
+
+    def refresh(self, force: bool = False) -> None:
+        root = (self.data_dir or DATA_DIR) / self.folder_name
+        if root != self._root:
+            # DATA_DIR è cambiata (es. nei test): si riparte da zero
+            self._root = root
+            self._entries, self._mtimes = {}, {}
+            force = True
+        now = time.monotonic()
+        if not force and self._last_scan is not None and now - self._last_scan < self.refresh_interval:
+            return
+        self._last_scan = now
+
+        seen = set()
+        changed = False
+        if root.exists():
+            with os.scandir(root) as it:
+                for item in it:
+                    if not item.name.endswith(".json") or item.name.startswith(".") or not item.is_file():
+                        continue
+                    stem = item.name[: -len(".json")]
+                    seen.add(stem)
+                    mtime_ns = item.stat().st_mtime_ns
+                    if self._mtimes.get(stem) == mtime_ns:
+                        continue
+                    self._mtimes[stem] = mtime_ns
+                    entry = self._read_entry(Path(item.path), stem, mtime_ns)
+                    if entry:
+                        self._entries[stem] = entry
+                    else:
+                        self._entries.pop(stem, None)
+                    changed = True
+        for stem in set(self._mtimes) - seen:
+            self._mtimes.pop(stem, None)
+            self._entries.pop(stem, None)
+            changed = True
+        if changed:
+            self._rebuild_views()
+
+    def _read_entry(self, path: Path, stem: str, mtime_ns: int) -> Optional[DirectoryEntry]:
+        try:
+            data = json.loads(path.read_text())
+        except Exception:
+            return None
+        if not isinstance(data, dict):
+            return None
+        name = data.get("name")
+        return DirectoryEntry(str(data.get(self.id_field) or stem), name, normalize_name(name), mtime_ns)
+
+    def _rebuild_views(self) -> None:
+        self._by_name = {}
+        self._listing = []
+        for stem in sorted(self._entries):
+            entry = self._entries[stem]
+            self._listing.append({"id": entry.id, "name": entry.name})
+            if entry.normalized_name:
+                self._by_name.setdefault(entry.normalized_name, entry.id)
+
+    def as_list(self) -> List[Dict[str, Optional[str]]]:
+        self.refresh()
+        return [dict(item) for item in self._listing]
+
+    def first_id(self) -> Optional[str]:
+        self.refresh()
+        return min(self._mtimes) if self._mtimes else None
+
+    def find_id_by_name(self, name: str) -> Optional[str]:
+        target = normalize_name(name)
+        if not target:
+            return None
+        self.refresh()
+        found = self._by_name.get(target)
+        if found is None:
+            # Il profilo potrebbe essere appena stato creato: una sola nuova scansione forzata
+            self.refresh(force=True)
+            found = self._by_name.get(target)
+        return found
+
+
+class Occurrence(NamedTuple):
+    """Singola occorrenza datata di un'attività (vedi iter_occurrences)."""
+    date: date
+    start: datetime
+    end: datetime
+    activity: Activity
+
+
+class FreeSlot(NamedTuple):
+    """Slot libero proposto da find_free_slot, in minuti dalla mezzanotte."""
+    start: int
+    end: int
+
+    @property
+    def time(self) -> str:
+        return f"{self.start // 60:02d}:{self.start % 60:02d}"
+
+    @property
+    def end_time(self) -> str:
+        return f"{self.end // 60:02d}:{self.end % 60:02d}"
+
+
+class TherapyChange(NamedTuple):
+    """
+    Modifica della terapia già scritta nello storage, notificata ai listener (vedi add_change_listener).
+    upserted: attività aggiunte o modificate (dati JSON attuali); removed: activity_id eliminati.
+    full: upserted contiene tutte le attività (terapia riscritta per intero, o id mancanti/ripetuti).
+    """
+    patient_id: str
+    upserted: List[dict]
+    removed: List[str]
+    full: bool = False
+
+
+class BatchResult(NamedTuple):
+    """Esito di una singola operazione di apply_batch."""
+    op: str
+    applied: bool
+    message: str
+
+
+class _ContextBundle(NamedTuple):
+    """Modelli già caricati (e indice delle attività) di un contesto non attivo."""
+    therapy: Optional[Therapy]
+    patient_profile: Optional[PatientProfile]
+    caregiver_profile: Optional[CaregiverProfile]
+    index: Optional[ScheduleIndex]
+    index_key: Optional[tuple]
+    weight: int
+
+
+@dataclass
+class _JournalState:
+    """Allineamento tra un modello in memoria e il suo snapshot + journal su disco."""
+    model: BaseModel
+    digest: str
+    pending_ops: int
+    size: int
+
+
+def _list_size(model: Optional[BaseModel]) -> int:
+    if model is None:
+        return 0
+    return sum(len(value) for value in vars(model).values() if isinstance(value, list))
+
+
+# Cartella di DATA_DIR per ciascun tipo di entità
+_FOLDERS = {"therapy": "therapies", "patient": "patients", "caregiver": "caregivers"}
+
+
+class JsonFileStorage:
+    """
+    Backend di default: un file JSON per paziente, caregiver e terapia sotto DATA_DIR,
+    con journal append-only delle modifiche e indice anagrafico in memoria.
+
+    Interfaccia comune ai backend (vedi anche SqliteStorage): list_profiles, list_ids,
+    find_id_by_name, first_id, exists, load, read, record, write, write_raw, compact, retain, close.
+    Senza data_dir i file stanno sotto DATA_DIR.
+    """
+
+    def __init__(self, data_dir: Optional[Path] = None):
+        self.data_dir = Path(data_dir) if data_dir is not None else None
+        self._indexes = {
+            "patient": _DirectoryIndex("patients", "patient_id", data_dir=self.data_dir),
+            "caregiver": _DirectoryIndex("caregivers", "caregiver_id", data_dir=self.data_dir),
+        }
+        self._journals: Dict[Path, _JournalState] = {}
+        self._loaded_files: Dict[Path, tuple] = {}
+
+    def path_for(self, kind: str, key: str) -> Path:
+        return (self.data_dir or DATA_DIR) / _FOLDERS[kind] / f"{key}.json"
+
+    def list_ids(self, kind: str) -> List[str]:
+        """Id di tutte le entità del tipo (nomi dei file), in ordine."""
+        root = (self.data_dir or DATA_DIR) / _FOLDERS[kind]
+        if not root.exists():
+            return []
+        return sorted(path.stem for path in root.glob("*.json") if not path.name.startswith("."))
+
+    def list_profiles(self, kind: str) -> List[Dict[str, Optional[str]]]:
+        return self._indexes[kind].as_list()
+
+    def find_id_by_name(self, kind: str, name: str) -> Optional[str]:
+        return self._indexes[kind].find_id_by_name(name)
+
+    def first_id(self, kind: str) -> Optional[str]:
+        return self._indexes[kind].first_id()
+
+    def exists(self, kind: str, key: str) -> bool:
+        return self.path_for(kind, key).exists()
+
+    @staticmethod
+    def _file_version(path: Path) -> tuple:
+        # (mtime, dimensione) di snapshot e journal: cambia a ogni scrittura di uno dei due
+        version = []
+        for candidate in (path, journal.journal_path(path)):
+            try:
+                st = candidate.stat()
+                version.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                version.append(None)
+        return tuple(version)
+
+    def load(self, kind: str, key: str, current: Optional[BaseModel], build):
+        """
+        Restituisce (modello, cambiato). Il file viene riletto e rivalidato solo se la sua versione
+        su disco è cambiata o se `current` non è il modello caricato l'ultima volta.
+        """
+        path = self.path_for(kind, key)
+        cached = self._loaded_files.get(path)
+        if current is not None and cached is not None and cached[1] is current and cached[0] == self._file_version(path):
+            return current, False
+        data, digest = journal.read_snapshot(path)
+        ops = journal.read_ops(path, digest)
+        if ops:
+            data = journal.replay(data, ops)
+        model = build(data)
+        if digest is None:
+            self._journals.pop(path, None)
+        else:
+            self._journals[path] = _JournalState(model, digest, len(ops), _list_size(model))
+            if len(ops) >= journal.JOURNAL_COMPACT_THRESHOLD:
+                self._write_snapshot(path, model)
+        self._loaded_files[path] = (self._file_version(path), model)
+        return model, True
+
+    def read(self, kind: str, key: str) -> Any:
+        """Dati grezzi (snapshot + journal) senza costruire modelli né toccare lo stato di load."""
+        path = self.path_for(kind, key)
+        data, digest = journal.read_snapshot(path)
+        ops = journal.read_ops(path, digest)
+        return journal.replay(data, ops) if ops else data
+
+    def _write_snapshot(self, path: Path, model: BaseModel) -> None:
+        digest = journal.write_snapshot(path, model.model_dump(mode="json"))
+        self._journals[path] = _JournalState(model, digest, 0, _list_size(model))
+        self._mark_written(path, model)
+
+    def _mark_written(self, path: Path, model: BaseModel) -> None:
+        # Il disco ora coincide con il modello in memoria: il prossimo load non deve rileggerlo
+        self._loaded_files[path] = (self._file_version(path), model)
+
+    def write(self, kind: str, key: str, model: BaseModel) -> None:
+        self._write_snapshot(self.path_for(kind, key), model)
+
+    def write_raw(self, kind: str, key: str, data: Any) -> None:
+        """Sostituisce un'entità con dati già validati (importazioni), senza tenerne il modello in memoria."""
+        path = self.path_for(kind, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        journal.write_snapshot(path, data)
+        self._journals.pop(path, None)
+        self._loaded_files.pop(path, None)
+
+    def record(self, kind: str, key: str, model: BaseModel, ops: List[dict]) -> None:
+        """
+        Persiste una modifica già applicata al modello in memoria come righe del journal (costo O(modifica)).
+        Se il modello non è quello caricato dal disco (es. assegnato a mano) si riscrive lo snapshot completo.
+        """
+        path = self.path_for(kind, key)
+        state = self._journals.get(path)
+        expected_size = None
+        if state is not None:
+            delta = sum(1 if op["op"] in ("add", "append") else -1 if op["op"] == "remove" else 0 for op in ops)
+            expected_size = state.size + delta
+        if state is None or state.model is not model or expected_size != _list_size(model) or not path.exists():
+            self._write_snapshot(path, model)
+            return
+        journal.append_ops(path, ops, state.digest)
+        state.pending_ops += len(ops)
+        state.size = expected_size
+        if state.pending_ops >= journal.JOURNAL_COMPACT_THRESHOLD:
+            self._write_snapshot(path, model)
+        else:
+            self._mark_written(path, model)
+
+    def compact(self) -> None:
+        """Riversa nello snapshot JSON tutti i journal con operazioni pendenti."""
+        for path, state in list(self._journals.items()):
+            if state.pending_ops:
+                self._write_snapshot(path, state.model)
+
+    def retain(self, keys: List[tuple]) -> None:
+        """Dimentica lo stato dei file che non appartengono al contesto corrente."""
+        paths = {self.path_for(kind, key) for kind, key in keys}
+        self._loaded_files = {path: value for path, value in self._loaded_files.items() if path in paths}
+        self._journals = {path: value for path, value in self._journals.items() if path in paths}
+
+    def close(self) -> None:
+        pass
+
+
+def default_storage(data_dir: Optional[Path] = None):
+    """
+    Backend scelto da KMCHAT_STORAGE: 'json' (default) o 'sqlite' (database in KMCHAT_SQLITE_PATH,
+    altrimenti <data_dir>/kmchat.sqlite3). data_dir di default: DATA_DIR.
+    """
+    if os.getenv("KMCHAT_STORAGE", "json").strip().lower() == "sqlite":
+        return SqliteStorage(os.getenv("KMCHAT_SQLITE_PATH") or Path(data_dir or DATA_DIR) / SQLITE_FILENAME)
+    return JsonFileStorage(data_dir)
+
+
 class KnowledgeManager:
     def __init__(
         self,
         patient_id: str = None,
         caregiver_id: str = None,
         auto_discover: bool = False,
+        storage=None,
+        context_cache_size: int = CONTEXT_CACHE_SIZE,
+        context_cache_max_items: int = CONTEXT_CACHE_MAX_ITEMS,
     ):
         self.therapy: Optional[Therapy] = None
         self.patient_profile: Optional[PatientProfile] = None
         self.caregiver_profile: Optional[CaregiverProfile] = None
+        self.storage = storage or default_storage()
+        self._index: Optional[ScheduleIndex] = None
+        self._index_key: Optional[tuple] = None
+        self._profile_indexes: Dict[str, ProfileIndex] = {}
+        self._version = 0
+        self._listeners: List[Callable[[TherapyChange], None]] = []
+        # nome -> (week_schedule_key, vista derivata), vedi week_view
+        self._week_views: Dict[str, tuple] = {}
+        # LRU dei contesti lasciati da set_context: (patient_id, caregiver_id) -> modelli caricati
+        self._contexts: "OrderedDict[tuple, _ContextBundle]" = OrderedDict()
+        self.context_cache_size = context_cache_size
+        self.context_cache_max_items = context_cache_max_items
         
         # Discovery automatico solo se richiesto
         if auto_discover:
@@ -33,11 +409,10 @@ class KnowledgeManager:
             logger.warning("Nessun contesto iniziale completo trovato. Usare set_context().")
 
     def _discover_first_id(self, folder_name: str) -> Optional[str]:
-        target_dir = DATA_DIR / folder_name
-        if target_dir.exists():
-            files = sorted(target_dir.glob("*.json"))
-            if files:
-                return files[0].stem
+        if folder_name == "patients":
+            return self.storage.first_id("patient")
+        if folder_name == "caregivers":
+            return self.storage.first_id("caregiver")
         return None
 
     def _get_patient_file(self, pid: str) -> Path:
@@ -50,163 +425,276 @@ class KnowledgeManager:
         return DATA_DIR / "therapies" / f"{pid}.json"
 
     def set_context(self, patient_id: str, caregiver_id: str):
+        if (patient_id, caregiver_id) != (self.current_patient_id, self.current_caregiver_id):
+            self._stash_context()
+            self._restore_context(patient_id, caregiver_id)
         self.current_patient_id = patient_id
         self.current_caregiver_id = caregiver_id
+        # Per un contesto in cache load_data verifica solo le versioni nello storage
         self.load_data()
 
+    def _stash_context(self) -> None:
+        if not self.current_patient_id or self.therapy is None:
+            return
+        weight = 1 + sum(_list_size(m) for m in (self.therapy, self.patient_profile, self.caregiver_profile))
+        key = (self.current_patient_id, self.current_caregiver_id)
+        self._contexts[key] = _ContextBundle(
+            self.therapy, self.patient_profile, self.caregiver_profile, self._index, self._index_key, weight
+        )
+        self._contexts.move_to_end(key)
+        total = sum(bundle.weight for bundle in self._contexts.values())
+        while self._contexts and (len(self._contexts) > self.context_cache_size or total > self.context_cache_max_items):
+            _, evicted = self._contexts.popitem(last=False)
+            total -= evicted.weight
+
+    def _restore_context(self, patient_id: str, caregiver_id: str) -> None:
+        bundle = self._contexts.pop((patient_id, caregiver_id), None)
+        if bundle is None:
+            return
+        self.therapy, self.patient_profile, self.caregiver_profile = (
+            bundle.therapy, bundle.patient_profile, bundle.caregiver_profile
+        )
+        self._index, self._index_key = bundle.index, bundle.index_key
+
+    def _storage_keys(self) -> List[tuple]:
+        # Entità da tenere allineate nello storage: contesto corrente e contesti in cache
+        contexts = [(self.current_patient_id, self.current_caregiver_id), *self._contexts]
+        keys = []
+        for pid, cid in contexts:
+            keys.extend([("therapy", pid), ("patient", pid), ("caregiver", cid or "unknown")])
+        return keys
+
     def get_available_users(self):
-        patients = []
-        caregivers = []
-        if (DATA_DIR / "patients").exists():
-            for f in (DATA_DIR / "patients").glob("*.json"):
-                try:
-                    data = json.loads(f.read_text())
-                    patients.append({"id": data.get("patient_id") or f.stem, "name": data.get("name")})
-                except: pass
-        if (DATA_DIR / "caregivers").exists():
-            for f in (DATA_DIR / "caregivers").glob("*.json"):
-                try:
-                    data = json.loads(f.read_text())
-                    caregivers.append({"id": data.get("caregiver_id") or f.stem, "name": data.get("name")})
-                except: pass
-        return {"patients": patients, "caregivers": caregivers}
+        return {"patients": self.storage.list_profiles("patient"), "caregivers": self.storage.list_profiles("caregiver")}
 
     def find_patient_id_by_name(self, name: str) -> Optional[str]:
-        if not name:
-            return None
-        target = name.strip().lower()
-        if (DATA_DIR / "patients").exists():
-            for f in (DATA_DIR / "patients").glob("*.json"):
-                try:
-                    data = json.loads(f.read_text())
-                    if str(data.get("name", "")).strip().lower() == target:
-                        return str(data.get("patient_id") or f.stem)
-                except Exception:
-                    continue
-        return None
+        return self.storage.find_id_by_name("patient", name)
 
     def find_caregiver_id_by_name(self, name: str) -> Optional[str]:
-        if not name:
-            return None
-        target = name.strip().lower()
-        if (DATA_DIR / "caregivers").exists():
-            for f in (DATA_DIR / "caregivers").glob("*.json"):
-                try:
-                    data = json.loads(f.read_text())
-                    if str(data.get("name", "")).strip().lower() == target:
-                        return str(data.get("caregiver_id") or f.stem)
-                except Exception:
-                    continue
-        return None
+        return self.storage.find_id_by_name("caregiver", name)
+
+    def patient_exists(self, patient_id: str) -> bool:
+        return bool(patient_id) and self.storage.exists("patient", patient_id)
+
+    def caregiver_exists(self, caregiver_id: str) -> bool:
+        return bool(caregiver_id) and self.storage.exists("caregiver", caregiver_id)
 
     def load_data(self):
         if not self.current_patient_id:
             return
 
-        p_file = self._get_patient_file(self.current_patient_id)
+        pid = self.current_patient_id
         # Default caregiver se non presente (può capitare in test parziali)
         c_id = self.current_caregiver_id or "unknown"
-        c_file = self._get_caregiver_file(c_id)
-        t_file = self._get_therapy_file(self.current_patient_id)
-
-        # Therapy
-        if t_file.exists():
-            with open(t_file, "r") as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    self.therapy = Therapy(patient_id=self.current_patient_id, activities=[Activity(**a) for a in data])
-                else:
-                    self.therapy = Therapy(**data)
-        else:
-            self.therapy = Therapy(patient_id=self.current_patient_id, activities=[])
 
-        # Patient Profile
-        if p_file.exists():
-            with open(p_file, "r") as f:
-                self.patient_profile = PatientProfile(**json.load(f))
-        else:
+        # Ogni entità viene riletta e rivalidata solo se la sua versione nello storage è cambiata
+        self.therapy, therapy_changed = self.storage.load("therapy", pid, self.therapy, self._build_therapy)
+        self.patient_profile, patient_changed = self.storage.load(
+            "patient", pid, self.patient_profile, self._build_patient_profile
+        )
+        self.caregiver_profile, caregiver_changed = self.storage.load(
+            "caregiver", c_id, self.caregiver_profile, lambda data: self._build_caregiver_profile(data, c_id)
+        )
+        # Stato di contesti precedenti non più necessario
+        self.storage.retain(self._storage_keys())
+        if therapy_changed:
+            self.invalidate_indexes()
+        if therapy_changed or patient_changed or caregiver_changed:
+            self._version += 1
+
+    @property
+    def version(self) -> int:
+        """Contatore che cambia a ogni modifica dei dati in memoria: utilizzabile come chiave di cache dalle UI."""
+        return self._version
+
+    def _build_therapy(self, data) -> Therapy:
+        if data is None:
+            return Therapy(patient_id=self.current_patient_id, activities=[])
+        if isinstance(data, list):
+            return Therapy(patient_id=self.current_patient_id, activities=[Activity(**a) for a in data])
+        return Therapy(**data)
+
+    def _build_patient_profile(self, data) -> PatientProfile:
+        if data is None:
             # Fallback temporaneo se non esiste
-            self.patient_profile = PatientProfile(patient_id=self.current_patient_id, name="Sconosciuto")
+            return PatientProfile(patient_id=self.current_patient_id, name="Sconosciuto")
+        return PatientProfile(**data)
 
-        # Caregiver Profile
-        if c_file.exists():
-            with open(c_file, "r") as f:
-                self.caregiver_profile = CaregiverProfile(**json.load(f))
-        else:
-            self.caregiver_profile = CaregiverProfile(caregiver_id=c_id, name="Sconosciuto")
+    def _build_caregiver_profile(self, data, c_id: str) -> CaregiverProfile:
+        if data is None:
+            return CaregiverProfile(caregiver_id=c_id, name="Sconosciuto")
+        return CaregiverProfile(**data)
+
+    def _record_ops(self, kind: str, key: str, model: BaseModel, ops: List[dict]) -> None:
+        self.storage.record(kind, key, model, ops)
+        self._version += 1
+
+    def _record_therapy_ops(self, ops: List[dict]) -> None:
+        if self.therapy:
+            self._record_ops("therapy", self.current_patient_id, self.therapy, ops)
+            if self._listeners:
+                self._notify(self._therapy_change(ops))
 
     def save_data(self):
         if self.therapy:
-            t_file = self._get_therapy_file(self.current_patient_id)
-            with open(t_file, "w") as f:
-                f.write(self.therapy.model_dump_json(indent=4))
+            self.storage.write("therapy", self.current_patient_id, self.therapy)
+            self._version += 1
+            if self._listeners:
+                activities = [act.model_dump(mode="json") for act in self.therapy.activities]
+                self._notify(TherapyChange(self.current_patient_id, activities, [], full=True))
+
+    def add_change_listener(self, listener: Callable[[TherapyChange], None]) -> None:
+        """
+        Registra una funzione chiamata dopo ogni modifica persistita delle attività (aggiunte,
+        modifiche, rimozioni anche di un solo giorno, batch, save_data): serve a tenere allineate
+        copie derivate dei dati, come l'indice vettoriale RAG.
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_change_listener(self, listener: Callable[[TherapyChange], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, change: TherapyChange) -> None:
+        # I dati sono già salvati: un listener in errore non deve annullare l'operazione
+        for listener in list(self._listeners):
+            try:
+                listener(change)
+            except Exception:
+                logger.warning("Listener delle modifiche in errore", exc_info=True)
+
+    def _therapy_change(self, ops: List[dict]) -> TherapyChange:
+        """Attività da aggiornare e id da rimuovere per le operazioni del journal appena registrate."""
+        upserted: Dict[str, Any] = {}
+        removed: Dict[str, None] = {}
+        for op in ops:
+            kind = op["op"]
+            if kind == "add":
+                activity_id = op["activity"].get("activity_id")
+                upserted[activity_id] = op["activity"]
+                removed.pop(activity_id, None)
+            elif kind == "update":
+                activity_id = op["fields"].get("activity_id", op["activity_id"])
+                if activity_id != op["activity_id"]:
+                    upserted.pop(op["activity_id"], None)
+                    removed[op["activity_id"]] = None
+                upserted[activity_id] = self._activity_at(op["index"], activity_id)
+            elif kind == "remove":
+                upserted.pop(op["activity_id"], None)
+                removed[op["activity_id"]] = None
+        ids = [act.activity_id for act in self.therapy.activities]
+        present = set(ids)
+        if len(present) != len(ids) or not all(ids) or not all(removed) or any(i in present for i in removed):
+            # Id mancanti o ripetuti (prima o dopo le operazioni): le copie derivate li distinguono
+            # per posizione, quindi si notifica la terapia completa
+            activities = [act.model_dump(mode="json") for act in self.therapy.activities]
+            return TherapyChange(self.current_patient_id, activities, [], full=True)
+        return TherapyChange(
+            self.current_patient_id,
+            [act.model_dump(mode="json") if isinstance(act, Activity) else act for act in upserted.values() if act is not None],
+            [activity_id for activity_id in removed if activity_id],
+        )
+
+    def _activity_at(self, position: Optional[int], activity_id: str) -> Optional[Activity]:
+        # La posizione registrata è quella al momento dell'operazione: nei batch può essere cambiata
+        activities = self.therapy.activities
+        if position is not None and position < len(activities) and activities[position].activity_id == activity_id:
+            return activities[position]
+        return next((act for act in reversed(activities) if act.activity_id == activity_id), None)
+
+    def compact(self) -> None:
+        """Riversa nello snapshot tutte le modifiche ancora nel journal."""
+        self.storage.compact()
+
+    def _profile_index(self, kind: str, profile: BaseModel) -> ProfileIndex:
+        """Indice dei contenuti del profilo, ricostruito solo se il profilo è cambiato fuori dal manager."""
+        index = self._profile_indexes.get(kind)
+        if index is None or not index.is_current(profile):
+            index = self._profile_indexes[kind] = ProfileIndex(profile)
+        return index
 
     def save_knowledge_note(self, category: str, content: str, day: str = None) -> str:
         target_profile = None
-        save_path = None
+        save_key = None
         category = category.lower()
         
         if 'patient' in category or category in ['habits', 'preferences', 'conditions']:
             if not self.patient_profile: return "Errore: Profilo paziente non caricato."
             target_profile = self.patient_profile
-            save_path = self._get_patient_file(self.current_patient_id)
+            save_key = ("patient", self.current_patient_id)
         elif 'caregiver' in category:
             if not self.caregiver_profile: return "Errore: Profilo caregiver non caricato."
             target_profile = self.caregiver_profile
-            save_path = self._get_caregiver_file(self.current_caregiver_id)
+            save_key = ("caregiver", self.current_caregiver_id)
         else:
             return f"Categoria '{category}' non valida."
 
+        index = self._profile_index(save_key[0], target_profile)
+
         # Gestione campi specifici per il paziente
-        if target_profile == self.patient_profile:
-            if category == 'habits':
-                if content not in target_profile.habits:
-                    target_profile.habits.append(content)
-                    with open(save_path, "w") as f: f.write(target_profile.model_dump_json(indent=4))
-                    return "Abitudine salvata."
-                return "Abitudine già presente."
-            elif category == 'preferences':
-                if content not in target_profile.preferences:
-                    target_profile.preferences.append(content)
-                    with open(save_path, "w") as f: f.write(target_profile.model_dump_json(indent=4))
-                    return "Preferenza salvata."
-                return "Preferenza già presente."
-            elif category == 'conditions':
-                if content not in target_profile.medical_conditions:
-                    target_profile.medical_conditions.append(content)
-                    with open(save_path, "w") as f: f.write(target_profile.model_dump_json(indent=4))
-                    return "Condizione medica salvata."
-                return "Condizione medica già presente."
-
-        # Deduplicazione Note
-        for note in target_profile.notes:
-            if note.content == content and note.day == day:
+        if target_profile is self.patient_profile and category in _PATIENT_FIELDS:
+            field, label, saved_msg = _PATIENT_FIELDS[category]
+            existing = index.find(field, content)
+            if existing is not None:
+                return f"{label} già presente." if existing == content else f"{label} già presente (simile a '{existing}')."
+            getattr(target_profile, field).append(content)
+            index.add(field, content)
+            self._record_ops(*save_key, target_profile, [{"op": "append", "field": field, "value": content}])
+            return saved_msg
+
+        # Deduplicazione Note (anche quasi-duplicati: maiuscole, spazi, accenti)
+        existing = index.find("notes", content, day)
+        if existing is not None:
+            if existing == content:
                 return "Nota già presente (duplicato ignorato)."
+            return f"Nota già presente (simile a '{existing}', duplicato ignorato)."
 
         new_note = Note(content=content, day=day)
         target_profile.notes.append(new_note)
-        
-        with open(save_path, "w") as f:
-            f.write(target_profile.model_dump_json(indent=4))
+        index.add("notes", new_note)
+        self._record_ops(*save_key, target_profile, [{"op": "append", "field": "notes", "value": new_note.model_dump(mode="json")}])
             
         return f"Nota salvata correttamente (Giorno: {day or 'Sempre'})."
 
     def _parse_time_to_minutes(self, time_str: str) -> int:
-        try:
-            h, m = map(int, time_str.split(':'))
-            return h * 60 + m
-        except ValueError: return -1
+        return parse_time_to_minutes(time_str)
 
     def _get_time_interval(self, time_str: str, duration_minutes: int | None = None) -> tuple[int, int]:
-        if '-' in time_str:
-            parts = time_str.split('-')
-            start = self._parse_time_to_minutes(parts[0].strip())
-            end = self._parse_time_to_minutes(parts[1].strip())
-            return start, end
-        start = self._parse_time_to_minutes(time_str.strip())
-        if duration_minutes is not None and duration_minutes > 0:
-            return start, start + duration_minutes
-        return start, start + 30
+        return time_interval(time_str, duration_minutes)
+
+    def _therapy_key(self) -> Optional[tuple]:
+        # Riferimenti (non id) per non confondere oggetti ricreati allo stesso indirizzo
+        if not self.therapy:
+            return None
+        return (self.therapy, self.therapy.activities, len(self.therapy.activities))
+
+    def _index_is_current(self) -> bool:
+        if self._index is None or self._index_key is None or not self.therapy:
+            return False
+        therapy, activities, size = self._index_key
+        return therapy is self.therapy and activities is self.therapy.activities and size == len(activities)
+
+    def _schedule_index(self) -> ScheduleIndex:
+        """
+        Indice delle attività, ricostruito solo se la terapia è stata sostituita o la lista
+        è stata modificata dall'esterno (es. append diretto nei test).
+        """
+        if not self._index_is_current():
+            self._index = ScheduleIndex(self.therapy.activities if self.therapy else [])
+            self._index_key = self._therapy_key()
+        return self._index
+
+    def invalidate_indexes(self) -> None:
+        """Da chiamare dopo modifiche alle attività fatte senza passare dai metodi del manager."""
+        self._index = None
+        self._index_key = None
+
+    @contextmanager
+    def _indexed_mutation(self):
+        index = self._schedule_index()
+        yield index
+        self._index_key = self._therapy_key()
 
     def _parse_date(self, date_str: str) -> Optional[date]:
         if not date_str:
@@ -216,60 +704,118 @@ class KnowledgeManager:
         except ValueError:
             return None
 
-    def _is_activity_active_on_date(self, activity: Activity, target_date: date) -> bool:
-        if not target_date:
-            return True
-        start = self._parse_date(activity.valid_from) if activity.valid_from else None
-        end = self._parse_date(activity.valid_until) if activity.valid_until else None
-        if start and target_date < start:
-            return False
-        if end and target_date > end:
-            return False
-        return True
-
     def get_activities_by_day(self, day: str, date_str: str = None) -> List[Activity]:
         if not self.therapy or not day:
             return []
-        target = day.strip()
         target_date = self._parse_date(date_str) if date_str else datetime.today().date()
-        results = []
-        for act in self.therapy.activities:
-            for act_day in act.day_of_week:
-                if act_day.strip() == target and self._is_activity_active_on_date(act, target_date):
-                    results.append(act)
-                    break
-        return results
+        ordinal = target_date.toordinal() if target_date else None
+        return [item.activity for item in self._schedule_index().on_day(day, ordinal)]
 
-    def get_week_schedule(self) -> Dict[str, List[Activity]]:
-        week = {
-            "Lunedì": [],
-            "Martedì": [],
-            "Mercoledì": [],
-            "Giovedì": [],
-            "Venerdì": [],
-            "Sabato": [],
-            "Domenica": [],
-        }
+    def get_activities_between(self, start_date, end_date) -> Dict[date, List[Activity]]:
+        """
+        Attività previste per ogni data dell'intervallo (estremi inclusi, date o stringhe ISO),
+        filtrate per giorno della settimana e finestra di validità.
+        """
+        start = start_date if isinstance(start_date, date) else self._parse_date(start_date)
+        end = end_date if isinstance(end_date, date) else self._parse_date(end_date)
+        if not start or not end or end < start:
+            return {}
+        index = self._schedule_index() if self.therapy else None
+        # Le attività di un giorno della settimana si leggono una sola volta per tutte le sue date
+        per_weekday = [index.on_day(name) if index else [] for name in WEEKDAYS]
+        schedule = {}
+        for ordinal in range(start.toordinal(), end.toordinal() + 1):
+            current = date.fromordinal(ordinal)
+            schedule[current] = [item.activity for item in per_weekday[current.weekday()] if item.active_on(ordinal)]
+        return schedule
+
+    def iter_occurrences(self, start, end) -> Iterator[Occurrence]:
+        """
+        Occorrenze concrete tra `start` e `end` (estremi inclusi, date o stringhe ISO), in ordine
+        cronologico e nel rispetto delle finestre di validità. Generatore: le viste su mesi o
+        trimestri non costruiscono liste intere.
+        """
+        start = start if isinstance(start, date) else self._parse_date(start)
+        end = end if isinstance(end, date) else self._parse_date(end)
+        if not self.therapy or not start or not end or end < start:
+            return
+        # Liste per giorno della settimana già ordinate per orario, calcolate una volta sola
+        per_weekday = self._schedule_index().by_weekday()
+        for ordinal in range(start.toordinal(), end.toordinal() + 1):
+            current = date.fromordinal(ordinal)
+            midnight = datetime.combine(current, datetime.min.time())
+            for item in per_weekday[current.weekday()]:
+                if item.start >= 0 and item.active_on(ordinal):
+                    yield Occurrence(
+                        current, midnight + timedelta(minutes=item.start), midnight + timedelta(minutes=item.end), item.activity
+                    )
+
+    def get_week_schedule(self) -> Mapping[str, Tuple[Activity, ...]]:
+        """
+        Attività per giorno della settimana, ordinate per orario, in sola lettura. È la stessa
+        copia finché la vista non cambia (vedi week_schedule_key); le modifiche successive non la toccano.
+        """
         if not self.therapy:
-            return week
-        for act in self.therapy.activities:
-            for act_day in act.day_of_week:
-                act_day_clean = act_day.strip()
-                if act_day_clean in week:
-                    week[act_day_clean].append(act)
-        return week
+            return MappingProxyType({day: () for day in WEEKDAYS})
+        return self._schedule_index().week()
+
+    def week_view(self, name: str, build: Callable[[Mapping[str, Tuple[Activity, ...]]], Any]) -> Any:
+        """
+        Vista derivata dalla settimana (testo di un tool, tabella della UI) tenuta in cache con il
+        nome `name`: build(get_week_schedule()) viene ricalcolato solo quando week_schedule_key cambia.
+        """
+        key = self.week_schedule_key
+        cached = self._week_views.get(name)
+        if cached is None or cached[0] != key:
+            cached = (key, build(self.get_week_schedule()))
+            self._week_views[name] = cached
+        return cached[1]
+
+    @property
+    def week_schedule_key(self) -> tuple:
+        """Cambia solo quando cambia la vista settimanale: chiave di cache per le viste derivate (UI, tool)."""
+        if not self.therapy:
+            return (None, None)
+        index = self._schedule_index()
+        return (index, index.week_version)
 
     def get_activity_by_name_day(self, name: str, day: str) -> Optional[Activity]:
         if not self.therapy or not name or not day:
             return None
-        target = day.strip()
-        for act in self.therapy.activities:
-            if act.name != name:
-                continue
-            for act_day in act.day_of_week:
-                if act_day.strip() == target:
-                    return act
-        return None
+        return self._schedule_index().find(name, day)
+
+    def _activity_position(self, activity: Activity) -> int:
+        # Confronto per identità: due attività possono avere campi (e id) identici
+        return next(i for i, act in enumerate(self.therapy.activities) if act is activity)
+
+    def find_free_slot(
+        self,
+        duration_minutes: int = None,
+        days: List[str] = None,
+        earliest: str = FREE_SLOT_EARLIEST,
+        latest: str = FREE_SLOT_LATEST,
+        after_dependency: Union[str, List[str]] = None,
+        limit: int = 3,
+    ) -> List[FreeSlot]:
+        """
+        Primi slot senza conflitti comuni a tutti i `days`, tra earliest e latest ("HH:MM").
+        Con after_dependency (un nome o una lista) lo slot non inizia prima di nessuna dipendenza
+        (stessa regola di check_missing_dependencies); se una dipendenza non è prevista in quei
+        giorni non ci sono slot.
+        """
+        duration = duration_minutes if duration_minutes and duration_minutes > 0 else DEFAULT_DURATION_MINUTES
+        lo, hi = parse_time_to_minutes(earliest or FREE_SLOT_EARLIEST), parse_time_to_minutes(latest or FREE_SLOT_LATEST)
+        mask = WeekdayMask.of(days)
+        if not mask or lo < 0 or hi < 0:
+            return []
+        index = self._schedule_index()
+        dependencies = [after_dependency] if isinstance(after_dependency, str) else after_dependency or []
+        for dep_name in dependencies:
+            dep_starts = [item.start for item in index.by_name(dep_name) if item.mask & mask and item.has_interval]
+            if not dep_starts:
+                return []
+            lo = max(lo, max(dep_starts))
+        return [FreeSlot(start, end) for start, end in free_slots(index.busy(mask.names()), duration, lo, hi, limit)]
 
     def check_temporal_conflict(self, new_activity: Activity) -> List[str]:
         conflicts = []
@@ -280,43 +826,70 @@ class KnowledgeManager:
             )
         except: return ["Formato orario non valido"]
 
-        for existing in self.therapy.activities:
-            common_days = set(new_activity.day_of_week) & set(existing.day_of_week)
-            if common_days:
-                try:
-                    ex_start, ex_end = self._get_time_interval(
-                        existing.time,
-                        existing.duration_minutes,
-                    )
-                    if new_start < ex_end and new_end > ex_start:
-                         conflicts.append(f"Conflitto temporale con '{existing.name}' ({existing.time}) nei giorni {common_days}")
-                except: continue
+        index = self._schedule_index()
+        hits = {}
+        for day in WeekdayMask.of(new_activity.day_of_week).names():
+            for item in index.overlapping(day, new_start, new_end):
+                hits.setdefault(item.seq, (item, set()))[1].add(day)
+        for seq in sorted(hits):
+            item, common_days = hits[seq]
+            existing = item.activity
+            conflicts.append(f"Conflitto temporale con '{existing.name}' ({existing.time}) nei giorni {common_days}")
         return conflicts
 
     def check_removal_conflict(self, activity_to_remove: Activity) -> List[str]:
         conflicts = []
-        days_removed = set(activity_to_remove.day_of_week)
-        for existing in self.therapy.activities:
-            if existing.activity_id == activity_to_remove.activity_id: continue
-            if activity_to_remove.name in existing.dependencies:
-                common_days = set(existing.day_of_week) & days_removed
-                if common_days:
-                    conflicts.append(f"Rimozione '{activity_to_remove.name}' rompe la dipendenza per '{existing.name}' nei giorni {common_days}")
+        index = self._schedule_index()
+        hits = {}
+        for day in dict.fromkeys(map(day_key, activity_to_remove.day_of_week)):
+            for item in index.dependents(activity_to_remove.name, day):
+                if item.activity.activity_id == activity_to_remove.activity_id: continue
+                hits.setdefault(item.seq, (item, set()))[1].add(day)
+        for seq in sorted(hits):
+            item, common_days = hits[seq]
+            conflicts.append(f"Rimozione '{activity_to_remove.name}' rompe la dipendenza per '{item.activity.name}' nei giorni {common_days}")
         return conflicts
 
-    def check_missing_dependencies(self, new_activity: Activity) -> List[str]:
+    def get_dependents(self, name: str, day: str = None) -> List[Activity]:
+        """Tutte le attività che dipendono (anche indirettamente) da `name`, nel giorno indicato o in tutti."""
+        if not self.therapy or not name:
+            return []
+        items = self._schedule_index().transitive_dependents(name, [day] if day else None)
+        return [item.activity for item in items]
+
+    def validate_dependencies(self) -> List[str]:
+        """Controlla l'intera terapia: dipendenze mancanti, sequenze errate e cicli."""
+        if not self.therapy:
+            return []
+        report = self._schedule_index().dependency_report()
+        issues = []
+        for (name, day), dep_name in report.missing:
+            issues.append(f"Dipendenza mancante: '{dep_name}' non trovata per '{name}' ({day})")
+        for (name, day), (dep_name, _) in report.misordered:
+            issues.append(f"Errore sequenza: '{name}' inizia prima della dipendenza '{dep_name}' ({day})")
+        if report.cyclic:
+            nodes = ", ".join(f"'{name}' ({day})" for name, day in report.cyclic)
+            issues.append(f"Dipendenze circolari tra: {nodes}")
+        return issues
+
+    def check_missing_dependencies(self, new_activity: Activity, pending: Dict[str, List[Activity]] = None) -> List[str]:
+        """`pending`: attività non ancora in terapia (es. dello stesso batch), per nome, che possono soddisfare le dipendenze."""
         issues = []
-        new_days = set(new_activity.day_of_week)
+        new_days = WeekdayMask.of(new_activity.day_of_week)
         try: new_start, _ = self._get_time_interval(new_activity.time)
         except: new_start = -1
 
+        index = self._schedule_index()
         for dep_name in new_activity.dependencies:
             found_dependency = None
-            for existing in self.therapy.activities:
-                if existing.name == dep_name:
-                    if set(existing.day_of_week) & new_days:
-                        found_dependency = existing
-                        break
+            candidates = [(item.activity, item.mask) for item in index.by_name(dep_name)]
+            candidates.extend(
+                (act, WeekdayMask.of(act.day_of_week)) for act in (pending or {}).get(dep_name, ()) if act is not new_activity
+            )
+            for candidate, mask in candidates:
+                if new_days & mask:
+                    found_dependency = candidate
+                    break
             if not found_dependency:
                 issues.append(f"Dipendenza mancante: '{dep_name}' non trovata nei giorni {new_activity.day_of_week}")
             elif new_start != -1:
@@ -328,38 +901,45 @@ class KnowledgeManager:
         return issues
 
     def remove_activity(self, activity_name: str, day: str, force: bool = False) -> str:
-        target_act = None
-        target_idx = -1
+        message, ops = self._remove_activity(activity_name, day, force)
+        if ops:
+            self._record_therapy_ops(ops)
+        return message
+
+    def _remove_activity(self, activity_name: str, day: str, force: bool) -> tuple[str, List[dict]]:
+        """Applica la rimozione in memoria; restituisce (messaggio, operazioni da registrare)."""
         day_clean = day.strip() if isinstance(day, str) else day
-        for i, act in enumerate(self.therapy.activities):
-            if act.name == activity_name and day_clean in act.day_of_week:
-                target_act = act
-                target_idx = i
-                break
-        
-        if not target_act: return f"Attività '{activity_name}' non trovata per {day_clean}."
+        target_act = self.get_activity_by_name_day(activity_name, day_clean)
+        if not target_act: return f"Attività '{activity_name}' non trovata per {day_clean}.", []
+        target_idx = self._activity_position(target_act)
 
         conflicts = self.check_removal_conflict(target_act)
         if conflicts:
             msg = f"ATTENZIONE: La rimozione crea conflitti di dipendenza: {'; '.join(conflicts)}."
-            if not force: return f"{msg} Aggiungi 'force=True' per procedere comunque."
+            if not force: return f"{msg} Aggiungi 'force=True' per procedere comunque.", []
             logger.warning(f"Forzatura rimozione nonostante conflitti: {conflicts}")
 
-        if len(target_act.day_of_week) > 1:
-            target_act.day_of_week.remove(day_clean)
-            self.save_data()
-            return f"Attività '{activity_name}' rimossa dal giorno {day}."
+        target_key = day_key(day_clean)
+        remaining = [d for d in target_act.day_of_week if day_key(d) != target_key]
+        if remaining:
+            with self._indexed_mutation() as index:
+                seq = index.discard(target_act)
+                target_act.day_of_week[:] = remaining
+                index.add(target_act, seq)
+            return f"Attività '{activity_name}' rimossa dal giorno {day}.", [{
+                "op": "update", "index": target_idx, "activity_id": target_act.activity_id,
+                "fields": {"day_of_week": list(target_act.day_of_week)},
+            }]
         else:
-            self.therapy.activities.pop(target_idx)
-            self.save_data()
-            return f"Attività '{activity_name}' eliminata definitivamente."
+            with self._indexed_mutation() as index:
+                index.discard(target_act)
+                self.therapy.activities.pop(target_idx)
+            return f"Attività '{activity_name}' eliminata definitivamente.", [
+                {"op": "remove", "index": target_idx, "activity_id": target_act.activity_id}
+            ]
 
     def check_update_conflicts(self, old_name: str, day: str, new_data: dict) -> List[str]:
-        target_act = None
-        for act in self.therapy.activities:
-            if act.name == old_name and day in act.day_of_week:
-                target_act = act
-                break
+        target_act = self.get_activity_by_name_day(old_name, day)
         if not target_act: return [f"Attività '{old_name}' non trovata per {day}."]
 
         updated_act = target_act.model_copy(update=new_data)
@@ -382,35 +962,52 @@ class KnowledgeManager:
         return warnings
 
     def update_activity(self, old_name: str, day: str, new_data: dict, force: bool = False) -> str:
-        target_act = None
-        for act in self.therapy.activities:
-            if act.name == old_name and day in act.day_of_week:
-                target_act = act
-                break
-        if not target_act: return f"Attività '{old_name}' non trovata per {day}."
+        message, ops = self._update_activity(old_name, day, new_data, force)
+        if ops:
+            self._record_therapy_ops(ops)
+        return message
+
+    def _update_activity(self, old_name: str, day: str, new_data: dict, force: bool) -> tuple[str, List[dict]]:
+        target_act = self.get_activity_by_name_day(old_name, day)
+        if not target_act: return f"Attività '{old_name}' non trovata per {day}.", []
 
         warnings = self.check_update_conflicts(old_name, day, new_data)
 
         if warnings:
             msg = "; ".join([str(w) for w in warnings])
-            if not force: return f"Impossibile modificare: {msg}. Usa 'force=True' per forzare."
+            if not force: return f"Impossibile modificare: {msg}. Usa 'force=True' per forzare.", []
             logger.warning(f"Forzatura modifica nonostante: {msg}")
 
-        for key, val in new_data.items(): setattr(target_act, key, val)
-        self.save_data()
-        return f"Attività '{old_name}' modificata in '{target_act.name}' con successo."
+        # L'activity_id registrato è quello precedente alla modifica, usato per ritrovarla nel replay
+        activity_id = target_act.activity_id
+        target_idx = self._activity_position(target_act)
+        with self._indexed_mutation() as index:
+            seq = index.discard(target_act)
+            for key, val in new_data.items(): setattr(target_act, key, val)
+            index.add(target_act, seq)
+        return f"Attività '{old_name}' modificata in '{target_act.name}' con successo.", [{
+            "op": "update", "index": target_idx, "activity_id": activity_id,
+            "fields": target_act.model_dump(mode="json", include=set(new_data)),
+        }]
 
-    def add_activity(self, activity: Activity, force: bool = False) -> str:
-        # Prevent exact duplicates (same name, time, overlapping day, and validity window)
-        for existing in self.therapy.activities:
-            if existing.name != activity.name:
-                continue
+    def _is_duplicate(self, activity: Activity, pending: List[Activity] = ()) -> bool:
+        # Stesso nome, orario, finestra di validità e almeno un giorno in comune
+        days = WeekdayMask.of(activity.day_of_week)
+        candidates = [(item.activity, item.mask) for item in self._schedule_index().by_name(activity.name)]
+        candidates.extend((act, WeekdayMask.of(act.day_of_week)) for act in pending)
+        for existing, mask in candidates:
             if existing.time != activity.time:
                 continue
-            if not set(existing.day_of_week) & set(activity.day_of_week):
+            if not days & mask:
                 continue
             if existing.valid_from != activity.valid_from or existing.valid_until != activity.valid_until:
                 continue
+            return True
+        return False
+
+    def add_activity(self, activity: Activity, force: bool = False) -> str:
+        # Prevent exact duplicates (same name, time, overlapping day, and validity window)
+        if self._is_duplicate(activity):
             return "Attività già presente."
 
         warnings = []
@@ -424,7 +1021,133 @@ class KnowledgeManager:
             if not force: return f"Impossibile aggiungere: {msg}. Usa 'force=True' per forzare l'inserimento."
             logger.warning(f"Forzatura aggiunta nonostante: {msg}")
 
-        self.therapy.activities.append(activity)
-        self.save_data()
+        with self._indexed_mutation() as index:
+            self.therapy.activities.append(activity)
+            index.add(activity)
+        self._record_therapy_ops([{"op": "add", "activity": activity.model_dump(mode="json")}])
         logger.info("Attività aggiunta: %s (%s)", activity.name, activity.time)
         return "Attività aggiunta con successo (Forzata)." if force else "Attività aggiunta con successo."
+
+    def apply_batch(self, ops: List[Dict[str, Any]], force: bool = False) -> List[BatchResult]:
+        """
+        Applica più operazioni con un'unica scrittura e restituisce l'esito di ciascuna.
+        Operazioni: {"op": "add", "activity": Activity | dict}, {"op": "update", "name", "day", "data"},
+        {"op": "remove", "name", "day"}.
+        Modifiche e rimozioni vengono applicate per prime, nell'ordine dato; le aggiunte vengono poi
+        validate insieme (vedi _validate_batch_adds).
+        """
+        if not self.therapy:
+            return [BatchResult(str(op.get("op")), False, "Nessuna terapia caricata.") for op in ops]
+        results: List[Optional[BatchResult]] = [None] * len(ops)
+        journal_ops: List[dict] = []
+        adds = []
+        for pos, op in enumerate(ops):
+            kind = op.get("op")
+            if kind == "add":
+                activity = op.get("activity")
+                try:
+                    adds.append((pos, activity if isinstance(activity, Activity) else Activity(**activity)))
+                except Exception as e:
+                    results[pos] = BatchResult(kind, False, f"Attività non valida: {e}")
+            elif kind == "update":
+                message, applied = self._update_activity(op.get("name"), op.get("day"), op.get("data") or {}, force)
+                journal_ops.extend(applied)
+                results[pos] = BatchResult(kind, bool(applied), message)
+            elif kind == "remove":
+                message, applied = self._remove_activity(op.get("name"), op.get("day"), force)
+                journal_ops.extend(applied)
+                results[pos] = BatchResult(kind, bool(applied), message)
+            else:
+                results[pos] = BatchResult(str(kind), False, f"Operazione '{kind}' non supportata.")
+
+        accepted = []
+        for pos, activity, warnings, ok in self._validate_batch_adds(adds, force):
+            if not ok:
+                if warnings == ["Attività già presente."]:
+                    results[pos] = BatchResult("add", False, warnings[0])
+                else:
+                    msg = "; ".join(warnings)
+                    results[pos] = BatchResult("add", False, f"Impossibile aggiungere: {msg}. Usa 'force=True' per forzare l'inserimento.")
+                continue
+            if warnings:
+                logger.warning(f"Forzatura aggiunta nonostante: {'; '.join(warnings)}")
+            accepted.append(activity)
+            results[pos] = BatchResult(
+                "add", True, "Attività aggiunta con successo (Forzata)." if force else "Attività aggiunta con successo."
+            )
+        if accepted:
+            with self._indexed_mutation() as index:
+                for activity in accepted:
+                    self.therapy.activities.append(activity)
+                    index.add(activity)
+            journal_ops.extend({"op": "add", "activity": activity.model_dump(mode="json")} for activity in accepted)
+
+        # Un'unica scrittura per l'intero batch
+        if journal_ops:
+            self._record_therapy_ops(journal_ops)
+        return results
+
+    def check_batch_conflicts(self, activities: List[Activity]) -> List[List[str]]:
+        """Avvisi per ciascuna attività di un'aggiunta multipla, senza applicarla."""
+        if not self.therapy:
+            return [[] for _ in activities]
+        checked = self._validate_batch_adds(list(enumerate(activities)), force=True)
+        return [warnings for _, _, warnings, _ in checked]
+
+    def _validate_batch_adds(self, adds: List[tuple], force: bool) -> List[tuple]:
+        """
+        Valida insieme le aggiunte di un batch: conflitti con la terapia tramite l'indice, conflitti
+        tra le nuove attività con un'unica sweep ordinata per orario, dipendenze anche verso attività
+        dello stesso batch. Tra due nuove attività in conflitto prevale la prima del batch.
+        Restituisce (posizione, attività, avvisi, accettata) nell'ordine del batch.
+        """
+        outcome = {}
+        candidates = []
+        seen: Dict[str, List[Activity]] = {}
+        for pos, activity in adds:
+            if self._is_duplicate(activity, seen.get(activity.name, ())):
+                outcome[pos] = (activity, ["Attività già presente."], False)
+                continue
+            seen.setdefault(activity.name, []).append(activity)
+            candidates.append((pos, activity))
+
+        intervals = []
+        for _, activity in candidates:
+            try:
+                start, end = self._get_time_interval(activity.time, activity.duration_minutes)
+            except Exception:
+                start = end = None
+            intervals.append((start, end, WeekdayMask.of(activity.day_of_week).names()))
+        batch_conflicts = overlapping_pairs(intervals)
+
+        accepted: Dict[int, Activity] = {}
+        warnings: Dict[int, List[str]] = {}
+        for n, (pos, activity) in enumerate(candidates):
+            found = self.check_temporal_conflict(activity)
+            for other, common_days in sorted(batch_conflicts.get(n, {}).items()):
+                if other in accepted:
+                    peer = candidates[other][1]
+                    found.append(f"Conflitto temporale con '{peer.name}' ({peer.time}) nei giorni {common_days}")
+            # Dipendenze verificate in modo ottimistico verso tutto il batch; ricontrollate sotto
+            found.extend(self.check_missing_dependencies(activity, seen))
+            warnings[n] = found
+            if force or not found:
+                accepted[n] = activity
+
+        # Le attività scartate non possono soddisfare dipendenze: si ricontrolla fino a un punto fisso
+        changed = not force
+        while changed:
+            changed = False
+            by_name: Dict[str, List[Activity]] = {}
+            for act in accepted.values():
+                by_name.setdefault(act.name, []).append(act)
+            for n in list(accepted):
+                issues = self.check_missing_dependencies(accepted[n], by_name)
+                if issues:
+                    warnings[n].extend(issues)
+                    del accepted[n]
+                    changed = True
+
+        for n, (pos, activity) in enumerate(candidates):
+            outcome[pos] = (activity, warnings[n], n in accepted)
+        return [(pos, *outcome[pos]) for pos in sorted(outcome)]
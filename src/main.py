@@ -5,12 +5,13 @@ import argparse
 import asyncio
 import json
 import re
+import uuid
 from datetime import date, timedelta
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Mapping, Sequence
 from pathlib import Path
 
 from llama_index.llms.ollama import Ollama
-from llama_index.core import Settings, Document
+from llama_index.core import Settings
 try:
     from llama_index.core import MetadataFilters, ExactMatchFilter
 except Exception:
@@ -18,12 +19,18 @@ except Exception:
     ExactMatchFilter = None
 from llama_index.core import VectorStoreIndex
 from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.embeddings.ollama import OllamaEmbedding
 import chromadb
 
 # Importiamo il nostro cervello logico e i modelli
 from src.knowledge_manager import KnowledgeManager
 from src.models import Activity
+from src.schedule_index import normalize_time_and_duration as _normalize_time_and_duration, time_interval
+from src.weekdays import WEEKDAYS, day_key, weekday_index
+from src.embeddings import get_embed_model
+from src.ingest_data import (
+    COLLECTION_NAME, GUIDELINE_TYPE, changed_in_collection, context_filters, delete_ids, profile_docs,
+)
+from src.rag_sync import STALE_FILENAME, RagSync
 from src.logging_utils import setup_logger
 
 # --- CONFIGURAZIONE ---
@@ -40,6 +47,7 @@ HISTORY_FILE = "session_history.md"
 VALID_TOOLS = [
     "get_schedule",
     "get_schedule_week",
+    "find_free_slot",
     "get_patient_info",
     "get_caregiver_info",
     "add_activity",
@@ -57,9 +65,10 @@ VALID_TOOLS = [
 TOOL_ARG_WHITELIST = {
     "get_schedule": {"day", "date"},
     "get_schedule_week": set(),
+    "find_free_slot": {"duration_minutes", "days", "earliest", "latest", "after_dependency"},
     "get_patient_info": {"category"},
     "get_caregiver_info": {"category"},
-    "add_activity": {"name", "description", "days", "time", "duration_minutes", "dependencies", "force", "valid_from", "valid_until", "duration_days"},
+    "add_activity": {"name", "description", "days", "time", "duration_minutes", "dependencies", "force", "valid_from", "valid_until", "duration_days", "activities"},
     "modify_activity": {"old_name", "day", "new_name", "new_description", "new_time", "new_days", "duration_minutes", "force", "valid_from", "valid_until", "duration_days"},
     "delete_activity": {"name", "day", "force"},
     "consult_guidelines": {"query"},
@@ -93,41 +102,16 @@ def _normalize_duration_minutes(value) -> int | None:
         return int(value.strip())
     return None
 
-def _parse_time_to_minutes(value: str) -> int | None:
-    try:
-        hours, minutes = map(int, value.split(":"))
-        return hours * 60 + minutes
-    except Exception:
-        return None
-
-def _normalize_time_and_duration(time_str: str | None, duration_minutes: int | None) -> tuple[str | None, int | None]:
-    # Normalize time windows into start-time + duration for consistent scheduling logic.
-    if not time_str:
-        return time_str, duration_minutes
-    cleaned = str(time_str).strip()
-    if "-" not in cleaned:
-        return cleaned, duration_minutes
-
-    start_str, end_str = [part.strip() for part in cleaned.split("-", 1)]
-    if duration_minutes is None:
-        start_min = _parse_time_to_minutes(start_str)
-        end_min = _parse_time_to_minutes(end_str)
-        if start_min is not None and end_min is not None and end_min > start_min:
-            duration_minutes = end_min - start_min
-    return start_str, duration_minutes
-
 def _expand_days_for_duration(days: List[str], duration_days: int | None) -> List[str]:
     if not duration_days or not days:
         return days
     if len(days) != 1:
         return days
-    base_day = days[0]
-    day_order = ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"]
-    if base_day not in day_order:
+    start_idx = weekday_index(days[0])
+    if start_idx is None:
         return days
-    start_idx = day_order.index(base_day)
     total = duration_days + 1
-    return [day_order[(start_idx + i) % 7] for i in range(total)]
+    return [WEEKDAYS[(start_idx + i) % 7] for i in range(total)]
 
 def _apply_duration(valid_from: str | None, valid_until: str | None, duration_days: int | None) -> tuple[str | None, str | None]:
     """Calcola valid_until basandosi sulla durata in giorni se specificata."""
@@ -213,30 +197,42 @@ def get_rag_index():
         db_path.mkdir(parents=True, exist_ok=True)
         
     db_client = chromadb.PersistentClient(path=str(db_path))
-    chroma_collection = db_client.get_or_create_collection("patient_therapies")
+    chroma_collection = db_client.get_or_create_collection(COLLECTION_NAME)
     vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    get_rag_index.collection = chroma_collection
     get_rag_index.index = VectorStoreIndex.from_vector_store(vector_store)
     return get_rag_index.index
 
 def reset_rag_index() -> None:
     """Reset cached RAG index after re-ingest or collection changes."""
-    if hasattr(get_rag_index, "index"):
-        delattr(get_rag_index, "index")
-
-def get_rag_context(query: str, patient_name: str | None, caregiver_name: str | None) -> str:
+    for attr in ("index", "collection"):
+        if hasattr(get_rag_index, attr):
+            delattr(get_rag_index, attr)
+
+def get_rag_collection():
+    """Collezione Chroma dell'indice RAG."""
+    get_rag_index()
+    return get_rag_index.collection
+
+# Ogni modifica alle attività salvata dal KnowledgeManager aggiorna anche i vettori RAG
+rag_sync = RagSync(
+    get_rag_index, get_rag_collection, lambda patient_id: km.storage.read("therapy", patient_id),
+    stale_path=Path(DB_DIR) / "chroma_db" / STALE_FILENAME,
+)
+km.add_change_listener(rag_sync)
+
+def _context_retriever(index, patient_id: str | None, caregiver_id: str | None):
+    # Ricerca limitata ai documenti del paziente o del caregiver attivi (pre-filtro in Chroma)
+    return index.as_retriever(similarity_top_k=3, filters=context_filters(patient_id, caregiver_id))
+
+def get_rag_context(query: str, patient_id: str | None, caregiver_id: str | None) -> str:
     if os.getenv("KMCHAT_DISABLE_RAG_CONTEXT") == "1":
         return ""
     if not query:
         return ""
     try:
         index = get_rag_index()
-        retriever = index.as_retriever(similarity_top_k=3)
-        scoped_query = query
-        if patient_name:
-            scoped_query = f"{scoped_query}\nPatient: {patient_name}"
-        if caregiver_name:
-            scoped_query = f"{scoped_query}\nCaregiver: {caregiver_name}"
-        results = retriever.retrieve(scoped_query)
+        results = _context_retriever(index, patient_id, caregiver_id).retrieve(query)
         if not results:
             return "Nessuna informazione specifica trovata nei documenti."
         snippets = []
@@ -252,8 +248,7 @@ def debug_rag_tool(query: str = None) -> str:
         return "Errore: specifica una query per il debug RAG."
     try:
         index = get_rag_index()
-        retriever = index.as_retriever(similarity_top_k=3)
-        results = retriever.retrieve(str(query))
+        results = _context_retriever(index, km.current_patient_id, km.current_caregiver_id).retrieve(str(query))
         if not results:
             return "RAG DEBUG: nessun risultato."
         lines = ["RAG DEBUG (top 3):"]
@@ -270,32 +265,6 @@ def debug_rag_tool(query: str = None) -> str:
     except Exception as exc:
         return f"Errore nel debug RAG: {exc}"
 
-def _index_activity_in_rag(activity: Activity, source: str) -> None:
-    try:
-        index = get_rag_index()
-        text = (
-            f"Attività: {activity.name}\n"
-            f"Descrizione: {activity.description}\n"
-            f"Giorni: {', '.join(activity.day_of_week)}\n"
-            f"Orario: {activity.time}\n"
-            f"Durata (minuti): {activity.duration_minutes if activity.duration_minutes is not None else 'Non specificata'}\n"
-            f"Dipendenze: {', '.join(activity.dependencies) if activity.dependencies else 'Nessuna'}"
-        )
-        meta = {
-            "type": "therapy_activity",
-            "source": source,
-            "activity_id": activity.activity_id,
-            "patient_id": km.current_patient_id,
-            "caregiver_id": km.current_caregiver_id,
-        }
-        if activity.valid_from:
-            meta["valid_from"] = activity.valid_from
-        if activity.valid_until:
-            meta["valid_until"] = activity.valid_until
-        index.insert(Document(text=text, metadata=meta))
-    except Exception:
-        pass
-
 # --- TOOL ROUTING HELPERS ---
 def _parse_action_string(text: str) -> Dict[str, Any] | None:
     """
@@ -422,6 +391,29 @@ def _normalize_tool_action(data: Dict[str, Any]) -> Dict[str, Any]:
         
     return data
 
+def _sanitize_add_activity_args(filtered: Dict[str, Any]) -> Dict[str, Any]:
+    days = filtered.get("days")
+    if isinstance(days, str):
+        filtered["days"] = [days]
+    elif days is None:
+        filtered["days"] = []
+    filtered["days"] = [d.strip() for d in filtered["days"] if isinstance(d, str) and d.strip()]
+    if filtered.get("dependencies") is None:
+        filtered["dependencies"] = []
+    if isinstance(filtered.get("time"), str):
+        filtered["time"] = filtered["time"].strip()
+    filtered["time"], filtered["duration_minutes"] = _normalize_time_and_duration(
+        filtered.get("time"),
+        filtered.get("duration_minutes"),
+    )
+    if not filtered.get("description"):
+        filtered["description"] = filtered.get("name", "")
+    if "duration_minutes" in filtered:
+        filtered["duration_minutes"] = _normalize_duration_minutes(filtered.get("duration_minutes"))
+    if "duration_days" in filtered:
+        filtered["duration_days"] = _normalize_duration_days(filtered.get("duration_days"))
+    return filtered
+
 def _sanitize_tool_args(tool_name: str, args: Dict[str, Any], user_input: str | None = None) -> Dict[str, Any]:
     if not isinstance(args, dict):
         return {}
@@ -436,27 +428,30 @@ def _sanitize_tool_args(tool_name: str, args: Dict[str, Any], user_input: str |
             filtered["day"] = filtered["day"].strip()
         if filtered.get("date") is not None:
             filtered["date"] = str(filtered["date"]).strip()
-    elif tool_name == "add_activity":
+    elif tool_name == "find_free_slot":
         days = filtered.get("days")
         if isinstance(days, str):
-            filtered["days"] = [days]
-        elif days is None:
-            filtered["days"] = []
-        filtered["days"] = [d.strip() for d in filtered["days"] if isinstance(d, str) and d.strip()]
-        if filtered.get("dependencies") is None:
-            filtered["dependencies"] = []
-        if isinstance(filtered.get("time"), str):
-            filtered["time"] = filtered["time"].strip()
-        filtered["time"], filtered["duration_minutes"] = _normalize_time_and_duration(
-            filtered.get("time"),
-            filtered.get("duration_minutes"),
-        )
-        if not filtered.get("description"):
-            filtered["description"] = filtered.get("name", "")
+            days = [days]
+        filtered["days"] = [d.strip() for d in days or [] if isinstance(d, str) and d.strip()]
         if "duration_minutes" in filtered:
             filtered["duration_minutes"] = _normalize_duration_minutes(filtered.get("duration_minutes"))
-        if "duration_days" in filtered:
-            filtered["duration_days"] = _normalize_duration_days(filtered.get("duration_days"))
+        for key in ("earliest", "latest", "after_dependency"):
+            if isinstance(filtered.get(key), str):
+                filtered[key] = filtered[key].strip() or None
+    elif tool_name == "add_activity":
+        activities = filtered.get("activities")
+        if isinstance(activities, dict):
+            activities = [activities]
+        if isinstance(activities, list) and activities:
+            # Più attività nella stessa richiesta: ogni elemento ha gli stessi campi di add_activity
+            item_fields = allowed - {"activities", "force"}
+            filtered["activities"] = [
+                _sanitize_add_activity_args({k: v for k, v in item.items() if k in item_fields})
+                for item in activities if isinstance(item, dict)
+            ]
+        else:
+            filtered.pop("activities", None)
+            filtered = _sanitize_add_activity_args(filtered)
     elif tool_name == "modify_activity":
         day = filtered.get("day")
         if isinstance(day, list):
@@ -498,7 +493,9 @@ def _coerce_tool_call(llm_fast, user_input: str) -> Dict[str, Any] | None:
         "Sei un router di tool molto rigido. Restituisci SOLO un JSON valido.\n"
         "Strumenti disponibili:\n"
         "- get_schedule(day)\n"
+        "- find_free_slot(duration_minutes, days, earliest=None, latest=None, after_dependency=None)\n"
         "- add_activity(name, description, days, time, duration_minutes=None, dependencies=[], force=False)\n"
+        "  oppure add_activity(activities=[{name, days, time, ...}, ...]) per più attività insieme\n"
         "- modify_activity(old_name, day, new_name, new_description, new_time, new_days, duration_minutes=None, force=False)\n"
         "- delete_activity(name, day, force=False)\n"
         "- consult_guidelines(query)\n"
@@ -522,8 +519,9 @@ def _coerce_tool_call(llm_fast, user_input: str) -> Dict[str, Any] | None:
         "10) Se l'utente chiede note del paziente, usa get_patient_info con category notes.\n"
         "11) Se l'utente chiede note del caregiver, usa get_caregiver_info con category notes.\n"
         "12) Se l'utente chiede un debug RAG, usa debug_rag(query).\n"
-        "13) Giorni ammessi: Lunedì, Martedì, Mercoledì, Giovedì, Venerdì, Sabato, Domenica (accento grave).\n"
-        "14) Altrimenti, rispondi con {\"action\":\"reply\",\"message\":\"...\"}.\n\n"
+        "13) Se l'utente chiede quando c'è un orario libero, usa find_free_slot.\n"
+        "14) Giorni ammessi: Lunedì, Martedì, Mercoledì, Giovedì, Venerdì, Sabato, Domenica (accento grave).\n"
+        "15) Altrimenti, rispondi con {\"action\":\"reply\",\"message\":\"...\"}.\n\n"
         "Esempio modify_activity:\n"
         "{\"action\":\"call_tool\",\"tool_name\":\"modify_activity\",\"arguments\":{\"old_name\":\"Camminata\",\"day\":\"Lunedì\",\"new_name\":\"Cyclette al chiuso\",\"new_time\":\"18:00\"}}\n\n"
         "Esempio durata:\n"
@@ -621,6 +619,8 @@ def _execute_tool(tname: str, args: Dict[str, Any]) -> str:
         return get_schedule_tool(**args)
     if tname == "get_schedule_week":
         return get_schedule_week_tool()
+    if tname == "find_free_slot":
+        return find_free_slot_tool(**args)
     if tname == "get_patient_info":
         return get_patient_info_tool(**args)
     if tname == "get_caregiver_info":
@@ -671,19 +671,17 @@ def save_knowledge_tool(category: str, content: str | dict | None = None, day: s
     else: category = "patient"
     
     km_result = km.save_knowledge_note(category, content, day=day)
+    kind, owner_id = ("caregiver", km.current_caregiver_id) if category == "caregiver" else ("patient", km.current_patient_id)
     index = get_rag_index()
-    if index:
-        meta = {
-            "category": category,
-            "source": "chat",
-            "type": "extracted",
-            "patient_id": km.current_patient_id,
-            "caregiver_id": km.current_caregiver_id,
-        }
-        if day: meta["validity_day"] = day
-        doc = Document(text=f"[{day or 'Always'}] {content}", metadata=meta)
-        index.insert(doc)
-        return f"{km_result} e indicizzata."
+    if index and owner_id:
+        # Stessi id e hash di ingest_data: la prossima ingestion trova la nota invariata
+        docs = profile_docs(kind, km.storage.read(kind, owner_id), owner_id)
+        collection = get_rag_collection()
+        changed = list(changed_in_collection(docs, collection))
+        if changed:
+            delete_ids(collection, [doc.id_ for doc in changed])
+            index.insert_nodes(changed)
+            return f"{km_result} e indicizzata."
     return km_result
 
 def switch_context_tool(patient_id: str = None, caregiver_id: str = None) -> str:
@@ -696,21 +694,21 @@ def switch_context_tool(patient_id: str = None, caregiver_id: str = None) -> str
     pid = str(pid).strip() if pid is not None else pid
     cid = str(cid).strip() if cid is not None else cid
 
-    # Resolve names to IDs when a direct file match is missing.
+    # Resolve names to IDs when a direct ID match is missing.
     if pid:
-        p_file = Path("data") / "patients" / f"{pid}.json"
-        if not p_file.exists():
+        if not km.patient_exists(pid):
             resolved = km.find_patient_id_by_name(pid)
             if resolved:
                 pid = resolved
     if cid:
-        c_file = Path("data") / "caregivers" / f"{cid}.json"
-        if not c_file.exists():
+        if not km.caregiver_exists(cid):
             resolved = km.find_caregiver_id_by_name(cid)
             if resolved:
                 cid = resolved
 
     km.set_context(str(pid), str(cid))
+    # Terapia rimasta non allineata nell'indice RAG (errore precedente o import esterno)
+    rag_sync.reconcile_stale([km.current_patient_id])
     return f"Contesto aggiornato: {km.patient_profile.name}, {km.caregiver_profile.name}."
 
 def delete_activity_tool(name: str, day: str, force: bool = False, confirm: bool = False) -> str:
@@ -811,12 +809,42 @@ def modify_activity_tool(
         ) + warning_msg
 
     # 5. Esecuzione Reale
-    result = km.update_activity(old_name, day, updates, force=force)
-    if "successo" in result.lower():
-        updated = km.get_activity_by_name_day(new_name or old_name, day)
-        if updated:
-            _index_activity_in_rag(updated, "modify")
-    return result
+    return km.update_activity(old_name, day, updates, force=force)
+
+def _new_activity_id() -> str:
+    # Univoco anche per più attività create nello stesso secondo (id del documento RAG)
+    return f"act_{uuid.uuid4().hex[:12]}"
+
+def _build_activity(
+    name: str,
+    description: str,
+    days: List[str],
+    time: str,
+    duration_minutes: int | None,
+    dependencies: List[str],
+    valid_from: str | None,
+    valid_until: str | None,
+    duration_days: int | None,
+    activity_id: str,
+) -> Activity:
+    valid_from, valid_until = _apply_duration(valid_from, valid_until, duration_days)
+    time, duration_minutes = _normalize_time_and_duration(time, duration_minutes)
+
+    # Pulizia giorni: nomi canonici ("monday" -> "Lunedì"), senza duplicati
+    clean_days = list(dict.fromkeys(day_key(d) for d in days if isinstance(d, str) and d.strip()))
+    clean_days = _expand_days_for_duration(clean_days, duration_days)
+
+    return Activity(
+        activity_id=activity_id,
+        name=name,
+        description=description or name,
+        day_of_week=clean_days,
+        time=time,
+        duration_minutes=duration_minutes,
+        dependencies=dependencies or [],
+        valid_from=valid_from,
+        valid_until=valid_until,
+    )
 
 def add_activity_tool(
     name: str = None,
@@ -830,10 +858,13 @@ def add_activity_tool(
     valid_from: str | None = None,
     valid_until: str | None = None,
     duration_days: int | None = None,
+    activities: List[Dict[str, Any]] | None = None,
 ) -> str:
     context_error = _ensure_patient_context()
     if context_error:
         return context_error
+    if activities:
+        return _add_activities_batch(activities, force=force, confirm=confirm)
     # 1. Validazione Parametri Base
     if not name:
         return "Errore: Devi specificare il NOME dell'attività."
@@ -844,26 +875,12 @@ def add_activity_tool(
 
     try:
         # 2. Creazione Oggetto Temporaneo per Controlli
-        import time as t
-        temp_id = f"temp_{int(t.time())}"
-        valid_from, valid_until = _apply_duration(valid_from, valid_until, duration_days)
-        time, duration_minutes = _normalize_time_and_duration(time, duration_minutes)
-        
-        # Pulizia giorni
-        clean_days = [d.strip() for d in days if isinstance(d, str) and d.strip()]
-        clean_days = _expand_days_for_duration(clean_days, duration_days)
-        
-        new_activity = Activity(
-            activity_id=temp_id,
-            name=name,
-            description=description or name,
-            day_of_week=clean_days,
-            time=time,
-            duration_minutes=duration_minutes,
-            dependencies=dependencies,
-            valid_from=valid_from,
-            valid_until=valid_until,
+        new_activity = _build_activity(
+            name, description, days, time, duration_minutes, dependencies,
+            valid_from, valid_until, duration_days, _new_activity_id(),
         )
+        valid_from, valid_until = new_activity.valid_from, new_activity.valid_until
+        time, duration_minutes = new_activity.time, new_activity.duration_minutes
 
         # 3. Controllo Conflitti (PRE-CONFERMA)
         warnings = []
@@ -872,6 +889,9 @@ def add_activity_tool(
             t_conflicts = km.check_temporal_conflict(new_activity)
             if t_conflicts:
                 warnings.extend(t_conflicts)
+                alternatives = _suggest_free_slots(new_activity)
+                if alternatives:
+                    warnings.append(f"Orari liberi alternativi: {alternatives}")
             
             # Conflitti Semantici (solo se non forzato)
             sem_warning = check_semantic_conflict(name, description or name)
@@ -911,17 +931,98 @@ def add_activity_tool(
             ) + warning_msg
 
         # 5. Esecuzione Reale (Post-Conferma)
-        result = km.add_activity(new_activity, force=force)
-        
-        if "successo" in result.lower():
-            _index_activity_in_rag(new_activity, "add")
-            
-        return result
+        return km.add_activity(new_activity, force=force)
 
     except Exception as e:
         logger.exception("Error in add_activity_tool")
         return f"Errore interno: {str(e)}"
 
+def _activity_duration(activity: Activity) -> int | None:
+    try:
+        start, end = time_interval(activity.time, activity.duration_minutes)
+    except Exception:
+        return activity.duration_minutes
+    return end - start if end > start >= 0 else activity.duration_minutes
+
+def _format_free_slots(slots) -> str:
+    return ", ".join(f"{slot.time}-{slot.end_time}" for slot in slots)
+
+def _suggest_free_slots(activity: Activity) -> str:
+    """Slot liberi da proporre nello stesso turno quando l'orario richiesto è in conflitto."""
+    slots = km.find_free_slot(
+        _activity_duration(activity), activity.day_of_week,
+        after_dependency=activity.dependencies,
+    )
+    return _format_free_slots(slots)
+
+def find_free_slot_tool(
+    duration_minutes: int | None = None,
+    days: List[str] | None = None,
+    earliest: str | None = None,
+    latest: str | None = None,
+    after_dependency: str | None = None,
+) -> str:
+    context_error = _ensure_patient_context()
+    if context_error:
+        return context_error
+    if not days:
+        return "Errore: specifica almeno un GIORNO in cui cercare lo slot."
+    slots = km.find_free_slot(duration_minutes, days, earliest, latest, after_dependency)
+    if not slots:
+        if after_dependency and not any(km.get_activity_by_name_day(after_dependency, d) for d in days):
+            return f"Nessuno slot: '{after_dependency}' non è prevista nei giorni {', '.join(days)}."
+        return f"Nessuno slot libero nei giorni {', '.join(days)}."
+    return f"Slot liberi ({', '.join(days)}): {_format_free_slots(slots)}"
+
+def _add_activities_batch(items: List[Dict[str, Any]], force: bool = False, confirm: bool = False) -> str:
+    """Aggiunta di più attività in un'unica operazione: conflitti valutati insieme, una sola scrittura."""
+    errors = []
+    for i, item in enumerate(items, start=1):
+        label = item.get("name") or f"#{i}"
+        if not item.get("name"):
+            errors.append(f"{label}: manca il NOME")
+        if not item.get("days"):
+            errors.append(f"{label}: manca il GIORNO")
+        if not item.get("time"):
+            errors.append(f"{label}: manca l'ORARIO")
+    if errors:
+        return "Errore: " + "; ".join(errors) + "."
+
+    try:
+        new_activities = [
+            _build_activity(
+                item["name"], item.get("description", ""), item["days"], item["time"],
+                item.get("duration_minutes"), item.get("dependencies"), item.get("valid_from"),
+                item.get("valid_until"), item.get("duration_days"), _new_activity_id(),
+            )
+            for item in items
+        ]
+
+        if not confirm:
+            warnings = []
+            if not force:
+                for activity, issues in zip(new_activities, km.check_batch_conflicts(new_activities)):
+                    sem_warning = _shorten_semantic_warning(check_semantic_conflict(activity.name, activity.description))
+                    if sem_warning:
+                        issues = issues + [f"Avviso Semantico: {sem_warning}"]
+                    if issues:
+                        warnings.append(f"{activity.name}: {'; '.join(issues)}")
+            warning_msg = ""
+            if warnings:
+                warning_msg = f"\n⚠️ ATTENZIONE: {' | '.join(warnings)}."
+                warning_msg += "\nPer procedere comunque, conferma l'azione (verrà applicato force=True)."
+                force = True
+            return _stage_action(
+                "add_activity", {"activities": items, "force": force, "confirm": True}
+            ) + warning_msg
+
+        results = km.apply_batch([{"op": "add", "activity": a} for a in new_activities], force=force)
+        return "\n".join(f"- {activity.name}: {result.message}" for activity, result in zip(new_activities, results))
+
+    except Exception as e:
+        logger.exception("Error in add_activity batch")
+        return f"Errore interno: {str(e)}"
+
 def get_schedule_tool(day: str = None, date: str = None) -> str:
     context_error = _ensure_patient_context()
     if context_error:
@@ -942,7 +1043,10 @@ def get_schedule_week_tool() -> str:
     context_error = _ensure_patient_context()
     if context_error:
         return context_error
-    week = km.get_week_schedule()
+    # Il testo viene riformattato solo quando la vista settimanale del manager cambia
+    return km.week_view("week_text", _format_week_schedule)
+
+def _format_week_schedule(week: Mapping[str, Sequence[Activity]]) -> str:
     output = "Programma settimanale:\n"
     for day, activities in week.items():
         output += f"{day}:\n"
@@ -1021,7 +1125,7 @@ def consult_guidelines_tool(query: str) -> str:
     index = get_rag_index()
     if not index: return "Errore: DB non trovato."
     if MetadataFilters and ExactMatchFilter:
-        filters = MetadataFilters(filters=[ExactMatchFilter(key="type", value="guideline")])
+        filters = MetadataFilters(filters=[ExactMatchFilter(key="type", value=GUIDELINE_TYPE)])
         return str(index.as_query_engine(similarity_top_k=3, filters=filters).query(query))
     return str(index.as_query_engine(similarity_top_k=3).query(query))
 
@@ -1063,7 +1167,7 @@ def build_system_prompt(user_input: str, strict: bool = False):
 
     # 2. Contesto Dinamico
     chat_history = session.get_recent_history()
-    rag_context = get_rag_context(user_input, p_profile.name if p_profile else None, c_profile.name if c_profile else None)
+    rag_context = get_rag_context(user_input, km.current_patient_id, km.current_caregiver_id)
     available = km.get_available_users()
 
     strict_suffix = ""
@@ -1127,15 +1231,16 @@ Caregivers: {available.get("caregivers")}
    - Se l'utente chiede "note del caregiver", usa `get_caregiver_info(category="notes")`.
 10. FORMATI: Usa SOLO questi giorni: Lunedì, Martedì, Mercoledì, Giovedì, Venerdì, Sabato, Domenica. Accento grave su ì/è (non í/é).
 11. FORMATI ORA: Se l'utente fornisce un intervallo "HH:MM-HH:MM", converti in orario iniziale + `duration_minutes`. Non usare parole come "sera".
-12. MULTI-AZIONE: Se l'utente chiede più azioni nello stesso messaggio, usa `reply` per chiedere di separarle.
+12. MULTI-AZIONE: Se l'utente chiede di aggiungere più attività nello stesso messaggio, usa un solo `add_activity` con `activities=[{...}, {...}]`. Per altre combinazioni di azioni usa `reply` per chiedere di separarle.
 13. STILE: Risposte concise, senza saluti o firme.
 
 STRUMENTI:
 - `get_schedule(day)`
 - `get_schedule_week()`
+- `find_free_slot(duration_minutes, days, earliest=None, latest=None, after_dependency=None)`: Primi orari liberi comuni ai giorni indicati.
 - `get_patient_info(category)`
 - `get_caregiver_info(category)`
-- `add_activity(name, days, time, duration_minutes=None, dependencies=[], force=False)`
+- `add_activity(name, days, time, duration_minutes=None, dependencies=[], force=False)` oppure `add_activity(activities=[{name, days, time, ...}, ...])`
 - `modify_activity(...)`
 - `delete_activity(name, day)`
 - `save_knowledge(category, content)`: Categorie: 'conditions', 'preferences', 'habits', 'caregiver'.
@@ -1157,6 +1262,8 @@ User: "Dimmi le attività di martedì"
 JSON: {{"action": "call_tool", "tool_name": "get_schedule", "arguments": {{"day": "Martedì"}}}}
 User: "Dimmi le attività della settimana"
 JSON: {{"action": "call_tool", "tool_name": "get_schedule_week", "arguments": {{}}}}
+User: "Quando posso mettere 45 minuti di fisioterapia lunedì pomeriggio?"
+JSON: {{"action": "call_tool", "tool_name": "find_free_slot", "arguments": {{"duration_minutes": 45, "days": ["Lunedì"], "earliest": "14:00"}}}}
 User: "Aggiungi attività 'Ossigenoterapia' mercoledì"
 JSON: {{"action": "reply", "message": "A che ora vuoi aggiungere l'attività?"}}
 User: "Quali sono le note del paziente?"
@@ -1173,6 +1280,8 @@ User: "Aggiungi controllo pressione martedì alle 09:00 per i prossimi 2 giorni"
 JSON: {{"action": "call_tool", "tool_name": "add_activity", "arguments": {{"name": "Controllo pressione", "days": ["Martedì", "Mercoledì", "Giovedì"], "time": "09:00", "duration_days": 2}}}}
 User: "Aggiungi camomilla mercoledì di sera"
 JSON: {{"action": "call_tool", "tool_name": "add_activity", "arguments": {{"name": "Camomilla", "days": ["Mercoledì"], "time": "21:00"}}}}
+User: "Aggiungi colazione alle 08:00 e pastiglia alle 08:30 il lunedì"
+JSON: {{"action": "call_tool", "tool_name": "add_activity", "arguments": {{"activities": [{{"name": "Colazione", "days": ["Lunedì"], "time": "08:00"}}, {{"name": "Pastiglia", "days": ["Lunedì"], "time": "08:30"}}]}}}}
 User: "La mia visita abituale è alle 18:00"
 JSON: {{"action": "call_tool", "tool_name": "save_knowledge", "arguments": {{"category": "caregiver", "content": "La mia visita abituale è alle 18:00"}}}}
 {strict_suffix}
@@ -1293,7 +1402,7 @@ async def run_agent_step(llms: Dict, user_input: str) -> AsyncGenerator[str, Non
                     final_reply = f"{auto_confirm_msg}\n{final_reply}"
                 yield final_reply
             elif (
-                tname in {"get_schedule", "get_schedule_week", "get_patient_info", "get_caregiver_info", "switch_context", "confirm_action", "get_context"}
+                tname in {"get_schedule", "get_schedule_week", "find_free_slot", "get_patient_info", "get_caregiver_info", "switch_context", "confirm_action", "get_context"}
                 or str(res).startswith("Azione in sospeso:")
                 or str(res).startswith("Errore")
                 or str(res).startswith("BLOCCO SEMANTICO")
@@ -1366,9 +1475,11 @@ async def main():
     
     # Global Settings use SMART by default for internal logic checks
     Settings.llm = llm_smart 
-    Settings.embed_model = OllamaEmbedding(model_name="nomic-embed-text")
+    Settings.embed_model = get_embed_model()
 
     llms = {"FAST": llm_fast, "SMART": llm_smart}
+    # Pazienti rimasti non allineati nell'indice RAG dalle sessioni precedenti
+    rag_sync.reconcile_stale()
 
     if args.test_prompt:
         print(f"\n🧪 Test: {args.test_prompt}")
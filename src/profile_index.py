@@ -0,0 +1,59 @@
+"""
+Indice dei contenuti dei profili (paziente e caregiver) per la deduplicazione delle note.
+
+Per ogni campo lista del profilo (habits, preferences, notes, ...) tiene un dict
+forma normalizzata -> contenuto originale: un duplicato, anche solo "quasi" uguale
+(maiuscole, spazi, accenti), si trova con un lookup invece di una scansione.
+"""
+from typing import Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+from src.models import Note
+from src.text_normalize import fold_text
+
+
+def entry_key(value):
+    # Le note sono uguali solo se coincidono anche nel giorno di validità
+    if isinstance(value, Note):
+        return fold_text(value.day), fold_text(value.content)
+    return fold_text(value)
+
+
+def _content(value) -> str:
+    return value.content if isinstance(value, Note) else str(value)
+
+
+class ProfileIndex:
+    """Indice di un singolo profilo; va aggiornato con add a ogni elemento aggiunto."""
+
+    def __init__(self, profile: BaseModel):
+        self.profile = profile
+        self._entries: Dict[str, Dict[object, str]] = {}
+        for field, values in vars(profile).items():
+            if isinstance(values, list):
+                entries = self._entries[field] = {}
+                for value in values:
+                    entries.setdefault(entry_key(value), _content(value))
+        self._shape = self._current_shape()
+
+    def _current_shape(self) -> Tuple:
+        # Riferimenti e lunghezze delle liste: cambiano se il profilo è stato modificato dall'esterno
+        return tuple((field, values, len(values)) for field, values in vars(self.profile).items() if isinstance(values, list))
+
+    def is_current(self, profile: BaseModel) -> bool:
+        if profile is not self.profile:
+            return False
+        current = self._current_shape()
+        return len(current) == len(self._shape) and all(
+            a[0] == b[0] and a[1] is b[1] and a[2] == b[2] for a, b in zip(current, self._shape)
+        )
+
+    def find(self, field: str, content: str, day: Optional[str] = None) -> Optional[str]:
+        """Contenuto già presente equivalente a `content` (per le note anche nello stesso giorno), se esiste."""
+        key = (fold_text(day), fold_text(content)) if field == "notes" else fold_text(content)
+        return self._entries.get(field, {}).get(key)
+
+    def add(self, field: str, value) -> None:
+        self._entries.setdefault(field, {}).setdefault(entry_key(value), _content(value))
+        self._shape = self._current_shape()
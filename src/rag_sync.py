@@ -0,0 +1,146 @@
+"""
+Allineamento dell'indice vettoriale RAG alle attività salvate dal KnowledgeManager.
+
+RagSync è un listener delle modifiche (KnowledgeManager.add_change_listener): i documenti hanno
+gli stessi id e testi di ingest_data, quindi aggiunte e modifiche sostituiscono il vettore
+precedente, le eliminazioni lo rimuovono e la rimozione di un solo giorno lo ricalcola.
+
+I pazienti non allineati (scrittura nel DB vettoriale fallita, oppure terapie scritte senza
+passare dal manager, come in bulk_import) sono elencati in un file accanto al DB Chroma, così
+il segnale sopravvive ai riavvii: vengono riconciliati per intero con i dati salvati (confronto
+degli hash, embedding solo dei documenti cambiati) alla modifica successiva, all'avvio e al
+cambio di contesto (reconcile_stale). Un'ingestion completa svuota l'elenco.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set
+
+from src.ingest_data import (
+    activity_doc_id, build_activity_doc, changed_documents, delete_ids, existing_hashes, therapy_docs,
+)
+from src.knowledge_manager import TherapyChange
+
+if TYPE_CHECKING:
+    from llama_index.core import Document, VectorStoreIndex
+
+ACTIVITY_DOC_TYPE = "therapy_activity"
+# Elenco dei pazienti da riallineare, nella cartella del DB Chroma
+STALE_FILENAME = "rag_stale.json"
+logger = logging.getLogger("kmchat.rag_sync")
+
+
+def read_stale(path: Optional[Path]) -> Set[str]:
+    if path is None:
+        return set()
+    try:
+        return set(json.loads(Path(path).read_text(encoding="utf-8")))
+    except FileNotFoundError:
+        return set()
+    except Exception:
+        logger.warning("Elenco dei pazienti da riallineare %s non leggibile: ignorato.", path)
+        return set()
+
+
+def write_stale(path: Path, patient_ids: Iterable[str]) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(sorted(patient_ids)), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def mark_stale(path: Path, patient_ids: Iterable[str]) -> None:
+    """Segna i pazienti da riallineare: per chi scrive le terapie senza passare dal KnowledgeManager."""
+    stale = read_stale(path)
+    new = set(patient_ids) - stale
+    if new:
+        write_stale(path, stale | new)
+
+
+def _activities_of(data: Any) -> List[dict]:
+    # Terapia grezza dallo storage: {"activities": [...]} oppure lista (formato legacy)
+    activities = data.get("activities") if isinstance(data, dict) else data
+    return [act for act in activities or () if isinstance(act, dict)]
+
+
+class RagSync:
+    def __init__(
+        self,
+        get_index: Callable[[], VectorStoreIndex],
+        get_collection: Callable[[], Any],
+        read_therapy: Callable[[str], Any],
+        stale_path: Optional[Path] = None,
+    ):
+        self._get_index = get_index
+        self._get_collection = get_collection
+        self._read_therapy = read_therapy
+        # Senza stale_path l'elenco dei pazienti da riallineare resta solo in memoria
+        self.stale_path = Path(stale_path) if stale_path else None
+        self.stale: Set[str] = read_stale(self.stale_path)
+
+    def __call__(self, change: TherapyChange) -> None:
+        try:
+            if change.full or change.patient_id in self.stale:
+                self.reconcile(change.patient_id, change.upserted if change.full else None)
+            else:
+                self.apply(change)
+        except Exception:
+            self._set_stale(change.patient_id, True)
+            logger.warning(
+                "Indice RAG non aggiornato per il paziente %s: verrà riallineato alla prossima occasione",
+                change.patient_id, exc_info=True,
+            )
+
+    def apply(self, change: TherapyChange) -> None:
+        # Le notifiche parziali hanno id univoci (altrimenti KnowledgeManager invia la terapia completa)
+        docs = [build_activity_doc(act, change.patient_id) for act in change.upserted if act.get("activity_id")]
+        removed = [activity_doc_id(change.patient_id, activity_id) for activity_id in change.removed]
+        self._write([doc for doc in docs if doc is not None], removed)
+
+    def reconcile(self, patient_id: str, activities: List[dict] = None) -> Dict[str, int]:
+        """Riallinea i documenti delle attività del paziente ai dati salvati; restituisce i conteggi."""
+        if activities is None:
+            activities = _activities_of(self._read_therapy(patient_id))
+        docs = therapy_docs(activities, patient_id)
+        where = {"$and": [{"patient_id": patient_id}, {"type": ACTIVITY_DOC_TYPE}]}
+        existing = existing_hashes(self._get_collection(), where=where)
+        changed = list(changed_documents(docs, existing))
+        self._write(changed, list(existing))
+        self._set_stale(patient_id, False)
+        return {"aggiornati": len(changed), "rimossi": len(existing)}
+
+    def reconcile_stale(self, patient_ids: Iterable[str] = None) -> None:
+        """Riconcilia i pazienti segnati (tutti, o solo quelli di patient_ids); gli errori lasciano il segno."""
+        # Rilettura del file: altri processi (bulk_import, altre sessioni) possono averlo aggiornato
+        self.stale |= read_stale(self.stale_path)
+        targets = self.stale if patient_ids is None else self.stale & set(patient_ids)
+        for patient_id in sorted(targets):
+            try:
+                self.reconcile(patient_id)
+            except Exception:
+                logger.warning("Riallineamento RAG del paziente %s non riuscito", patient_id, exc_info=True)
+
+    def _set_stale(self, patient_id: str, stale: bool) -> None:
+        if (patient_id in self.stale) == stale:
+            return
+        if stale:
+            self.stale.add(patient_id)
+        else:
+            self.stale.discard(patient_id)
+        if self.stale_path is not None:
+            # Unione con il file: non perdere i pazienti segnati da altri processi
+            merged = read_stale(self.stale_path) | self.stale
+            write_stale(self.stale_path, merged if stale else merged - {patient_id})
+
+    def _write(self, docs: List[Document], removed: List[str]) -> None:
+        if not docs and not removed:
+            return
+        index = self._get_index()
+        # Upsert: il vettore precedente con lo stesso id viene eliminato prima dell'inserimento
+        delete_ids(self._get_collection(), [doc.id_ for doc in docs] + removed)
+        if docs:
+            index.insert_nodes(docs)
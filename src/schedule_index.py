@@ -0,0 +1,417 @@
+"""
+Indici in memoria derivati dalle attività di una terapia.
+
+Gli orari vengono interpretati una sola volta all'inserimento; per ogni giorno le attività
+sono tenute in una lista ordinata per (inizio, fine), così la ricerca delle sovrapposizioni
+costa O(log n + k) invece di una scansione completa della terapia. Le ricerche per nome e
+per (nome, giorno) sono lookup su dict, e il grafo delle dipendenze tiene anche gli archi
+inversi (chi dipende da chi) per giorno.
+"""
+import heapq
+from bisect import bisect_left
+from collections import Counter, deque
+from datetime import datetime
+from itertools import count
+from types import MappingProxyType
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+from src.models import Activity
+from src.weekdays import WEEKDAYS, WeekdayMask, day_key
+
+# Durata implicita di un'attività con solo orario di inizio e senza duration_minutes
+DEFAULT_DURATION_MINUTES = 30
+
+
+def parse_time_to_minutes(time_str: str) -> int:
+    try:
+        h, m = map(int, time_str.split(':'))
+        return h * 60 + m
+    except ValueError:
+        return -1
+
+
+def normalize_time_and_duration(time_str: str | None, duration_minutes: int | None) -> tuple[str | None, int | None]:
+    # Normalize time windows into start-time + duration for consistent scheduling logic.
+    if not time_str:
+        return time_str, duration_minutes
+    cleaned = str(time_str).strip()
+    if "-" not in cleaned:
+        return cleaned, duration_minutes
+
+    start_str, end_str = [part.strip() for part in cleaned.split("-", 1)]
+    if duration_minutes is None:
+        start_min = parse_time_to_minutes(start_str)
+        end_min = parse_time_to_minutes(end_str)
+        if start_min >= 0 and end_min >= 0 and end_min > start_min:
+            duration_minutes = end_min - start_min
+    return start_str, duration_minutes
+
+
+def parse_date_ordinal(date_str: Optional[str]) -> Optional[int]:
+    """Data ISO -> ordinale (date.toordinal); None se assente o non valida."""
+    if not date_str:
+        return None
+    try:
+        return datetime.fromisoformat(date_str).date().toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def time_interval(time_str: str, duration_minutes: int | None = None) -> Tuple[int, int]:
+    if '-' in time_str:
+        parts = time_str.split('-')
+        start = parse_time_to_minutes(parts[0].strip())
+        end = parse_time_to_minutes(parts[1].strip())
+        return start, end
+    start = parse_time_to_minutes(time_str.strip())
+    if duration_minutes is not None and duration_minutes > 0:
+        return start, start + duration_minutes
+    return start, start + DEFAULT_DURATION_MINUTES
+
+
+def overlapping_pairs(
+    intervals: List[Tuple[Optional[int], Optional[int], Iterable[str]]]
+) -> Dict[int, Dict[int, Set[str]]]:
+    """
+    Sweep-line per giorno su una lista di (inizio, fine, giorni): per ogni posizione j restituisce
+    {i: giorni in comune} delle posizioni i < j che si sovrappongono. Gli intervalli con inizio None
+    sono ignorati. Costo O(n log n + coppie).
+    """
+    by_day: Dict[str, List[Tuple[int, int, int]]] = {}
+    for pos, (start, end, days) in enumerate(intervals):
+        if start is None:
+            continue
+        for day in set(days):
+            by_day.setdefault(day, []).append((start, end, pos))
+    pairs: Dict[int, Dict[int, Set[str]]] = {}
+    for day, events in by_day.items():
+        events.sort()
+        active: List[Tuple[int, int, int]] = []  # heap (fine, posizione, inizio) degli intervalli aperti
+        for start, end, pos in events:
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            for _, other, other_start in active:
+                if end > other_start:
+                    first, second = min(pos, other), max(pos, other)
+                    pairs.setdefault(second, {}).setdefault(first, set()).add(day)
+            heapq.heappush(active, (end, pos, start))
+    return pairs
+
+
+def free_slots(
+    busy: Iterable[Tuple[int, int]], duration: int, earliest: int, latest: int, limit: int = 3
+) -> List[Tuple[int, int]]:
+    """
+    Scansione dei vuoti tra intervalli occupati ordinati per inizio: il primo slot di `duration`
+    minuti (stessa regola di sovrapposizione di check_temporal_conflict) in ciascun vuoto
+    compreso tra earliest e latest, al massimo `limit` slot.
+    """
+    slots: List[Tuple[int, int]] = []
+    cursor = earliest
+    for start, end in busy:
+        if len(slots) >= limit or cursor + duration > latest:
+            break
+        if min(start, latest) - cursor >= duration:
+            slots.append((cursor, cursor + duration))
+        cursor = max(cursor, end)
+    if len(slots) < limit and cursor + duration <= latest:
+        slots.append((cursor, cursor + duration))
+    return slots
+
+
+class IndexedActivity:
+    """Attività con l'intervallo orario già calcolato."""
+    __slots__ = (
+        "activity", "seq", "name", "start", "end", "days", "day_keys", "mask", "dependencies", "valid_from", "valid_until",
+    )
+
+    def __init__(self, activity: Activity, seq: int):
+        self.activity = activity
+        self.seq = seq
+        # Chiavi congelate all'inserimento: servono a rimuovere l'attività anche dopo una modifica in place
+        self.name = activity.name
+        self.days: Tuple[str, ...] = tuple(dict.fromkeys(activity.day_of_week))
+        # Nomi canonici ("Monday" e "lunedi" -> "Lunedì"); i nomi non riconosciuti restano com'erano
+        self.day_keys = frozenset(map(day_key, self.days))
+        self.mask = WeekdayMask.of(self.days)
+        self.dependencies: Tuple[str, ...] = tuple(dict.fromkeys(activity.dependencies))
+        # Finestra di validità come ordinali: None = nessun limite (anche per date non valide)
+        self.valid_from = parse_date_ordinal(activity.valid_from)
+        self.valid_until = parse_date_ordinal(activity.valid_until)
+        try:
+            self.start, self.end = time_interval(activity.time, activity.duration_minutes)
+        except Exception:
+            # Orario non interpretabile: l'attività non partecipa ai controlli temporali
+            self.start = self.end = None
+
+    @property
+    def has_interval(self) -> bool:
+        return self.start is not None
+
+    def active_on(self, ordinal: Optional[int]) -> bool:
+        if ordinal is None:
+            return True
+        if self.valid_from is not None and ordinal < self.valid_from:
+            return False
+        return self.valid_until is None or ordinal <= self.valid_until
+
+
+class _DayIntervals:
+    """Intervalli di un singolo giorno, ordinati per (inizio, fine, seq)."""
+
+    def __init__(self):
+        self.keys: List[Tuple[int, int, int]] = []
+        self.items: List[IndexedActivity] = []
+        # Durate presenti (con molteplicità): la massima limita a sinistra la finestra di ricerca
+        self.lengths: Counter = Counter()
+        self.max_length = 0
+
+    def insert(self, item: IndexedActivity) -> None:
+        key = (item.start, item.end, item.seq)
+        i = bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.items.insert(i, item)
+        length = item.end - item.start
+        self.lengths[length] += 1
+        self.max_length = max(self.max_length, length)
+
+    def remove(self, item: IndexedActivity) -> None:
+        key = (item.start, item.end, item.seq)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+            del self.items[i]
+            length = item.end - item.start
+            self.lengths[length] -= 1
+            if not self.lengths[length]:
+                del self.lengths[length]
+                if length == self.max_length:
+                    # Le durate distinte sono poche (al più i minuti di un giorno)
+                    self.max_length = max(self.lengths, default=0)
+
+    def overlapping(self, start: int, end: int) -> Iterator[IndexedActivity]:
+        lo = bisect_left(self.keys, (start - self.max_length,))
+        hi = bisect_left(self.keys, (end,))
+        for i in range(lo, hi):
+            if self.keys[i][1] > start:
+                yield self.items[i]
+
+
+class _WeekDay:
+    """Attività di un giorno nella vista settimanale, ordinate per orario (senza orario valido in coda)."""
+
+    def __init__(self):
+        self.keys: List[tuple] = []
+        self.activities: List[Activity] = []
+
+    @staticmethod
+    def _key(item: IndexedActivity) -> tuple:
+        return (0, item.start, item.end, item.seq) if item.has_interval else (1, 0, 0, item.seq)
+
+    def insert(self, item: IndexedActivity) -> None:
+        key = self._key(item)
+        i = bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.activities.insert(i, item.activity)
+
+    def remove(self, item: IndexedActivity) -> None:
+        key = self._key(item)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+            del self.activities[i]
+
+
+def _insert_by_seq(items: List[IndexedActivity], item: IndexedActivity) -> None:
+    # Le liste per chiave sono corte: basta mantenere l'ordine di inserimento (seq)
+    i = len(items)
+    while i > 0 and items[i - 1].seq > item.seq:
+        i -= 1
+    items.insert(i, item)
+
+
+def _remove_from(mapping: dict, key, item: IndexedActivity) -> None:
+    items = mapping.get(key)
+    if not items:
+        return
+    items[:] = [other for other in items if other is not item]
+    if not items:
+        del mapping[key]
+
+
+class DependencyReport(NamedTuple):
+    """Esito della visita topologica: i nodi sono coppie (nome attività, giorno)."""
+    order: List[Tuple[str, str]]
+    missing: List[Tuple[Tuple[str, str], str]]
+    misordered: List[Tuple[Tuple[str, str], Tuple[str, str]]]
+    cyclic: List[Tuple[str, str]]
+
+
+class ScheduleIndex:
+    """
+    Indice incrementale delle attività di una terapia.
+    Va aggiornato con add/discard a ogni modifica delle attività indicizzate.
+    """
+
+    def __init__(self, activities: Optional[List[Activity]] = None):
+        self._seq = count()
+        self._items: Dict[int, IndexedActivity] = {}
+        self._by_day: Dict[str, _DayIntervals] = {}
+        self._by_name: Dict[str, List[IndexedActivity]] = {}
+        self._by_name_day: Dict[Tuple[str, str], List[IndexedActivity]] = {}
+        # Giorno (chiave canonica, vedi day_key) -> attività in ordine di inserimento, con o senza orario valido
+        self._on_day: Dict[str, List[IndexedActivity]] = {}
+        # Archi inversi: (nome dipendenza, giorno) -> attività che ne dipendono in quel giorno
+        self._dependents: Dict[Tuple[str, str], List[IndexedActivity]] = {}
+        # Vista settimanale materializzata: le liste vengono aggiornate in place, week_version a ogni modifica
+        self._week = {day: _WeekDay() for day in WEEKDAYS}
+        self.week_version = 0
+        # Copia in sola lettura della vista, rifatta solo quando week_version cambia
+        self._week_snapshot: Optional[Tuple[int, Mapping[str, Tuple[Activity, ...]]]] = None
+        for activity in activities or []:
+            self.add(activity)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, activity: Activity, seq: Optional[int] = None) -> IndexedActivity:
+        item = IndexedActivity(activity, next(self._seq) if seq is None else seq)
+        self._items[id(activity)] = item
+        if item.has_interval:
+            for day in item.day_keys:
+                self._by_day.setdefault(day, _DayIntervals()).insert(item)
+        _insert_by_seq(self._by_name.setdefault(activity.name, []), item)
+        for day in item.day_keys:
+            if day in self._week:
+                self._week[day].insert(item)
+            _insert_by_seq(self._on_day.setdefault(day, []), item)
+            _insert_by_seq(self._by_name_day.setdefault((activity.name, day), []), item)
+            for dep_name in item.dependencies:
+                _insert_by_seq(self._dependents.setdefault((dep_name, day), []), item)
+        self.week_version += 1
+        return item
+
+    def discard(self, activity: Activity) -> Optional[int]:
+        """Rimuove l'attività dall'indice e ne restituisce il seq (per reinserirla dopo una modifica)."""
+        item = self._items.pop(id(activity), None)
+        if item is None:
+            return None
+        if item.has_interval:
+            for day in item.day_keys:
+                intervals = self._by_day.get(day)
+                if intervals:
+                    intervals.remove(item)
+        _remove_from(self._by_name, item.name, item)
+        for day in item.day_keys:
+            if day in self._week:
+                self._week[day].remove(item)
+            _remove_from(self._on_day, day, item)
+            _remove_from(self._by_name_day, (item.name, day), item)
+            for dep_name in item.dependencies:
+                _remove_from(self._dependents, (dep_name, day), item)
+        self.week_version += 1
+        return item.seq
+
+    def find(self, name: str, day: str) -> Optional[Activity]:
+        """Prima attività (in ordine di inserimento) con questo nome prevista nel giorno indicato."""
+        items = self._by_name_day.get((name, day_key(day)))
+        return items[0].activity if items else None
+
+    def on_day(self, day: str, ordinal: Optional[int] = None) -> List[IndexedActivity]:
+        """Attività previste nel giorno, in ordine di inserimento; con `ordinal` solo quelle valide in quella data."""
+        items = self._on_day.get(day_key(day), ())
+        return [item for item in items if item.active_on(ordinal)]
+
+    def week(self) -> Mapping[str, Tuple[Activity, ...]]:
+        """
+        Vista settimanale (giorno -> attività ordinate per orario) in sola lettura: una copia che
+        non cambia con le modifiche successive, la stessa finché week_version non cambia.
+        """
+        if self._week_snapshot is None or self._week_snapshot[0] != self.week_version:
+            view = MappingProxyType({day: tuple(bucket.activities) for day, bucket in self._week.items()})
+            self._week_snapshot = (self.week_version, view)
+        return self._week_snapshot[1]
+
+    def by_weekday(self) -> List[List[IndexedActivity]]:
+        """
+        Per ogni giorno della settimana (lunedì = 0) le attività con orario, ordinate per (inizio, fine, seq).
+        """
+        return [list(self._by_day[day].items) if day in self._by_day else [] for day in WEEKDAYS]
+
+    def by_name(self, name: str) -> List[IndexedActivity]:
+        return list(self._by_name.get(name, ()))
+
+    def overlapping(self, day: str, start: int, end: int) -> Iterator[IndexedActivity]:
+        intervals = self._by_day.get(day_key(day))
+        if intervals:
+            yield from intervals.overlapping(start, end)
+
+    def busy(self, days: Iterable[str]) -> Iterator[Tuple[int, int]]:
+        """Intervalli occupati (con orario valido) nei giorni indicati, fusi in ordine di inizio."""
+        lists = [self._by_day[key].items for key in dict.fromkeys(map(day_key, days)) if key in self._by_day]
+        for item in heapq.merge(*lists, key=lambda it: (it.start, it.end, it.seq)):
+            if item.start >= 0:
+                yield item.start, item.end
+
+    def dependents(self, name: str, day: str) -> List[IndexedActivity]:
+        """Attività che dichiarano `name` come dipendenza nel giorno indicato: O(grado)."""
+        return list(self._dependents.get((name, day_key(day)), ()))
+
+    def transitive_dependents(self, name: str, days: Optional[List[str]] = None) -> List[IndexedActivity]:
+        """Tutte le attività che dipendono, direttamente o indirettamente, da `name` nei giorni indicati."""
+        if days:
+            day_keys = set(map(day_key, days))
+        else:
+            day_keys = {day for item in self._by_name.get(name, ()) for day in item.day_keys}
+        frontier = deque((name, day) for day in day_keys)
+        seen_nodes: Set[Tuple[str, str]] = set(frontier)
+        found: Dict[int, IndexedActivity] = {}
+        while frontier:
+            node = frontier.popleft()
+            for item in self._dependents.get(node, ()):
+                found.setdefault(item.seq, item)
+                child = (item.name, node[1])
+                if child not in seen_nodes:
+                    seen_nodes.add(child)
+                    frontier.append(child)
+        return [found[seq] for seq in sorted(found)]
+
+    def _node_start(self, node: Tuple[str, str]) -> Optional[int]:
+        starts = [item.start for item in self._by_name_day.get(node, ()) if item.has_interval and item.start >= 0]
+        return min(starts) if starts else None
+
+    def dependency_report(self) -> DependencyReport:
+        """
+        Un'unica visita topologica (Kahn) del grafo (nome, giorno) -> dipendenze.
+        Segnala dipendenze mancanti, dipendenti che iniziano prima della dipendenza e cicli.
+        """
+        missing = []
+        misordered = []
+        children: Dict[Tuple[str, str], Set[Tuple[str, str]]] = {}
+        indegree: Dict[Tuple[str, str], int] = {node: 0 for node in self._by_name_day}
+        for node, items in self._by_name_day.items():
+            name, day = node
+            deps = dict.fromkeys(dep for item in items for dep in item.dependencies)
+            for dep_name in deps:
+                dep_node = (dep_name, day)
+                if dep_node not in self._by_name_day:
+                    missing.append((node, dep_name))
+                    continue
+                if node not in children.setdefault(dep_node, set()):
+                    children[dep_node].add(node)
+                    indegree[node] += 1
+                start, dep_start = self._node_start(node), self._node_start(dep_node)
+                if start is not None and dep_start is not None and start < dep_start:
+                    misordered.append((node, dep_node))
+
+        ready = deque(sorted(node for node, degree in indegree.items() if degree == 0))
+        order = []
+        while ready:
+            node = ready.popleft()
+            order.append(node)
+            for child in sorted(children.get(node, ())):
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    ready.append(child)
+        cyclic = sorted(node for node, degree in indegree.items() if degree > 0)
+        return DependencyReport(order, missing, misordered, cyclic)
@@ -0,0 +1,420 @@
+"""
+Backend SQLite per KnowledgeManager (alternativo ai file JSON di DATA_DIR).
+
+Un unico database locale in modalità WAL: più lettori concorrenti e un solo scrittore,
+con ogni modifica (add/update/remove di un'attività, nota di profilo) applicata in una
+transazione. Le attività sono righe indicizzate per paziente, nome e giorno, così le
+ricerche trasversali a tutti i pazienti non richiedono di aprire un file per entità.
+
+Migrazione dell'albero JSON esistente:
+    python -m src.sqlite_storage migrate --data-dir data --db data/kmchat.sqlite3
+"""
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from pydantic import BaseModel
+
+from src import journal
+from src.models import Activity
+from src.text_normalize import normalize_name
+from src.weekdays import day_key
+
+SQLITE_FILENAME = "kmchat.sqlite3"
+_PROFILE_KINDS = ("patient", "caregiver")
+_FOLDERS = {"therapy": "therapies", "patient": "patients", "caregiver": "caregivers"}
+
+logger = logging.getLogger("kmchat.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT,
+    name_norm TEXT,
+    data TEXT NOT NULL,
+    revision INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (kind, id)
+);
+CREATE INDEX IF NOT EXISTS idx_profiles_name ON profiles (kind, name_norm);
+
+CREATE TABLE IF NOT EXISTS therapies (
+    patient_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    revision INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS activities (
+    row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL,
+    activity_id TEXT,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_activities_patient ON activities (patient_id, activity_id);
+CREATE INDEX IF NOT EXISTS idx_activities_name ON activities (name, patient_id);
+
+CREATE TABLE IF NOT EXISTS activity_days (
+    activity_row INTEGER NOT NULL REFERENCES activities (row_id) ON DELETE CASCADE,
+    patient_id TEXT NOT NULL,
+    day TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_activity_days_day ON activity_days (day, patient_id);
+CREATE INDEX IF NOT EXISTS idx_activity_days_row ON activity_days (activity_row);
+"""
+
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False)
+
+
+class SqliteStorage:
+    """
+    Stessa interfaccia di JsonFileStorage (list_profiles, list_ids, find_id_by_name, first_id, exists,
+    load, read, record, write, write_raw, compact, retain, close) su un database SQLite.
+    Ogni riga ha un numero di revisione: un load rilegge e rivalida il modello solo se è cambiato.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Streamlit esegue gli script in thread diversi. Le scritture passano da un'unica
+        # connessione sotto lock; le letture usano una connessione per thread, così in WAL
+        # procedono in parallelo tra loro e con lo scrittore.
+        self._lock = threading.RLock()
+        self._conn = self._connect()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        # (tipo, id) -> (revisione, modello) dell'ultimo load o dell'ultima scrittura
+        self._loaded: Dict[Tuple[str, str], Tuple[int, BaseModel]] = {}
+
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False, **kwargs)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _reading(self) -> Iterator[sqlite3.Connection]:
+        """Connessione di lettura del thread corrente, in una transazione: le query vedono un'unica versione."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit: BEGIN/COMMIT espliciti delimitano lo snapshot di lettura
+            conn = self._connect(isolation_level=None)
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock, self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+            self._conn.close()
+
+    # --- Anagrafica ---
+
+    def list_profiles(self, kind: str) -> List[Dict[str, Optional[str]]]:
+        with self._reading() as conn:
+            rows = conn.execute("SELECT id, name FROM profiles WHERE kind = ? ORDER BY id", (kind,)).fetchall()
+        return [{"id": row["id"], "name": row["name"]} for row in rows]
+
+    def list_ids(self, kind: str) -> List[str]:
+        """Id di tutte le entità del tipo, in ordine."""
+        with self._reading() as conn:
+            if kind == "therapy":
+                rows = conn.execute("SELECT patient_id AS id FROM therapies ORDER BY patient_id").fetchall()
+            else:
+                rows = conn.execute("SELECT id FROM profiles WHERE kind = ? ORDER BY id", (kind,)).fetchall()
+        return [row["id"] for row in rows]
+
+    def find_id_by_name(self, kind: str, name: str) -> Optional[str]:
+        target = normalize_name(name)
+        if not target:
+            return None
+        with self._reading() as conn:
+            row = conn.execute(
+                "SELECT id FROM profiles WHERE kind = ? AND name_norm = ? ORDER BY id LIMIT 1", (kind, target)
+            ).fetchone()
+        return row["id"] if row else None
+
+    def first_id(self, kind: str) -> Optional[str]:
+        with self._reading() as conn:
+            row = conn.execute("SELECT MIN(id) AS id FROM profiles WHERE kind = ?", (kind,)).fetchone()
+        return row["id"]
+
+    def exists(self, kind: str, key: str) -> bool:
+        with self._reading() as conn:
+            if kind == "therapy":
+                row = conn.execute("SELECT 1 FROM therapies WHERE patient_id = ?", (key,)).fetchone()
+            else:
+                row = conn.execute("SELECT 1 FROM profiles WHERE kind = ? AND id = ?", (kind, key)).fetchone()
+        return row is not None
+
+    # --- Lettura ---
+
+    @staticmethod
+    def _revision(conn: sqlite3.Connection, kind: str, key: str) -> Optional[int]:
+        if kind == "therapy":
+            row = conn.execute("SELECT revision FROM therapies WHERE patient_id = ?", (key,)).fetchone()
+        else:
+            row = conn.execute("SELECT revision FROM profiles WHERE kind = ? AND id = ?", (kind, key)).fetchone()
+        return row["revision"] if row else None
+
+    @staticmethod
+    def _read(conn: sqlite3.Connection, kind: str, key: str) -> Any:
+        if kind != "therapy":
+            row = conn.execute("SELECT data FROM profiles WHERE kind = ? AND id = ?", (kind, key)).fetchone()
+            return json.loads(row["data"]) if row else None
+        row = conn.execute("SELECT data FROM therapies WHERE patient_id = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row["data"])
+        data["activities"] = [
+            json.loads(act["data"])
+            for act in conn.execute("SELECT data FROM activities WHERE patient_id = ? ORDER BY row_id", (key,))
+        ]
+        return data
+
+    def load(self, kind: str, key: str, current: Optional[BaseModel], build):
+        """Restituisce (modello, cambiato), come JsonFileStorage.load."""
+        with self._reading() as conn:
+            revision = self._revision(conn, kind, key)
+            cached = self._loaded.get((kind, key))
+            if current is not None and cached is not None and cached[1] is current and cached[0] == revision:
+                return current, False
+            data = self._read(conn, kind, key)
+        model = build(data)
+        with self._lock:
+            self._loaded[(kind, key)] = (revision, model)
+        return model, True
+
+    def read(self, kind: str, key: str) -> Any:
+        """Dati grezzi, come JsonFileStorage.read."""
+        with self._reading() as conn:
+            return self._read(conn, kind, key)
+
+    # --- Scrittura ---
+
+    def _insert_activity(self, patient_id: str, data: dict) -> None:
+        cur = self._conn.execute(
+            "INSERT INTO activities (patient_id, activity_id, name, data) VALUES (?, ?, ?, ?)",
+            (patient_id, data.get("activity_id"), data.get("name") or "", _dumps(data)),
+        )
+        self._insert_days(cur.lastrowid, patient_id, data)
+
+    def _insert_days(self, row_id: int, patient_id: str, data: dict) -> None:
+        days = dict.fromkeys(day_key(day) for day in data.get("day_of_week") or [])
+        self._conn.executemany(
+            "INSERT INTO activity_days (activity_row, patient_id, day) VALUES (?, ?, ?)",
+            [(row_id, patient_id, day) for day in days],
+        )
+
+    def _put(self, kind: str, key: str, data: Any) -> None:
+        """Sostituisce per intero un'entità (da chiamare dentro una transazione)."""
+        if kind != "therapy":
+            name = data.get("name") if isinstance(data, dict) else None
+            self._conn.execute(
+                """INSERT INTO profiles (kind, id, name, name_norm, data) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (kind, id) DO UPDATE SET
+                   name = excluded.name, name_norm = excluded.name_norm,
+                   data = excluded.data, revision = profiles.revision + 1""",
+                (kind, key, name, normalize_name(name), _dumps(data)),
+            )
+            return
+        if isinstance(data, list):
+            # Formato legacy: lista di attività senza contenitore
+            data = {"patient_id": key, "activities": data}
+        header = {field: value for field, value in data.items() if field != "activities"}
+        self._conn.execute(
+            """INSERT INTO therapies (patient_id, data) VALUES (?, ?)
+               ON CONFLICT (patient_id) DO UPDATE SET data = excluded.data, revision = therapies.revision + 1""",
+            (key, _dumps(header)),
+        )
+        self._conn.execute("DELETE FROM activities WHERE patient_id = ?", (key,))
+        for activity in data.get("activities") or []:
+            self._insert_activity(key, activity)
+
+    def _resolve_row(self, patient_id: str, op: dict) -> Optional[sqlite3.Row]:
+        # Stessa risoluzione del journal: prima la posizione suggerita, poi l'activity_id
+        idx = op.get("index")
+        if isinstance(idx, int) and idx >= 0:
+            row = self._conn.execute(
+                "SELECT row_id, activity_id, data FROM activities WHERE patient_id = ? ORDER BY row_id LIMIT 1 OFFSET ?",
+                (patient_id, idx),
+            ).fetchone()
+            if row is not None and row["activity_id"] == op.get("activity_id"):
+                return row
+        return self._conn.execute(
+            "SELECT row_id, activity_id, data FROM activities WHERE patient_id = ? AND activity_id = ? ORDER BY row_id LIMIT 1",
+            (patient_id, op.get("activity_id")),
+        ).fetchone()
+
+    def _apply_op(self, kind: str, key: str, op: dict) -> bool:
+        """Applica un'operazione del journal alle righe del database; False se non applicabile."""
+        kind_op = op.get("op")
+        if kind_op == "append":
+            data = self._read(self._conn, kind, key)
+            if not isinstance(data, dict):
+                return False
+            data.setdefault(op["field"], []).append(op["value"])
+            self._put(kind, key, data)
+            return True
+        if kind != "therapy":
+            return False
+        if kind_op == "add":
+            self._insert_activity(key, op["activity"])
+            return True
+        row = self._resolve_row(key, op)
+        if row is None:
+            return False
+        if kind_op == "remove":
+            self._conn.execute("DELETE FROM activities WHERE row_id = ?", (row["row_id"],))
+            return True
+        if kind_op == "update":
+            data = json.loads(row["data"])
+            fields = op.get("fields") or {}
+            data.update(fields)
+            self._conn.execute(
+                "UPDATE activities SET activity_id = ?, name = ?, data = ? WHERE row_id = ?",
+                (data.get("activity_id"), data.get("name") or "", _dumps(data), row["row_id"]),
+            )
+            if "day_of_week" in fields:
+                self._conn.execute("DELETE FROM activity_days WHERE activity_row = ?", (row["row_id"],))
+                self._insert_days(row["row_id"], key, data)
+            return True
+        return False
+
+    def write(self, kind: str, key: str, model: BaseModel) -> None:
+        with self._lock, self._conn:
+            self._put(kind, key, model.model_dump(mode="json"))
+            self._loaded[(kind, key)] = (self._revision(self._conn, kind, key), model)
+
+    def write_raw(self, kind: str, key: str, data: Any) -> None:
+        """Sostituisce un'entità con dati già validati (importazioni), senza tenerne il modello in memoria."""
+        with self._lock, self._conn:
+            self._put(kind, key, data)
+            self._loaded.pop((kind, key), None)
+
+    def record(self, kind: str, key: str, model: BaseModel, ops: List[dict]) -> None:
+        """
+        Applica in un'unica transazione le operazioni già eseguite sul modello in memoria.
+        Se il modello non è quello caricato (o le righe non coincidono più) si riscrive l'entità intera.
+        """
+        with self._lock, self._conn:
+            cached = self._loaded.get((kind, key))
+            revision = self._revision(self._conn, kind, key)
+            in_sync = cached is not None and cached[1] is model and cached[0] == revision
+            if in_sync:
+                in_sync = all(self._apply_op(kind, key, op) for op in ops)
+            if in_sync and kind == "therapy":
+                count = self._conn.execute(
+                    "SELECT COUNT(*) FROM activities WHERE patient_id = ?", (key,)
+                ).fetchone()[0]
+                in_sync = count == len(model.activities)
+            if in_sync and kind == "therapy":
+                self._conn.execute("UPDATE therapies SET revision = revision + 1 WHERE patient_id = ?", (key,))
+            elif not in_sync:
+                self._put(kind, key, model.model_dump(mode="json"))
+            self._loaded[(kind, key)] = (self._revision(self._conn, kind, key), model)
+
+    def compact(self) -> None:
+        """Riversa il WAL nel file principale del database."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def retain(self, keys: List[tuple]) -> None:
+        keep = set(keys)
+        with self._lock:
+            self._loaded = {k: v for k, v in self._loaded.items() if k in keep}
+
+    # --- Query trasversali ---
+
+    def query_activities(self, name: Optional[str] = None, day: Optional[str] = None) -> List[Tuple[str, Activity]]:
+        """Attività di tutti i pazienti filtrate per nome e/o giorno: coppie (patient_id, attività)."""
+        sql = "SELECT a.patient_id, a.data FROM activities a"
+        params: list = []
+        clauses = []
+        if day is not None:
+            sql += " JOIN activity_days d ON d.activity_row = a.row_id"
+            clauses.append("d.day = ?")
+            params.append(day_key(day))
+        if name is not None:
+            clauses.append("a.name = ?")
+            params.append(name)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY a.patient_id, a.row_id"
+        with self._reading() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [(row["patient_id"], Activity(**json.loads(row["data"]))) for row in rows]
+
+    # --- Migrazione ---
+
+    def import_tree(self, data_dir: Path) -> Dict[str, int]:
+        """Importa (o reimporta) l'albero JSON di data_dir, journal inclusi, in un'unica transazione."""
+        counts = {}
+        with self._lock, self._conn:
+            for kind, folder in _FOLDERS.items():
+                counts[kind] = 0
+                root = Path(data_dir) / folder
+                if not root.exists():
+                    continue
+                for path in sorted(root.glob("*.json")):
+                    if path.name.startswith("."):
+                        continue
+                    try:
+                        data = journal.load_json(path)
+                    except Exception as e:
+                        logger.warning("File %s non importato: %s", path, e)
+                        continue
+                    if data is None:
+                        continue
+                    self._put(kind, path.stem, data)
+                    counts[kind] += 1
+            self._loaded.clear()
+        return counts
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Gestione del database SQLite di KnowledgeManager")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="Importa l'albero JSON di data/ nel database")
+    migrate.add_argument("--data-dir", default="data")
+    migrate.add_argument("--db", default=None, help=f"Percorso del database (default: <data-dir>/{SQLITE_FILENAME})")
+    args = parser.parse_args(argv)
+
+    data_dir = Path(args.data_dir)
+    storage = SqliteStorage(args.db or data_dir / SQLITE_FILENAME)
+    try:
+        counts = storage.import_tree(data_dir)
+    finally:
+        storage.close()
+    print(
+        f"Importati {counts['patient']} pazienti, {counts['caregiver']} caregiver "
+        f"e {counts['therapy']} terapie in {storage.db_path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
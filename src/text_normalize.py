@@ -0,0 +1,16 @@
+"""
+Normalizzazione dei testi per confronti e ricerche (nomi, note dei profili, nomi dei giorni).
+"""
+import unicodedata
+
+
+def normalize_name(name) -> str:
+    """Chiave della ricerca per nome dei profili, uguale per lo storage JSON e per SQLite."""
+    return str(name or "").strip().lower()
+
+
+def fold_text(text) -> str:
+    """Forma canonica per il confronto: senza accenti, casefold, spazi compattati."""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.casefold().split())
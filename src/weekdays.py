@@ -0,0 +1,92 @@
+"""
+Nomi dei giorni della settimana.
+
+La forma canonica è quella italiana con accento grave ("Lunedì"); normalize_day accetta
+varianti italiane e inglesi, con o senza accenti, maiuscole o abbreviazioni.
+Per i confronti tra insiemi di giorni si usa WeekdayMask: l'intersezione è un AND bit a bit.
+"""
+from typing import Iterable, List, Optional
+
+from src.text_normalize import fold_text
+
+# Nomi canonici nell'ordine di date.weekday()
+WEEKDAYS = ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"]
+
+_ALIASES = {
+    0: ("lunedi", "lun", "monday", "mon"),
+    1: ("martedi", "mar", "tuesday", "tue", "tues"),
+    2: ("mercoledi", "mer", "wednesday", "wed"),
+    3: ("giovedi", "gio", "thursday", "thu", "thur", "thurs"),
+    4: ("venerdi", "ven", "friday", "fri"),
+    5: ("sabato", "sab", "saturday", "sat"),
+    6: ("domenica", "dom", "sunday", "sun"),
+}
+
+
+def _fold(text: str) -> str:
+    return fold_text(text).rstrip(".")
+
+
+_BY_ALIAS = {alias: idx for idx, aliases in _ALIASES.items() for alias in aliases}
+
+
+def weekday_index(name) -> Optional[int]:
+    """Indice 0-6 (lunedì = 0) del giorno; None se il nome non è riconosciuto."""
+    if not isinstance(name, str):
+        return None
+    return _BY_ALIAS.get(_fold(name))
+
+
+def normalize_day(name) -> Optional[str]:
+    idx = weekday_index(name)
+    return WEEKDAYS[idx] if idx is not None else None
+
+
+def normalize_days(names: List[str]) -> List[str]:
+    """Nomi canonici senza duplicati, nell'ordine dato; i nomi non riconosciuti vengono scartati."""
+    return list(dict.fromkeys(day for day in map(normalize_day, names or []) if day))
+
+
+def day_key(name) -> str:
+    """Chiave di confronto di un giorno: nome canonico se riconosciuto, altrimenti il nome senza spazi."""
+    return normalize_day(name) or str(name).strip()
+
+
+class WeekdayMask(int):
+    """Insieme di giorni della settimana come maschera a 7 bit (bit 0 = lunedì). I nomi non riconosciuti sono ignorati."""
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, names: Iterable[str]) -> "WeekdayMask":
+        mask = 0
+        for name in names or ():
+            idx = weekday_index(name)
+            if idx is not None:
+                mask |= 1 << idx
+        return cls(mask)
+
+    def __and__(self, other) -> "WeekdayMask":
+        return WeekdayMask(int(self) & int(other))
+
+    def __or__(self, other) -> "WeekdayMask":
+        return WeekdayMask(int(self) | int(other))
+
+    __rand__ = __and__
+    __ror__ = __or__
+
+    def __contains__(self, name) -> bool:
+        idx = weekday_index(name)
+        return idx is not None and bool(self >> idx & 1)
+
+    def indexes(self) -> List[int]:
+        return [idx for idx in range(7) if self >> idx & 1]
+
+    def names(self) -> List[str]:
+        """Nomi canonici dei giorni, da lunedì a domenica."""
+        return [WEEKDAYS[idx] for idx in self.indexes()]
+
+    def __repr__(self) -> str:
+        return f"WeekdayMask({self.names()})"
+
+
+ALL_DAYS = WeekdayMask(0b1111111)
@@ -0,0 +1,35 @@
+"""Fixture condivise: un DATA_DIR temporaneo con le cartelle usate da KnowledgeManager."""
+import json
+import os
+from functools import partial
+from pathlib import Path
+
+import pytest
+
+from src import knowledge_manager as km_mod
+
+
+def write_json(root: Path, folder: str, stem: str, data, mtime_ns: int = None) -> Path:
+    path = root / folder / f"{stem}.json"
+    path.write_text(json.dumps(data))
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+@pytest.fixture
+def data_dir(request, tmp_path, monkeypatch):
+    """
+    DATA_DIR temporaneo (patients/, caregivers/, therapies/) con lo storage JSON: i test non
+    scrivono mai in data/. Nelle classi unittest (usefixtures) imposta self.data_dir e
+    self.write_json(folder, stem, data, mtime_ns=None), disponibili già in setUp.
+    """
+    root = tmp_path / "data"
+    for sub in ("patients", "caregivers", "therapies"):
+        (root / sub).mkdir(parents=True)
+    monkeypatch.setattr(km_mod, "DATA_DIR", root)
+    monkeypatch.delenv("KMCHAT_STORAGE", raising=False)
+    if request.instance is not None:
+        request.instance.data_dir = root
+        request.instance.write_json = partial(write_json, root)
+    return root
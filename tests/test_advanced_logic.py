@@ -1,7 +1,11 @@
 import unittest
+
+import pytest
+
 from src.knowledge_manager import KnowledgeManager
 from src.models import Activity, PatientProfile, CaregiverProfile, Note, Therapy
 
+@pytest.mark.usefixtures("data_dir")
 class TestAdvancedLogic(unittest.TestCase):
     def setUp(self):
         self.km = KnowledgeManager()
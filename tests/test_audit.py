@@ -0,0 +1,49 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.audit import main as audit_main, run_audit
+
+
+class TestAudit(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self.tmp.name)
+        therapies = self.data_dir / "therapies"
+        therapies.mkdir()
+        (therapies / "p1.json").write_text(json.dumps({"patient_id": "p1", "activities": [
+            {"activity_id": "a1", "name": "Fisioterapia", "description": "-", "day_of_week": ["Lunedì", "Martedì"], "time": "10:00-11:00"},
+            {"activity_id": "a2", "name": "Visita", "description": "-", "day_of_week": ["Monday"], "time": "10:30"},
+            {"activity_id": "a3", "name": "Farmaco", "description": "-", "day_of_week": ["Martedì"], "time": "09:00", "dependencies": ["Fisioterapia"]},
+            {"activity_id": "a4", "name": "Crema", "description": "-", "day_of_week": ["Martedì"], "time": "20:00", "dependencies": ["Doccia"]},
+        ]}))
+        (therapies / "p2.json").write_text(json.dumps({"patient_id": "p2", "activities": [
+            {"activity_id": "b1", "name": "Pranzo", "description": "-", "day_of_week": ["Lunedì"], "time": "12:00"},
+        ]}))
+        (therapies / "p3.json").write_text("{ non json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_report(self):
+        report = run_audit(self.data_dir, workers=2)
+        self.assertEqual((report["therapies"], report["therapies_with_issues"]), (3, 2))
+        p1 = next(p for p in report["patients"] if p["patient_id"] == "p1")
+        self.assertEqual(len(p1["overlaps"]), 1)
+        self.assertEqual(p1["overlaps"][0]["days"], ["Lunedì"])
+        self.assertEqual(p1["overlaps"][0]["second"]["activity_id"], "a2")
+        self.assertEqual(p1["missing_dependencies"], [{"activity": "Crema", "day": "Martedì", "dependency": "Doccia"}])
+        self.assertEqual(p1["order_violations"][0]["activity"], "Farmaco")
+        p3 = next(p for p in report["patients"] if p["patient_id"] == "p3")
+        self.assertTrue(p3["errors"])
+
+    def test_cli_output_and_exit_code(self):
+        output = self.data_dir / "audit.json"
+        code = audit_main(["--data-dir", str(self.data_dir), "--output", str(output), "--workers", "1", "--strict"])
+        self.assertEqual(code, 1)
+        self.assertEqual(json.loads(output.read_text())["therapies"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
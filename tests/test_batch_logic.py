@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+from src.knowledge_manager import KnowledgeManager
+from src.models import Activity, Therapy
+from src.schedule_index import overlapping_pairs
+
+
+def _act(act_id, name, time, days=("Lunedì",), deps=(), duration=None):
+    return Activity(
+        activity_id=act_id, name=name, description=name, day_of_week=list(days),
+        time=time, duration_minutes=duration, dependencies=list(deps),
+    )
+
+
+@pytest.fixture
+def km():
+    km = KnowledgeManager()
+    km.therapy = Therapy(patient_id="test", activities=[_act("1", "Colazione", "08:00")])
+    writes = []
+    km._record_therapy_ops = writes.append
+    km.writes = writes
+    return km
+
+
+def test_batch_single_write_and_per_op_results(km):
+    results = km.apply_batch([
+        {"op": "add", "activity": _act("2", "Farmaco", "08:30", deps=["Colazione"])},
+        {"op": "add", "activity": _act("3", "Pranzo", "12:00").model_dump()},
+        {"op": "update", "name": "Colazione", "day": "Lunedì", "data": {"time": "07:45"}},
+        {"op": "remove", "name": "Inesistente", "day": "Lunedì"},
+    ])
+    assert [r.applied for r in results] == [True, True, True, False]
+    assert [a.name for a in km.therapy.activities] == ["Colazione", "Farmaco", "Pranzo"]
+    assert len(km.writes) == 1
+    assert [op["op"] for op in km.writes[0]] == ["update", "add", "add"]
+
+
+def test_batch_conflicts_between_new_activities(km):
+    results = km.apply_batch([
+        {"op": "add", "activity": _act("2", "Fisioterapia", "10:00", duration=60)},
+        {"op": "add", "activity": _act("3", "Visita", "10:30")},
+        {"op": "add", "activity": _act("4", "Pranzo", "12:00")},
+    ])
+    assert [r.applied for r in results] == [True, False, True]
+    assert "Fisioterapia" in results[1].message
+    # Con force vengono applicate tutte
+    forced = km.apply_batch([{"op": "add", "activity": _act("5", "Visita", "10:30")}], force=True)
+    assert forced[0].applied
+
+
+def test_batch_dependencies_within_batch(km):
+    results = km.apply_batch([
+        {"op": "add", "activity": _act("2", "Farmaco B", "13:00", deps=["Pranzo"])},
+        {"op": "add", "activity": _act("3", "Pranzo", "12:00")},
+        {"op": "add", "activity": _act("4", "Farmaco C", "08:05", deps=["Cena"])},
+    ])
+    assert [r.applied for r in results] == [True, True, False]
+    assert "Dipendenza mancante" in results[2].message
+
+
+def test_batch_rejected_dependency_cascades(km):
+    results = km.apply_batch([
+        {"op": "add", "activity": _act("2", "Merenda", "08:15")},  # in conflitto con Colazione
+        {"op": "add", "activity": _act("3", "Farmaco", "16:00", deps=["Merenda"])},
+    ])
+    assert [r.applied for r in results] == [False, False]
+    assert not km.writes
+
+
+def test_batch_duplicates(km):
+    results = km.apply_batch([
+        {"op": "add", "activity": _act("2", "Colazione", "08:00")},
+        {"op": "add", "activity": _act("3", "Cena", "19:00")},
+        {"op": "add", "activity": _act("4", "Cena", "19:00")},
+    ])
+    assert [r.message for r in results if not r.applied] == ["Attività già presente."] * 2
+    assert km.check_batch_conflicts([_act("5", "Colazione", "08:10")])[0]
+
+
+def test_overlapping_pairs_matches_brute_force():
+    rng = random.Random(3)
+    intervals = []
+    for _ in range(200):
+        start = rng.randrange(0, 1400)
+        end = start + rng.choice([0, 5, 30, 90])
+        intervals.append((start, end, rng.sample(["Lunedì", "Martedì"], rng.randint(1, 2))))
+    pairs = overlapping_pairs(intervals)
+    for j, (s2, e2, d2) in enumerate(intervals):
+        for i in range(j):
+            s1, e1, d1 = intervals[i]
+            common = set(d1) & set(d2)
+            expected = common if common and s2 < e1 and e2 > s1 else set()
+            assert pairs.get(j, {}).get(i, set()) == expected
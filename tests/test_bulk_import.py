@@ -0,0 +1,73 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.bulk_import import run_import
+
+
+class TestBulkImport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = Path(self.tmp.name) / "source"
+        self.data_dir = Path(self.tmp.name) / "data"
+        for sub in ("patients", "caregivers", "therapies"):
+            (self.source / sub).mkdir(parents=True)
+
+        self._write("patients", "p1", {"patient_id": "p1", "name": "Mario"})
+        self._write("patients", "broken", {"patient_id": "p2"})
+        self._write("caregivers", "c1", {"caregiver_id": "c1", "name": "Andrea"})
+        self._write("therapies", "p1", {"patient_id": "p1", "activities": [
+            {"activity_id": "a1", "name": "Colazione", "day_of_week": ["lunedi", "Monday"], "time": "08:00-08:30"},
+            {"activity_id": "a2", "name": "Farmaco", "day_of_week": ["Lunedì"], "time": "08:30", "dependencies": ["Colazione"]},
+        ]})
+        self._write("therapies", "p3", [
+            {"activity_id": "b1", "name": "Pranzo", "day_of_week": ["Martedì"], "time": "12:00"},
+            {"activity_id": "b2", "name": "Visita", "day_of_week": ["martedì"], "time": "12:15"},
+        ])
+        self._write("therapies", "p4", {"patient_id": "p4", "activities": [
+            {"activity_id": "c1", "name": "Cena", "day_of_week": ["Festivo"], "time": "19:00"},
+        ]})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, folder, stem, data):
+        (self.source / folder / f"{stem}.json").write_text(json.dumps(data))
+
+    def test_import_normalizes_and_reports(self):
+        streamed = []
+        report = run_import(self.source, self.data_dir, workers=2, on_result=streamed.append)
+        self.assertEqual(len(streamed), 6)
+        self.assertEqual((report["imported"], report["rejected"]), (3, 3))
+        rejected = {(f["kind"], f["id"]) for f in report["files"] if f["status"] == "rejected"}
+        self.assertEqual(rejected, {("patient", "p2"), ("therapy", "p3"), ("therapy", "p4")})
+
+        therapy = json.loads((self.data_dir / "therapies" / "p1.json").read_text())
+        first = therapy["activities"][0]
+        self.assertEqual((first["time"], first["duration_minutes"], first["day_of_week"]), ("08:00", 30, ["Lunedì"]))
+        self.assertFalse((self.data_dir / "therapies" / "p3.json").exists())
+
+    def test_force_and_dry_run(self):
+        report = run_import(self.source, self.data_dir, workers=1, dry_run=True)
+        self.assertFalse(self.data_dir.exists())
+        self.assertEqual(report["imported"], 3)
+
+        report = run_import(self.source, self.data_dir, workers=1, force=True)
+        self.assertEqual(report["imported"], 4)
+        self.assertTrue((self.data_dir / "therapies" / "p3.json").exists())
+
+    def test_ids_outside_data_dir_are_rejected(self):
+        for stem, patient_id in (("evil", "../../evil"), ("dots", ".."), ("hidden", ".p5"), ("nested", "a/b")):
+            self._write("patients", stem, {"patient_id": patient_id, "name": "X"})
+        report = run_import(self.source, self.data_dir, workers=1)
+        rejected = {f["id"] for f in report["files"] if f["status"] == "rejected"}
+        self.assertTrue({"../../evil", "..", ".p5", "a/b"} <= rejected)
+        self.assertFalse((Path(self.tmp.name) / "evil.json").exists())
+        self.assertEqual(
+            sorted(p.name for p in (self.data_dir / "patients").iterdir()), ["p1.json"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from src import knowledge_manager as km_mod
+from src.knowledge_manager import KnowledgeManager, TherapyChange
+from src.models import Activity
+
+
+def _act(act_id, name, time, days=("Lunedì",)):
+    return Activity(activity_id=act_id, name=name, description=name, day_of_week=list(days), time=time)
+
+
+@pytest.fixture
+def km(tmp_path, monkeypatch):
+    for sub in ("patients", "caregivers", "therapies"):
+        (tmp_path / sub).mkdir()
+    (tmp_path / "patients" / "p1.json").write_text(json.dumps({"patient_id": "p1", "name": "Mario"}))
+    (tmp_path / "caregivers" / "c1.json").write_text(json.dumps({"caregiver_id": "c1", "name": "Andrea"}))
+    (tmp_path / "therapies" / "p1.json").write_text(json.dumps({
+        "patient_id": "p1",
+        "activities": [_act("a1", "Colazione", "08:00", ("Lunedì", "Martedì")).model_dump(mode="json")],
+    }))
+    monkeypatch.setattr(km_mod, "DATA_DIR", tmp_path)
+    km = KnowledgeManager("p1", "c1")
+    km.changes = []
+    km.add_change_listener(km.changes.append)
+    return km
+
+
+def test_add_update_and_remove_are_notified(km):
+    km.add_activity(_act("a2", "Pranzo", "12:00"))
+    km.update_activity("Pranzo", "Lunedì", {"time": "12:30"})
+    km.remove_activity("Pranzo", "Lunedì")
+    add, update, remove = km.changes
+    assert add == TherapyChange("p1", [_act("a2", "Pranzo", "12:00").model_dump(mode="json")], [])
+    assert [act["time"] for act in update.upserted] == ["12:30"] and not update.removed
+    assert remove.upserted == [] and remove.removed == ["a2"]
+
+
+def test_day_removal_notifies_remaining_days(km):
+    km.remove_activity("Colazione", "Martedì")
+    (change,) = km.changes
+    assert change.removed == []
+    assert [act["day_of_week"] for act in change.upserted] == [["Lunedì"]]
+
+
+def test_rejected_operations_are_not_notified(km):
+    km.add_activity(_act("a2", "Latte", "08:00"))
+    km.remove_activity("Inesistente", "Lunedì")
+    assert km.changes == []
+
+
+def test_batch_is_a_single_change(km):
+    km.apply_batch([
+        {"op": "add", "activity": _act("a2", "Pranzo", "12:00")},
+        {"op": "update", "name": "Colazione", "day": "Lunedì", "data": {"activity_id": "a1b", "time": "07:30"}},
+        {"op": "add", "activity": _act("a3", "Cena", "19:00")},
+    ])
+    (change,) = km.changes
+    assert [act["activity_id"] for act in change.upserted] == ["a1b", "a2", "a3"]
+    assert change.removed == ["a1"]
+
+
+def test_duplicate_ids_notify_full_therapy(km):
+    km.add_activity(_act("a2", "Pranzo", "12:00"))
+    km.apply_batch([{"op": "update", "name": "Pranzo", "day": "Lunedì", "data": {"activity_id": "a1"}}])
+    duplicated = km.changes[-1]
+    assert duplicated.full and [act["activity_id"] for act in duplicated.upserted] == ["a1", "a1"]
+    # Rimuovendo uno dei due duplicati l'altro resta: anche qui serve la terapia completa
+    km.remove_activity("Pranzo", "Lunedì")
+    removed = km.changes[-1]
+    assert removed.full and removed.removed == [] and [act["name"] for act in removed.upserted] == ["Colazione"]
+
+
+def test_save_data_notifies_full_therapy(km):
+    km.save_data()
+    (change,) = km.changes
+    assert change.full and [act["activity_id"] for act in change.upserted] == ["a1"]
+
+
+def test_failing_listener_does_not_break_the_operation(km):
+    def broken(change):
+        raise RuntimeError("vector store non disponibile")
+
+    km.add_change_listener(broken)
+    assert "successo" in km.add_activity(_act("a2", "Pranzo", "12:00"))
+    assert len(km.changes) == 1
+    assert [a.activity_id for a in KnowledgeManager("p1", "c1").therapy.activities] == ["a1", "a2"]
+    km.remove_change_listener(broken)
+    km.remove_activity("Pranzo", "Lunedì")
+    assert len(km.changes) == 2
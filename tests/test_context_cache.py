@@ -0,0 +1,66 @@
+import json
+import os
+import unittest
+from unittest.mock import patch
+
+import pytest
+
+from src import journal
+from src.knowledge_manager import KnowledgeManager
+from src.models import Activity
+
+
+@pytest.mark.usefixtures("data_dir")
+class TestContextCache(unittest.TestCase):
+    def setUp(self):
+        for pid in ("p1", "p2", "p3"):
+            self.write_json("patients", pid, {"patient_id": pid, "name": pid.upper()})
+            self.write_json("therapies", pid, {"patient_id": pid, "activities": [{
+                "activity_id": f"{pid}_a1", "name": "Colazione", "description": "-",
+                "day_of_week": ["Lunedì"], "time": "08:00",
+            }]})
+        self.write_json("caregivers", "c1", {"caregiver_id": "c1", "name": "Andrea"})
+        self.km = KnowledgeManager("p1", "c1")
+
+    def test_switch_back_uses_cached_models(self):
+        therapy = self.km.therapy
+        index = self.km._schedule_index()
+        self.km.set_context("p2", "c1")
+        self.assertEqual(self.km.therapy.activities[0].activity_id, "p2_a1")
+
+        with patch.object(journal, "read_snapshot", wraps=journal.read_snapshot) as read:
+            self.km.set_context("p1", "c1")
+            read.assert_not_called()
+        self.assertIs(self.km.therapy, therapy)
+        self.assertIs(self.km._schedule_index(), index)
+
+    def test_cached_context_sees_writes_and_external_changes(self):
+        self.km.set_context("p2", "c1")
+        self.km.add_activity(Activity(activity_id="x", name="Pranzo", description="-", day_of_week=["Lunedì"], time="12:00"))
+        self.km.set_context("p1", "c1")
+        self.km.set_context("p2", "c1")
+        self.assertEqual([a.name for a in self.km.therapy.activities], ["Colazione", "Pranzo"])
+
+        self.km.set_context("p1", "c1")
+        path = self.data_dir / "therapies" / "p2.json"
+        data = json.loads(path.read_text())
+        data["activities"] = []
+        journal.write_snapshot(path, data)
+        os.utime(path, ns=(1, 1))
+        self.km.set_context("p2", "c1")
+        self.assertEqual(self.km.therapy.activities, [])
+        self.assertIsNone(self.km.get_activity_by_name_day("Colazione", "Lunedì"))
+
+    def test_cache_is_bounded(self):
+        self.km.context_cache_size = 1
+        self.km.set_context("p2", "c1")
+        self.km.set_context("p3", "c1")
+        self.assertEqual(list(self.km._contexts), [("p2", "c1")])
+
+        self.km.context_cache_max_items = 1
+        self.km.set_context("p1", "c1")
+        self.assertEqual(list(self.km._contexts), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -63,3 +63,29 @@ def test_dependency_sequence_error(km_with_deps):
     )
     issues_ok = km_with_deps.check_missing_dependencies(ok_time)
     assert len(issues_ok) == 0
+
+def test_transitive_dependents(km_with_deps):
+    km_with_deps.therapy.activities.append(Activity(
+        activity_id="3", name="Passeggiata", description="Dopo il farmaco",
+        day_of_week=["Lunedì", "Martedì"], time="09:00", dependencies=["Farmaco A"]
+    ))
+    names = [a.name for a in km_with_deps.get_dependents("Colazione", "Lunedì")]
+    assert names == ["Farmaco A", "Passeggiata"]
+    # Di martedì non c'è la colazione: nessun dipendente
+    assert km_with_deps.get_dependents("Colazione", "Martedì") == []
+
+def test_validate_dependencies_whole_therapy(km_with_deps):
+    assert km_with_deps.validate_dependencies() == []
+
+    km_with_deps.therapy.activities.extend([
+        Activity(activity_id="4", name="Cena", description="...",
+                 day_of_week=["Lunedì"], time="07:00", dependencies=["Colazione", "Pranzo"]),
+        Activity(activity_id="5", name="X", description="...",
+                 day_of_week=["Martedì"], time="10:00", dependencies=["Y"]),
+        Activity(activity_id="6", name="Y", description="...",
+                 day_of_week=["Martedì"], time="11:00", dependencies=["X"]),
+    ])
+    issues = km_with_deps.validate_dependencies()
+    assert any("'Pranzo' non trovata" in i for i in issues)
+    assert any("'Cena' inizia prima della dipendenza 'Colazione'" in i for i in issues)
+    assert any("circolari" in i and "'X' (Martedì)" in i and "'Y' (Martedì)" in i for i in issues)
@@ -0,0 +1,54 @@
+import unittest
+from unittest.mock import patch
+
+import pytest
+
+from src.knowledge_manager import KnowledgeManager, _DirectoryIndex
+
+
+@pytest.mark.usefixtures("data_dir")
+class TestDirectoryIndex(unittest.TestCase):
+    def setUp(self):
+        self.write_json("patients", "p_01", {"patient_id": "p_01", "name": "Mario Rossi"})
+        self.write_json("patients", "p_02", {"patient_id": "p_02", "name": "Luigi Verdi"})
+        self.write_json("caregivers", "c_01", {"caregiver_id": "c_01", "name": "Andrea"})
+        self.km = KnowledgeManager()
+
+    def test_find_by_name_case_insensitive(self):
+        self.assertEqual(self.km.find_patient_id_by_name("  mario ROSSI "), "p_01")
+        self.assertEqual(self.km.find_caregiver_id_by_name("andrea"), "c_01")
+        self.assertIsNone(self.km.find_patient_id_by_name("Nessuno"))
+        self.assertIsNone(self.km.find_patient_id_by_name(""))
+
+    def test_available_users_sorted(self):
+        users = self.km.get_available_users()
+        self.assertEqual([p["id"] for p in users["patients"]], ["p_01", "p_02"])
+        self.assertEqual(users["caregivers"], [{"id": "c_01", "name": "Andrea"}])
+
+    def test_unchanged_files_are_not_parsed_again(self):
+        self.km.get_available_users()
+        with patch.object(_DirectoryIndex, "_read_entry", wraps=self.km.storage._indexes["patient"]._read_entry) as read:
+            self.km.storage._indexes["patient"].refresh(force=True)
+            read.assert_not_called()
+
+    def test_changed_and_new_files_are_picked_up(self):
+        self.km.get_available_users()
+        self.write_json("patients", "p_02", {"patient_id": "p_02", "name": "Luigi Bianchi"}, mtime_ns=10**18)
+        self.write_json("patients", "p_03", {"patient_id": "p_03", "name": "Anna Neri"})
+        # Un nome sconosciuto forza una nuova scansione
+        self.assertEqual(self.km.find_patient_id_by_name("Anna Neri"), "p_03")
+        self.assertEqual(self.km.find_patient_id_by_name("Luigi Bianchi"), "p_02")
+        self.assertIsNone(self.km.find_patient_id_by_name("Luigi Verdi"))
+
+    def test_removed_and_invalid_files(self):
+        self.km.get_available_users()
+        (self.data_dir / "patients" / "p_01.json").unlink()
+        (self.data_dir / "patients" / "broken.json").write_text("{not json")
+        self.km.storage._indexes["patient"].refresh(force=True)
+        ids = [p["id"] for p in self.km.get_available_users()["patients"]]
+        self.assertEqual(ids, ["p_02"])
+        self.assertEqual(self.km._discover_first_id("patients"), "broken")
+
+
+if __name__ == "__main__":
+    unittest.main()
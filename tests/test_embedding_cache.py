@@ -0,0 +1,22 @@
+from src.embedding_cache import EmbeddingCache
+
+
+def test_roundtrip_and_keys(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite")
+    cache.put_many("m1", "text", ["[Always] Beve caffè", "ciao"], [[0.1, 0.2], [1.0, -1.5]])
+    assert cache.get_many("m1", "text", ["ciao", "nuovo", "ciao"]) == [[1.0, -1.5], None, [1.0, -1.5]]
+    assert cache.get_many("m2", "text", ["ciao"]) == [None]
+    assert cache.get_many("m1", "query", ["ciao"]) == [None]
+    assert (cache.hits, cache.misses) == (2, 3)
+    cache.close()
+    assert EmbeddingCache(tmp_path / "cache.sqlite").get_many("m1", "text", ["[Always] Beve caffè"]) == [[0.1, 0.2]]
+
+
+def test_lru_eviction(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", max_entries=10)
+    cache.put_many("m", "text", [f"t{i}" for i in range(10)], [[float(i)] for i in range(10)])
+    cache.get_many("m", "text", ["t0"])
+    cache.put_many("m", "text", ["t10"], [[10.0]])
+    assert len(cache) <= 10
+    assert cache.get_many("m", "text", ["t0", "t10"]) == [[0.0], [10.0]]
+    assert cache.get_many("m", "text", ["t1"]) == [None]
@@ -0,0 +1,58 @@
+import pytest
+
+from src.knowledge_manager import KnowledgeManager
+from src.models import Activity, Therapy
+from src.schedule_index import free_slots
+
+
+def _act(idx, name, days, time, duration=None):
+    return Activity(activity_id=f"a{idx}", name=name, description="-", day_of_week=days, time=time, duration_minutes=duration)
+
+
+@pytest.fixture
+def km():
+    km = KnowledgeManager()
+    km.current_patient_id = "p1"
+    km.therapy = Therapy(patient_id="p1", activities=[
+        _act(1, "Colazione", ["Lunedì", "Martedì"], "08:00", 30),
+        _act(2, "Pastiglia", ["Lunedì"], "08:30", 15),
+        _act(3, "Fisioterapia", ["Martedì"], "09:00-10:30"),
+        _act(4, "Pranzo", ["Lunedì", "Martedì"], "12:00", 60),
+    ])
+    return km
+
+
+def test_gap_scan():
+    busy = [(60, 120), (90, 150), (200, 210)]
+    assert free_slots(busy, 30, 0, 300) == [(0, 30), (150, 180), (210, 240)]
+    assert free_slots(busy, 60, 100, 250, limit=5) == []
+    assert free_slots([], 45, 600, 640) == []
+
+
+def test_earliest_slots_single_day(km):
+    slots = km.find_free_slot(30, ["Lunedì"], earliest="08:00", latest="13:00")
+    assert [(s.time, s.end_time) for s in slots] == [("08:45", "09:15")]
+    slots = km.find_free_slot(30, ["Lunedì"], earliest="08:00", latest="14:00")
+    assert [s.time for s in slots] == ["08:45", "13:00"]
+
+
+def test_slots_common_to_all_days(km):
+    slots = km.find_free_slot(60, ["monday", "Martedì"], earliest="08:00", latest="14:00")
+    assert [s.time for s in slots] == ["10:30", "13:00"]
+    for slot in slots:
+        probe = _act(9, "Nuova", ["Lunedì", "Martedì"], slot.time, 60)
+        assert km.check_temporal_conflict(probe) == []
+
+
+def test_after_dependency(km):
+    assert km.find_free_slot(15, ["Lunedì"], earliest="07:00", after_dependency="Pranzo")[0].time == "13:00"
+    assert km.find_free_slot(15, ["Lunedì"], after_dependency="Fisioterapia") == []
+    assert km.find_free_slot(15, []) == []
+
+
+def test_after_all_dependencies(km):
+    # Conta la dipendenza che inizia più tardi, non la prima della lista
+    slots = km.find_free_slot(15, ["Lunedì"], earliest="07:00", after_dependency=["Colazione", "Pranzo"])
+    assert slots[0].time == "13:00"
+    assert km.find_free_slot(15, ["Lunedì"], earliest="07:00", after_dependency=["Colazione"])[0].time == "08:45"
+    assert km.find_free_slot(15, ["Lunedì"], after_dependency=["Pranzo", "Fisioterapia"]) == []
@@ -0,0 +1,198 @@
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src import ingest_data
+from src.ingest_data import (
+    GUIDELINE_TYPE, HASH_KEY, _batched, _bounded, _profile_doc_id, changed_documents, changed_in_collection, context_filters, delete_ids, embed_and_insert, existing_hashes, iter_documents, profile_docs, vanished_ids,
+)
+
+
+class FakeCollection:
+    """collection.get (paginato o per id) e collection.delete, come in chromadb."""
+
+    def __init__(self, hashes):
+        self.hashes = dict(hashes)
+        self.pages = 0
+        self.lookups = []
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=0):
+        if ids is not None:
+            self.lookups.append(list(ids))
+            ids = [doc_id for doc_id in ids if doc_id in self.hashes]
+        else:
+            self.pages += 1
+            ids = sorted(self.hashes)[offset:offset + limit]
+        page = {"ids": ids}
+        if include:
+            page["metadatas"] = [{HASH_KEY: self.hashes[doc_id]} if self.hashes[doc_id] else {} for doc_id in ids]
+        return page
+
+    def delete(self, ids):
+        for doc_id in ids:
+            del self.hashes[doc_id]
+
+
+def _doc(doc_id, digest):
+    return SimpleNamespace(id_=doc_id, metadata={HASH_KEY: digest})
+
+
+def test_incremental_diff_counts(monkeypatch):
+    monkeypatch.setattr(ingest_data, "CHROMA_PAGE_SIZE", 2)
+    collection = FakeCollection({"same": "h1", "edited": "h2", "vanished": "h3", "chat-random-id": None})
+    existing = existing_hashes(collection)
+    assert collection.pages == 3 and existing["chat-random-id"] is None
+
+    counts = {}
+    docs = [_doc("same", "h1"), _doc("edited", "h2-bis"), _doc("new", "h4")]
+    changed = changed_documents(iter(docs), existing, counts)
+    assert [doc.id_ for doc in changed] == ["edited", "new"]
+    assert counts == {"nuovi": 1, "modificati": 1, "invariati": 1}
+    # Restano gli id spariti dai dati, compresi quelli senza hash inseriti dalla chat
+    assert sorted(existing) == ["chat-random-id", "vanished"]
+    delete_ids(collection, list(existing))
+    assert sorted(collection.hashes) == ["edited", "same"]
+
+
+def test_hashes_are_looked_up_per_window(monkeypatch):
+    monkeypatch.setattr(ingest_data, "CHROMA_PAGE_SIZE", 2)
+    collection = FakeCollection({"same": "h1", "edited": "h2", "vanished": "h3", "chat-random-id": None})
+    docs = [_doc("same", "h1"), _doc("edited", "h2-bis"), _doc("new", "h4")]
+    counts, seen = {}, set()
+
+    changed = changed_in_collection(iter(docs), collection, counts, seen, window=2)
+    assert next(changed).id_ == "edited"
+    # Finora letta solo la prima finestra, per id: nessuna scansione dell'intera collezione
+    assert collection.lookups == [["same", "edited"]] and collection.pages == 0
+    assert [doc.id_ for doc in changed] == ["new"]
+    assert collection.lookups == [["same", "edited"], ["new"]]
+    assert counts == {"nuovi": 1, "modificati": 1, "invariati": 1}
+
+    removed = vanished_ids(collection, seen)
+    assert sorted(removed) == ["chat-random-id", "vanished"] and collection.pages == 3
+    delete_ids(collection, removed)
+    assert sorted(collection.hashes) == ["edited", "same"]
+
+
+def test_profile_doc_ids_are_content_based_and_unique():
+    seen = {}
+    ids = [_profile_doc_id("patient", "p1", "habits", "Caffè", seen) for _ in range(3)]
+    assert ids[1:] == [f"{ids[0]}:2", f"{ids[0]}:3"]
+    # Stesso contenuto in un'altra esecuzione: stesso id; altra categoria o altro paziente: id diverso
+    assert _profile_doc_id("patient", "p1", "habits", "Caffè", {}) == ids[0]
+    assert _profile_doc_id("patient", "p1", "notes", "Caffè", {}) != ids[0]
+    assert _profile_doc_id("patient", "p2", "habits", "Caffè", {}) != ids[0]
+
+
+def test_ids_are_stable_across_runs(tmp_path, monkeypatch):
+    pytest.importorskip("llama_index.core")
+    monkeypatch.delenv("KMCHAT_STORAGE", raising=False)
+    for sub in ("patients", "caregivers", "therapies"):
+        (tmp_path / sub).mkdir()
+    (tmp_path / "patients" / "p1.json").write_text(json.dumps({"patient_id": "p1", "name": "Mario", "habits": ["Caffè", "Caffè"]}))
+    (tmp_path / "caregivers" / "c1.json").write_text(json.dumps({"caregiver_id": "c1", "semantic_preferences": ["Mattina"]}))
+    activities = [
+        {"activity_id": "a1", "name": "Colazione", "description": "-", "day_of_week": ["Lunedì"], "time": "08:00"},
+        {"activity_id": "a2", "name": "Pranzo", "description": "-", "day_of_week": ["Lunedì"], "time": "12:00"},
+    ]
+    therapy = tmp_path / "therapies" / "p1.json"
+    therapy.write_text(json.dumps({"patient_id": "p1", "activities": activities}))
+
+    first = {doc.id_: doc.metadata[HASH_KEY] for doc in iter_documents(tmp_path, workers=1)}
+    assert len(first) == 5
+    assert {doc.id_: doc.metadata[HASH_KEY] for doc in iter_documents(tmp_path, workers=2)} == first
+
+    activities[1]["time"] = "12:30"
+    therapy.write_text(json.dumps({"patient_id": "p1", "activities": activities}))
+    existing, counts = dict(first), {}
+    changed = list(changed_documents(iter_documents(tmp_path, workers=1), existing, counts))
+    assert [doc.id_ for doc in changed] == ["therapy:p1:a2"]
+    assert counts == {"nuovi": 0, "modificati": 1, "invariati": 4} and existing == {}
+
+
+def test_saved_note_gets_the_ingestion_id(tmp_path):
+    pytest.importorskip("llama_index.core")
+    data = {"patient_id": "p1", "habits": ["Caffè"], "notes": [{"content": "Dorme male", "day": "Lunedì"}]}
+    collection = FakeCollection({doc.id_: doc.metadata[HASH_KEY] for doc in profile_docs("patient", data, "p1")})
+
+    # Nota aggiunta dalla chat: solo il nuovo documento, con id e hash riconosciuti dalla prossima ingestion
+    data["notes"].append({"content": "Ansia la sera", "day": None})
+    changed = list(changed_in_collection(profile_docs("patient", data, "p1"), collection))
+    assert len(changed) == 1 and changed[0].text == "[Always] Ansia la sera"
+    assert changed[0].id_.startswith("patient:p1:notes:") and changed[0].metadata[HASH_KEY]
+    collection.hashes[changed[0].id_] = changed[0].metadata[HASH_KEY]
+    assert list(changed_in_collection(profile_docs("patient", data, "p1"), collection)) == []
+
+
+def test_bounded_keeps_at_most_window_items_in_flight():
+    in_flight, peak, pulled = [0], [0], []
+
+    class Future:
+        def __init__(self, item):
+            self.item = item
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+
+        def result(self):
+            in_flight[0] -= 1
+            return self.item * 10
+
+    def items():
+        for n in range(10):
+            pulled.append(n)
+            yield n
+
+    results = _bounded(Future, items(), window=3)
+    assert [next(results) for _ in range(2)] == [0, 10]
+    # Lo stadio a monte avanza solo quando si libera un posto: a valle non si accumula nulla
+    assert pulled == [0, 1, 2, 3]
+    assert list(results) == [n * 10 for n in range(2, 10)]
+    assert peak[0] == 3 and in_flight[0] == 0
+
+
+def test_batched():
+    assert list(_batched(iter(range(7)), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(_batched(iter(range(6)), 3)) == [[0, 1, 2], [3, 4, 5]]
+    assert list(_batched(iter([]), 3)) == []
+
+
+def test_embed_and_insert_keeps_order_and_counts(monkeypatch):
+    threads = set()
+
+    def fake_embed(batch):
+        threads.add(threading.get_ident())
+        for doc in batch:
+            doc.embedding = [float(doc.n)]
+        return batch, 10 * len(batch)
+
+    monkeypatch.setattr(ingest_data, "_embed_batch", fake_embed)
+    events = []
+    index = SimpleNamespace(insert_nodes=lambda batch: events.append(("insert", [doc.n for doc in batch])))
+    docs = (SimpleNamespace(n=n) for n in range(10))
+
+    stats = embed_and_insert(
+        index, docs, batch_size=4, concurrency=2,
+        before_insert=lambda batch: events.append(("before", [doc.n for doc in batch])),
+    )
+    assert (stats.documents, stats.tokens) == (10, 100)
+    # Blocchi inseriti nell'ordine di arrivo, ciascuno preceduto da before_insert, dal thread principale
+    assert events == [
+        ("before", [0, 1, 2, 3]), ("insert", [0, 1, 2, 3]),
+        ("before", [4, 5, 6, 7]), ("insert", [4, 5, 6, 7]),
+        ("before", [8, 9]), ("insert", [8, 9]),
+    ]
+    assert threading.get_ident() not in threads
+
+
+def test_context_filters_can_include_guidelines():
+    pytest.importorskip("llama_index.core")
+    pairs = lambda filters: [(f.key, f.value) for f in filters.filters]
+    assert pairs(context_filters("p1", None)) == [("patient_id", "p1")]
+    # Le linee guida entrano in OR con i documenti del contesto, anche senza contesto
+    assert pairs(context_filters("p1", "c1", include_guidelines=True)) == [
+        ("patient_id", "p1"), ("caregiver_id", "c1"), ("type", GUIDELINE_TYPE),
+    ]
+    assert pairs(context_filters(None, None, include_guidelines=True)) == [("type", GUIDELINE_TYPE)]
+    assert context_filters(None, None) is None
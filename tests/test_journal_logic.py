@@ -0,0 +1,153 @@
+import json
+import os
+import unittest
+from unittest.mock import patch
+
+import pytest
+
+from src import journal
+from src.knowledge_manager import KnowledgeManager
+from src.models import Activity
+
+
+@pytest.mark.usefixtures("data_dir")
+class TestJournalLogic(unittest.TestCase):
+    def setUp(self):
+        self.write_json("patients", "p1", {"patient_id": "p1", "name": "Mario"})
+        self.write_json("caregivers", "c1", {"caregiver_id": "c1", "name": "Andrea"})
+        self.therapy_file = self.write_json("therapies", "p1", {
+            "patient_id": "p1",
+            "activities": [{
+                "activity_id": "a1", "name": "Colazione", "description": "Colazione",
+                "day_of_week": ["Lunedì", "Martedì"], "time": "08:00", "dependencies": [],
+            }],
+        })
+        self.km = KnowledgeManager("p1", "c1")
+
+    def _activity(self, act_id, name, time):
+        return Activity(activity_id=act_id, name=name, description=name, day_of_week=["Lunedì"], time=time)
+
+    def _reload(self):
+        return KnowledgeManager("p1", "c1")
+
+    def test_mutations_append_to_journal_and_replay(self):
+        snapshot_before = self.therapy_file.read_bytes()
+        self.km.add_activity(self._activity("a2", "Pranzo", "12:00"))
+        self.km.update_activity("Pranzo", "Lunedì", {"time": "12:30"})
+        self.km.remove_activity("Colazione", "Martedì")
+
+        self.assertEqual(self.therapy_file.read_bytes(), snapshot_before)
+        lines = journal.journal_path(self.therapy_file).read_text().splitlines()
+        self.assertEqual([json.loads(l)["op"] for l in lines], ["base", "add", "update", "update"])
+
+        reloaded = self._reload()
+        acts = {a.name: a for a in reloaded.therapy.activities}
+        self.assertEqual(acts["Pranzo"].time, "12:30")
+        self.assertEqual(acts["Colazione"].day_of_week, ["Lunedì"])
+
+    def test_remove_and_rename_replay(self):
+        self.km.add_activity(self._activity("a2", "Pranzo", "12:00"))
+        self.km.update_activity("Pranzo", "Lunedì", {"name": "Pranzo leggero"})
+        self.km.remove_activity("Colazione", "Lunedì")
+        self.km.remove_activity("Colazione", "Martedì")
+        reloaded = self._reload()
+        self.assertEqual([a.name for a in reloaded.therapy.activities], ["Pranzo leggero"])
+
+    def test_compaction_threshold(self):
+        with patch.object(journal, "JOURNAL_COMPACT_THRESHOLD", 2):
+            self.km.add_activity(self._activity("a2", "Pranzo", "12:00"))
+            self.assertTrue(journal.journal_path(self.therapy_file).exists())
+            self.km.add_activity(self._activity("a3", "Cena", "19:00"))
+        self.assertFalse(journal.journal_path(self.therapy_file).exists())
+        data = json.loads(self.therapy_file.read_text())
+        self.assertEqual(len(data["activities"]), 3)
+
+    def test_stale_journal_is_ignored_after_snapshot_rewrite(self):
+        self.km.add_activity(self._activity("a2", "Pranzo", "12:00"))
+        stale = journal.journal_path(self.therapy_file).read_text()
+        self.km.compact()
+        # Simula un crash tra la riscrittura dello snapshot e la rimozione del journal
+        journal.journal_path(self.therapy_file).write_text(stale)
+        reloaded = self._reload()
+        self.assertEqual(len(reloaded.therapy.activities), 2)
+
+    def test_identical_rewrite_discards_journal(self):
+        # Reset come negli script di test: stesso contenuto riscritto sopra uno snapshot con journal
+        journal.write_snapshot(self.therapy_file, "[]")
+        km = self._reload()
+        km.add_activity(self._activity("a2", "Pranzo", "12:00"))
+        journal.write_snapshot(self.therapy_file, "[]")
+
+        reloaded = self._reload()
+        self.assertEqual(reloaded.therapy.activities, [])
+        # Il journal non allineato viene sostituito, non esteso
+        reloaded.add_activity(self._activity("a3", "Cena", "19:00"))
+        self.assertEqual([a.activity_id for a in self._reload().therapy.activities], ["a3"])
+        lines = journal.journal_path(self.therapy_file).read_text().splitlines()
+        self.assertEqual([json.loads(l)["op"] for l in lines], ["base", "add"])
+
+    def test_touch_or_copy_keeps_pending_operations(self):
+        self.km.add_activity(self._activity("a2", "Pranzo", "12:00"))
+        # Stesso contenuto con mtime diverso (touch, git checkout, copia senza -p)
+        content = self.therapy_file.read_bytes()
+        self.therapy_file.write_bytes(content)
+        os.utime(self.therapy_file, ns=(1, 1))
+        self.assertEqual([a.activity_id for a in self._reload().therapy.activities], ["a1", "a2"])
+
+    def test_replaced_snapshot_with_pending_journal_is_an_error(self):
+        self.km.add_activity(self._activity("a2", "Pranzo", "12:00"))
+        data = json.loads(self.therapy_file.read_text())
+        data["activities"][0]["time"] = "08:30"
+        self.therapy_file.write_text(json.dumps(data))
+        with self.assertRaises(journal.JournalMismatchError):
+            self._reload()
+        # Un journal di una generazione superata invece è ignorato
+        journal.write_snapshot(self.therapy_file, data)
+        self.assertEqual(self._reload().therapy.activities[0].time, "08:30")
+
+    def test_generation_is_stored_in_the_snapshot(self):
+        self.km.compact()
+        self.km.add_activity(self._activity("a2", "Pranzo", "12:00"))
+        self.km.compact()
+        raw = json.loads(self.therapy_file.read_text())
+        self.assertEqual(raw[journal.GENERATION_KEY], 1)
+        data, base = journal.read_snapshot(self.therapy_file)
+        self.assertNotIn(journal.GENERATION_KEY, data)
+        self.assertTrue(base.endswith("@1"))
+
+    def test_profile_notes_are_journaled(self):
+        self.km.save_knowledge_note("habits", "Beve caffè")
+        self.km.save_knowledge_note("caregiver", "Visita alle 18:00", day="Lunedì")
+        reloaded = self._reload()
+        self.assertEqual(reloaded.patient_profile.habits, ["Beve caffè"])
+        self.assertEqual(reloaded.caregiver_profile.notes[0].day, "Lunedì")
+
+    def test_load_data_skips_unchanged_files(self):
+        version = self.km.version
+        with patch.object(journal, "read_snapshot", wraps=journal.read_snapshot) as read:
+            self.km.load_data()
+            read.assert_not_called()
+        self.assertEqual(self.km.version, version)
+
+    def test_own_writes_do_not_trigger_reparse(self):
+        version = self.km.version
+        self.km.add_activity(self._activity("a2", "Pranzo", "12:00"))
+        self.assertGreater(self.km.version, version)
+        therapy = self.km.therapy
+        with patch.object(journal, "read_snapshot", wraps=journal.read_snapshot) as read:
+            self.km.load_data()
+            read.assert_not_called()
+        self.assertIs(self.km.therapy, therapy)
+
+    def test_external_change_is_reloaded(self):
+        version = self.km.version
+        data = json.loads(self.therapy_file.read_text())
+        data["activities"][0]["time"] = "08:15"
+        self.therapy_file.write_text(json.dumps(data, indent=2))
+        self.km.load_data()
+        self.assertEqual(self.km.therapy.activities[0].time, "08:15")
+        self.assertGreater(self.km.version, version)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,13 +2,13 @@ import unittest
 from unittest.mock import MagicMock, patch
 import json
 import os
-import tempfile
-from pathlib import Path
 
-from src import knowledge_manager as km_mod
+import pytest
+
 from src.knowledge_manager import KnowledgeManager
 from src.models import Activity, PatientProfile, CaregiverProfile, Note
 
+@pytest.mark.usefixtures("data_dir")
 class TestPDFScenarios(unittest.TestCase):
     def setUp(self):
         # Setup KnowledgeManager with test data
@@ -158,35 +158,24 @@ class TestPDFScenarios(unittest.TestCase):
         """
         Scenario: caregiver knowledge updates and semantic ambiguity.
         """
-        tmp = tempfile.TemporaryDirectory()
-        original_data_dir = km_mod.DATA_DIR
-        try:
-            data_dir = Path(tmp.name)
-            for sub in ("patients", "caregivers", "therapies"):
-                (data_dir / sub).mkdir(parents=True, exist_ok=True)
-            km_mod.DATA_DIR = data_dir
-
-            self.km.current_caregiver_id = "caregiver_test"
-            self.km.caregiver_profile = CaregiverProfile(
-                caregiver_id="caregiver_test",
-                name="Andrea",
-                notes=[],
-                semantic_preferences=[],
-            )
+        self.km.current_caregiver_id = "caregiver_test"
+        self.km.caregiver_profile = CaregiverProfile(
+            caregiver_id="caregiver_test",
+            name="Andrea",
+            notes=[],
+            semantic_preferences=[],
+        )
 
-            res1 = self.km.save_knowledge_note("caregiver", "Visita abituale alle 18:00")
-            res2 = self.km.save_knowledge_note("caregiver", "Oggi visita anticipata alle 14:00")
-            res3 = self.km.save_knowledge_note("caregiver", "Aulin = granulare")
-            res4 = self.km.save_knowledge_note("caregiver", "Aulin = supposta")
+        res1 = self.km.save_knowledge_note("caregiver", "Visita abituale alle 18:00")
+        res2 = self.km.save_knowledge_note("caregiver", "Oggi visita anticipata alle 14:00")
+        res3 = self.km.save_knowledge_note("caregiver", "Aulin = granulare")
+        res4 = self.km.save_knowledge_note("caregiver", "Aulin = supposta")
 
-            self.assertIn("Nota salvata", res1)
-            self.assertIn("Nota salvata", res2)
-            self.assertIn("Nota salvata", res3)
-            self.assertIn("Nota salvata", res4)
-            self.assertEqual(len(self.km.caregiver_profile.notes), 4)
-        finally:
-            km_mod.DATA_DIR = original_data_dir
-            tmp.cleanup()
+        self.assertIn("Nota salvata", res1)
+        self.assertIn("Nota salvata", res2)
+        self.assertIn("Nota salvata", res3)
+        self.assertIn("Nota salvata", res4)
+        self.assertEqual(len(self.km.caregiver_profile.notes), 4)
 
 if __name__ == '__main__':
     unittest.main()
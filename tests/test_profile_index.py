@@ -0,0 +1,39 @@
+import pytest
+
+from src.knowledge_manager import KnowledgeManager
+from src.models import CaregiverProfile, Note, PatientProfile
+
+
+@pytest.fixture
+def km():
+    km = KnowledgeManager()
+    km.current_patient_id, km.current_caregiver_id = "p1", "c1"
+    km.patient_profile = PatientProfile(patient_id="p1", name="Mario", habits=["Beve caffè dopo pranzo"])
+    km.caregiver_profile = CaregiverProfile(caregiver_id="c1", name="Andrea", notes=[Note(content="Visita alle 18:00", day="Lunedì")])
+    km.writes = []
+    km._record_ops = lambda kind, key, model, ops: km.writes.append((kind, ops))
+    return km
+
+
+def test_exact_and_near_duplicates(km):
+    assert km.save_knowledge_note("habits", "Beve caffè dopo pranzo") == "Abitudine già presente."
+    assert "simile a 'Beve caffè dopo pranzo'" in km.save_knowledge_note("habits", "beve  caffe dopo pranzo")
+    assert km.save_knowledge_note("habits", "Legge il giornale") == "Abitudine salvata."
+    assert km.save_knowledge_note("habits", "legge il GIORNALE").startswith("Abitudine già presente")
+    assert km.patient_profile.habits == ["Beve caffè dopo pranzo", "Legge il giornale"]
+    assert len(km.writes) == 1
+
+
+def test_notes_dedup_by_day(km):
+    assert "già presente" in km.save_knowledge_note("caregiver", "visita alle 18:00", day="Lunedì")
+    assert km.save_knowledge_note("caregiver", "Visita alle 18:00", day="Martedì").startswith("Nota salvata")
+    assert km.save_knowledge_note("caregiver", "Visita alle 18:00").startswith("Nota salvata")
+    assert "già presente" in km.save_knowledge_note("caregiver", "VISITA alle 18:00")
+
+
+def test_index_follows_external_changes(km):
+    km.save_knowledge_note("preferences", "Riposino alle 15:00")
+    km.patient_profile.preferences.append("Cena presto")
+    assert "già presente" in km.save_knowledge_note("preferences", "cena presto")
+    km.patient_profile = PatientProfile(patient_id="p1", name="Mario")
+    assert km.save_knowledge_note("preferences", "Cena presto") == "Preferenza salvata."
@@ -0,0 +1,104 @@
+import pytest
+
+from src.knowledge_manager import TherapyChange
+from src.rag_sync import RagSync, mark_stale, read_stale
+
+
+class FakeCollection:
+    """Sottoinsieme di chromadb.Collection usato da rag_sync: get con filtro $and e delete per id."""
+
+    def __init__(self, metadatas=None):
+        self.metadatas = dict(metadatas or {})
+        self.fail = False
+
+    def get(self, where=None, include=None, limit=None, offset=0):
+        conditions = where["$and"] if where else []
+        ids = [
+            doc_id for doc_id, meta in self.metadatas.items()
+            if all(meta.get(key) == value for cond in conditions for key, value in cond.items())
+        ][offset:offset + limit]
+        return {"ids": ids, "metadatas": [self.metadatas[doc_id] for doc_id in ids]}
+
+    def delete(self, ids):
+        if self.fail:
+            raise ConnectionError("chroma non raggiungibile")
+        for doc_id in ids:
+            self.metadatas.pop(doc_id, None)
+
+
+class FakeIndex:
+    def __init__(self, collection):
+        self.collection = collection
+        self.inserted = []
+
+    def insert_nodes(self, docs):
+        ids = [doc.id_ for doc in docs]
+        # Come Chroma: id ripetuti nella stessa chiamata sono un errore
+        assert len(ids) == len(set(ids)), ids
+        self.inserted.append(ids)
+        for doc in docs:
+            self.collection.metadatas[doc.id_] = doc.metadata
+
+
+def _activity(activity_id, name, days=("Lunedì",)):
+    return {"activity_id": activity_id, "name": name, "description": name, "day_of_week": list(days), "time": "08:00"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    collection = FakeCollection({
+        "therapy:p1:old": {"patient_id": "p1", "type": "therapy_activity"},
+        "therapy:p2:x": {"patient_id": "p2", "type": "therapy_activity"},
+        "patient:p1:notes:abc": {"patient_id": "p1", "type": "patient_note"},
+    })
+    index = FakeIndex(collection)
+    therapies = {"p1": {"patient_id": "p1", "activities": []}}
+    sync = RagSync(lambda: index, lambda: collection, therapies.get, stale_path=tmp_path / "rag_stale.json")
+    return sync, collection, index, therapies
+
+
+def test_failed_write_is_persisted_and_reconciled_later(store, tmp_path):
+    sync, collection, index, therapies = store
+    collection.fail = True
+    sync(TherapyChange("p1", [], ["old"]))
+    assert sync.stale == {"p1"} and read_stale(tmp_path / "rag_stale.json") == {"p1"}
+
+    # Dopo un riavvio il segno viene riletto dal file e la riconciliazione rimuove gli orfani del paziente
+    collection.fail = False
+    restarted = RagSync(lambda: index, lambda: collection, therapies.get, stale_path=tmp_path / "rag_stale.json")
+    restarted.reconcile_stale(["p1"])
+    assert sorted(collection.metadatas) == ["patient:p1:notes:abc", "therapy:p2:x"]
+    assert restarted.stale == set() and read_stale(tmp_path / "rag_stale.json") == set()
+
+
+def test_external_writers_mark_stale(store, tmp_path):
+    sync, collection, _, _ = store
+    mark_stale(tmp_path / "rag_stale.json", ["p1"])
+    sync.reconcile_stale()
+    assert "therapy:p1:old" not in collection.metadatas
+    assert read_stale(tmp_path / "rag_stale.json") == set()
+
+
+def test_apply_upserts_and_deletes(store):
+    pytest.importorskip("llama_index.core")
+    sync, collection, index, _ = store
+    sync(TherapyChange("p1", [_activity("a1", "Colazione")], ["old"]))
+    assert index.inserted == [["therapy:p1:a1"]]
+    assert "therapy:p1:old" not in collection.metadatas
+    first_hash = collection.metadatas["therapy:p1:a1"]["content_hash"]
+    # Rimozione di un giorno: stesso id, vettore ricalcolato
+    sync(TherapyChange("p1", [_activity("a1", "Colazione", ("Martedì",))], []))
+    assert index.inserted[-1] == ["therapy:p1:a1"]
+    assert collection.metadatas["therapy:p1:a1"]["content_hash"] != first_hash
+
+
+def test_reconcile_with_duplicate_ids(store):
+    pytest.importorskip("llama_index.core")
+    sync, collection, index, therapies = store
+    therapies["p1"]["activities"] = [_activity("a1", "Colazione"), _activity("a1", "Pranzo")]
+    counts = sync.reconcile("p1")
+    assert counts == {"aggiornati": 2, "rimossi": 1}
+    assert index.inserted == [["therapy:p1:a1", "therapy:p1:a1#1"]]
+    # Seconda riconciliazione: nulla da ricalcolare
+    assert sync.reconcile("p1") == {"aggiornati": 0, "rimossi": 0}
+    assert sync.stale == set()
@@ -0,0 +1,173 @@
+import random
+from datetime import date, datetime
+
+import pytest
+
+from src.knowledge_manager import KnowledgeManager
+from src.models import Activity, Therapy
+from src.schedule_index import IndexedActivity, _DayIntervals, time_interval
+
+DAYS = ["Lunedì", "Martedì", "Mercoledì"]
+
+
+def _activity(idx, rng):
+    start = rng.randrange(0, 23 * 60)
+    if rng.random() < 0.3:
+        end = start + rng.randint(5, 120)
+        time_str = f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+        duration = None
+    else:
+        time_str = f"{start // 60:02d}:{start % 60:02d}"
+        duration = rng.choice([None, 10, 45, 90])
+    return Activity(
+        activity_id=f"a{idx}", name=f"Att {idx}", description="-",
+        day_of_week=rng.sample(DAYS, rng.randint(1, 2)), time=time_str, duration_minutes=duration,
+    )
+
+
+def _brute_force(km, new_act):
+    start, end = time_interval(new_act.time, new_act.duration_minutes)
+    names = []
+    for act in km.therapy.activities:
+        if set(act.day_of_week) & set(new_act.day_of_week):
+            ex_start, ex_end = time_interval(act.time, act.duration_minutes)
+            if start < ex_end and end > ex_start:
+                names.append(act.name)
+    return sorted(names)
+
+
+def _indexed(km, new_act):
+    return sorted(c.split("'")[1] for c in km.check_temporal_conflict(new_act))
+
+
+@pytest.fixture
+def km_random():
+    rng = random.Random(7)
+    km = KnowledgeManager()
+    km.therapy = Therapy(patient_id="test", activities=[_activity(i, rng) for i in range(150)])
+    return km, rng
+
+
+def test_index_matches_linear_scan(km_random):
+    km, rng = km_random
+    for i in range(100):
+        probe = _activity(1000 + i, rng)
+        assert _indexed(km, probe) == _brute_force(km, probe)
+
+
+def test_index_follows_mutations(km_random, monkeypatch):
+    km, rng = km_random
+    # Le modifiche passano dai metodi del manager: niente scrittura su disco nel test
+    monkeypatch.setattr(km, "_record_therapy_ops", lambda ops: None)
+    km.check_temporal_conflict(_activity(999, rng))
+    index = km._index
+
+    km.add_activity(_activity(500, rng), force=True)
+    km.update_activity("Att 3", km.therapy.activities[3].day_of_week[0], {"time": "06:00", "duration_minutes": 240}, force=True)
+    km.remove_activity("Att 4", km.therapy.activities[4].day_of_week[0], force=True)
+    act = km.therapy.activities[10]
+    km.remove_activity(act.name, act.day_of_week[0], force=True)
+
+    for i in range(100):
+        probe = _activity(2000 + i, rng)
+        assert _indexed(km, probe) == _brute_force(km, probe)
+    # Nessuna ricostruzione completa: l'indice è stato aggiornato in place
+    assert km._index is index
+
+
+def test_external_append_rebuilds_index(km_random):
+    km, rng = km_random
+    km.check_temporal_conflict(_activity(999, rng))
+    blocker = Activity(activity_id="x", name="Blocco", description="-", day_of_week=["Giovedì"], time="10:00-11:00")
+    km.therapy.activities.append(blocker)
+    probe = Activity(activity_id="y", name="Nuova", description="-", day_of_week=["Giovedì"], time="10:30")
+    assert _indexed(km, probe) == ["Blocco"]
+
+
+def test_name_day_lookup_follows_rename_and_day_removal(monkeypatch):
+    km = KnowledgeManager()
+    km.therapy = Therapy(patient_id="test", activities=[
+        Activity(activity_id="1", name="Colazione", description="-", day_of_week=["Lunedì", "Martedì"], time="08:00"),
+        Activity(activity_id="2", name="Colazione", description="-", day_of_week=["Martedì"], time="09:00"),
+    ])
+    monkeypatch.setattr(km, "_record_therapy_ops", lambda ops: None)
+
+    assert km.get_activity_by_name_day("Colazione", " Martedì ").activity_id == "1"
+    km.remove_activity("Colazione", "Martedì", force=True)
+    assert km.get_activity_by_name_day("Colazione", "Martedì").activity_id == "2"
+
+    km.update_activity("Colazione", "Lunedì", {"name": "Colazione leggera"}, force=True)
+    assert km.get_activity_by_name_day("Colazione", "Lunedì") is None
+    assert km.get_activity_by_name_day("Colazione leggera", "Lunedì").activity_id == "1"
+    assert [item.activity.activity_id for item in km._schedule_index().by_name("Colazione")] == ["2"]
+
+
+def test_iter_occurrences_is_chronological_and_honors_validity():
+    km = KnowledgeManager()
+    km.therapy = Therapy(patient_id="test", activities=[
+        Activity(activity_id="1", name="Cena", description="-", day_of_week=["Lunedì", "Monday"], time="19:00"),
+        Activity(activity_id="2", name="Colazione", description="-", day_of_week=["Lunedì", "Martedì"], time="08:00-08:20"),
+        Activity(activity_id="3", name="Ciclo", description="-", day_of_week=["Martedì"], time="07:00",
+                 valid_from="2025-01-14", valid_until="2025-01-21"),
+    ])
+    occurrences = km.iter_occurrences("2025-01-06", date(2025, 1, 21))
+    first = next(occurrences)
+    assert (first.date, first.start, first.end, first.activity.name) == (
+        date(2025, 1, 6), datetime(2025, 1, 6, 8, 0), datetime(2025, 1, 6, 8, 20), "Colazione",
+    )
+    rest = list(occurrences)
+    starts = [o.start for o in [first, *rest]]
+    assert starts == sorted(starts)
+    assert [o.activity.name for o in rest if o.date == date(2025, 1, 6)] == ["Cena"]
+    assert [o.date for o in rest if o.activity.name == "Ciclo"] == [date(2025, 1, 14), date(2025, 1, 21)]
+    assert len(rest) + 1 == 3 * 2 + 3 * 1 + 2
+
+
+def test_week_view_is_a_sorted_read_only_snapshot(monkeypatch):
+    km = KnowledgeManager()
+    km.therapy = Therapy(patient_id="test", activities=[
+        Activity(activity_id="1", name="Cena", description="-", day_of_week=["Lunedì"], time="19:00"),
+        Activity(activity_id="2", name="Colazione", description="-", day_of_week=["Lunedì", "Martedì"], time="08:00"),
+    ])
+    monkeypatch.setattr(km, "_record_therapy_ops", lambda ops: None)
+    week = km.get_week_schedule()
+    key = km.week_schedule_key
+    assert [a.name for a in week["Lunedì"]] == ["Colazione", "Cena"]
+    assert km.get_week_schedule() is week and km.week_schedule_key == key
+    with pytest.raises(TypeError):
+        week["Lunedì"] = ()
+
+    builds = []
+    text = lambda w: builds.append(1) or ",".join(a.name for a in w["Lunedì"])
+    assert km.week_view("text", text) == km.week_view("text", text) == "Colazione,Cena" and len(builds) == 1
+
+    km.add_activity(Activity(activity_id="3", name="Pranzo", description="-", day_of_week=["Lunedì"], time="12:00"))
+    km.update_activity("Cena", "Lunedì", {"time": "07:00"}, force=True)
+    km.remove_activity("Colazione", "Martedì")
+    assert km.week_schedule_key != key
+    # La copia precedente non cambia; la nuova riflette le modifiche
+    assert [a.name for a in week["Lunedì"]] == ["Colazione", "Cena"] and len(week["Martedì"]) == 1
+    current = km.get_week_schedule()
+    assert [a.name for a in current["Lunedì"]] == ["Cena", "Colazione", "Pranzo"]
+    assert current["Martedì"] == ()
+    assert km.week_view("text", text) == "Cena,Colazione,Pranzo" and len(builds) == 2
+
+
+def test_day_intervals_window_shrinks_after_removal():
+    day = _DayIntervals()
+    items = [
+        IndexedActivity(Activity(activity_id=f"a{n}", name=f"A{n}", description="-", day_of_week=["Lunedì"], time=time), n)
+        for n, time in enumerate(["00:00-12:00", "09:00-09:30", "10:00-10:30", "10:15-10:45"])
+    ]
+    for item in items:
+        day.insert(item)
+    assert day.max_length == 720
+    day.remove(items[0])
+    # Tolta l'attività lunga la finestra torna alla durata massima rimasta
+    assert day.max_length == 30
+    assert [item.name for item in day.overlapping(10 * 60 + 20, 10 * 60 + 25)] == ["A2", "A3"]
+    day.remove(items[2])
+    assert day.max_length == 30
+    for item in items[1:]:
+        day.remove(item)
+    assert day.max_length == 0 and not day.lengths
@@ -1,9 +1,13 @@
 import unittest
+from datetime import date
+
+import pytest
 
 from src.knowledge_manager import KnowledgeManager
 from src.models import Activity, Therapy
 
 
+@pytest.mark.usefixtures("data_dir")
 class TestScheduleLogic(unittest.TestCase):
     def setUp(self):
         self.km = KnowledgeManager()
@@ -75,6 +79,21 @@ class TestScheduleLogic(unittest.TestCase):
         names_outside = sorted([act.name for act in outside])
         self.assertNotIn("Terapia temporanea", names_outside)
 
+    def test_get_activities_between(self):
+        # 2024-12-30 e 2025-01-06 sono lunedì; la terapia temporanea vale dal 1 al 3 gennaio
+        schedule = self.km.get_activities_between("2024-12-30", date(2025, 1, 6))
+        self.assertEqual(len(schedule), 8)
+        self.assertNotIn("Terapia temporanea", [a.name for a in schedule[date(2024, 12, 30)]])
+        self.assertIn("Controllo pressione", [a.name for a in schedule[date(2025, 1, 1)]])
+        self.assertEqual(schedule[date(2025, 1, 2)], [])
+        self.assertEqual(self.km.get_activities_between("2025-01-06", "2025-01-01"), {})
+
+    def test_validity_follows_update(self):
+        self.km._record_therapy_ops = lambda ops: None
+        self.km.update_activity("Terapia temporanea", "Lunedì", {"valid_until": "2025-01-10"})
+        names = [a.name for a in self.km.get_activities_by_day("Lunedì", date_str="2025-01-06")]
+        self.assertIn("Terapia temporanea", names)
+
 
 if __name__ == "__main__":
     unittest.main()
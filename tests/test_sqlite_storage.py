@@ -0,0 +1,123 @@
+import json
+import os
+import sqlite3
+import threading
+import unittest
+from unittest import mock
+
+import pytest
+
+from src import journal
+from src.audit import run_audit
+from src.bulk_import import run_import
+from src.knowledge_manager import KnowledgeManager
+from src.models import Activity
+from src.sqlite_storage import SqliteStorage, main as sqlite_main
+
+
+@pytest.mark.usefixtures("data_dir")
+class TestSqliteStorage(unittest.TestCase):
+    def setUp(self):
+        self.write_json("patients", "p1", {"patient_id": "p1", "name": "Mario Rossi"})
+        self.write_json("patients", "p2", {"patient_id": "p2", "name": "Luigi Verdi"})
+        self.write_json("caregivers", "c1", {"caregiver_id": "c1", "name": "Andrea"})
+        self.write_json("therapies", "p1", {"patient_id": "p1", "activities": [
+            {"activity_id": "a1", "name": "Colazione", "description": "-", "day_of_week": ["Lunedì", "Martedì"], "time": "08:00"},
+        ]})
+        # Formato legacy (lista) con un'operazione ancora nel journal
+        therapy_p2 = self.write_json("therapies", "p2", [
+            {"activity_id": "b1", "name": "Colazione", "description": "-", "day_of_week": ["Martedì"], "time": "07:30"},
+        ])
+        _, digest = journal.read_snapshot(therapy_p2)
+        journal.append_ops(therapy_p2, [{"op": "add", "activity": {
+            "activity_id": "b2", "name": "Pranzo", "description": "-", "day_of_week": ["Lunedì"], "time": "12:00",
+        }}], digest)
+
+        self.db_path = self.data_dir.parent / "km.sqlite3"
+        sqlite_main(["migrate", "--data-dir", str(self.data_dir), "--db", str(self.db_path)])
+        self.storage = SqliteStorage(self.db_path)
+        self.addCleanup(self.storage.close)
+        self.km = KnowledgeManager("p1", "c1", storage=self.storage)
+
+    def _activity(self, act_id, name, time, days=("Lunedì",)):
+        return Activity(activity_id=act_id, name=name, description=name, day_of_week=list(days), time=time)
+
+    def _reload(self):
+        storage = SqliteStorage(self.db_path)
+        self.addCleanup(storage.close)
+        return KnowledgeManager("p1", "c1", storage=storage)
+
+    def test_migration_and_directory_queries(self):
+        self.assertEqual(self.km.patient_profile.name, "Mario Rossi")
+        self.assertEqual([a.name for a in self.km.therapy.activities], ["Colazione"])
+        self.assertEqual(self.km.find_patient_id_by_name(" luigi VERDI "), "p2")
+        self.assertEqual([p["id"] for p in self.km.get_available_users()["patients"]], ["p1", "p2"])
+        self.assertTrue(self.km.caregiver_exists("c1"))
+        self.assertFalse(self.km.patient_exists("p9"))
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_mutations_are_persisted(self):
+        self.km.add_activity(self._activity("a2", "Pranzo", "12:00"))
+        self.km.update_activity("Pranzo", "Lunedì", {"time": "12:30", "day_of_week": ["Lunedì", "Giovedì"]})
+        self.km.remove_activity("Colazione", "Martedì")
+        self.km.save_knowledge_note("habits", "Beve caffè")
+
+        reloaded = self._reload()
+        acts = {a.name: a for a in reloaded.therapy.activities}
+        self.assertEqual(list(acts), ["Colazione", "Pranzo"])
+        self.assertEqual(acts["Pranzo"].time, "12:30")
+        self.assertEqual(acts["Colazione"].day_of_week, ["Lunedì"])
+        self.assertEqual(reloaded.patient_profile.habits, ["Beve caffè"])
+        # L'indice per giorno segue le modifiche
+        self.assertEqual([a.name for _, a in self.storage.query_activities(day="Giovedì")], ["Pranzo"])
+        self.assertEqual(self.storage.query_activities(name="Colazione", day="Martedì")[0][0], "p2")
+
+    def test_cross_patient_query(self):
+        found = self.storage.query_activities(name="Colazione")
+        self.assertEqual([(pid, a.activity_id) for pid, a in found], [("p1", "a1"), ("p2", "b1")])
+        # Il journal non ancora compattato è stato incluso nella migrazione
+        self.assertEqual([pid for pid, _ in self.storage.query_activities(name="Pranzo")], ["p2"])
+
+    def test_load_skips_unchanged_rows_and_sees_other_writers(self):
+        therapy = self.km.therapy
+        version = self.km.version
+        self.km.load_data()
+        self.assertIs(self.km.therapy, therapy)
+        self.assertEqual(self.km.version, version)
+
+        other = self._reload()
+        other.add_activity(self._activity("a3", "Cena", "19:00"))
+        self.km.load_data()
+        self.assertEqual([a.name for a in self.km.therapy.activities], ["Colazione", "Cena"])
+        self.assertGreater(self.km.version, version)
+
+    def test_reads_do_not_wait_for_the_writer(self):
+        results = []
+        reader = threading.Thread(target=lambda: results.append(
+            (self.storage.read("therapy", "p1")["activities"][0]["name"], self.storage.list_ids("patient"))
+        ))
+        # Lo scrittore tiene il lock: la lettura usa la connessione del proprio thread
+        with self.storage._lock:
+            reader.start()
+            reader.join(timeout=5)
+        self.assertEqual(results, [("Colazione", ["p1", "p2"])])
+
+    def test_batch_tools_use_the_configured_storage(self):
+        env = {"KMCHAT_STORAGE": "sqlite", "KMCHAT_SQLITE_PATH": str(self.db_path)}
+        self.km.add_activity(self._activity("a2", "Caffè", "08:00"), force=True)
+        source = self.data_dir.parent / "source"
+        (source / "patients").mkdir(parents=True)
+        (source / "patients" / "p5.json").write_text(json.dumps({"patient_id": "p5", "name": "Anna"}))
+        with mock.patch.dict(os.environ, env):
+            for workers in (1, 2):
+                report = run_audit(self.data_dir, workers=workers)
+                self.assertEqual([p["patient_id"] for p in report["patients"]], ["p1"])
+            run_import(source, self.data_dir, workers=1)
+        # Modifiche e importazioni finiscono nel database, non nell'albero JSON
+        self.assertEqual(self.storage.find_id_by_name("patient", "anna"), "p5")
+        self.assertFalse((self.data_dir / "patients" / "p5.json").exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
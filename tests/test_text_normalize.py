@@ -0,0 +1,11 @@
+from src.text_normalize import fold_text, normalize_name
+
+
+def test_fold_text():
+    assert fold_text("  Beve  CAFFÈ\tdopo pranzo ") == "beve caffe dopo pranzo"
+    assert fold_text(None) == ""
+
+
+def test_normalize_name():
+    assert normalize_name("  Mario ROSSI ") == "mario rossi"
+    assert normalize_name(None) == ""
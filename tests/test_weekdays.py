@@ -0,0 +1,38 @@
+from src.knowledge_manager import KnowledgeManager
+from src.models import Activity, Therapy
+from src.weekdays import ALL_DAYS, WeekdayMask, day_key, normalize_day
+
+
+def test_mask_parsing():
+    mask = WeekdayMask.of(["Lunedì", "MONDAY", "mercoledi", "Sun.", "boh"])
+    assert mask == 0b1000101
+    assert mask.names() == ["Lunedì", "Mercoledì", "Domenica"]
+    assert "Wednesday" in mask and "Martedì" not in mask
+    assert isinstance(mask & ALL_DAYS, WeekdayMask)
+    assert not mask & WeekdayMask.of(["Tuesday"])
+
+
+def test_normalize_day():
+    assert normalize_day(" MERCOLEDI ") == "Mercoledì"
+    assert normalize_day("thu") == "Giovedì"
+    assert normalize_day("Venerdí") == "Venerdì"
+    assert normalize_day("Festivo") is None
+
+
+def test_day_key():
+    assert day_key(" giovedi ") == "Giovedì"
+    assert day_key(" Festivi ") == "Festivi"
+
+
+def test_cross_language_conflicts_and_removal():
+    km = KnowledgeManager()
+    km.current_patient_id = "p1"
+    km.therapy = Therapy(patient_id="p1", activities=[
+        Activity(activity_id="a1", name="Colazione", description="-", day_of_week=["Monday", "Friday"], time="08:00"),
+    ])
+    km._record_therapy_ops = lambda ops: None
+    clash = Activity(activity_id="a2", name="Visita", description="-", day_of_week=["lunedì"], time="08:15")
+    assert km.check_temporal_conflict(clash) == ["Conflitto temporale con 'Colazione' (08:00) nei giorni {'Lunedì'}"]
+    assert km.remove_activity("Colazione", "Lunedì") == "Attività 'Colazione' rimossa dal giorno Lunedì."
+    assert km.therapy.activities[0].day_of_week == ["Friday"]
+    assert km.get_activities_by_day("venerdi")[0].name == "Colazione"